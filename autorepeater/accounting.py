@@ -0,0 +1,109 @@
+"""Accounting of api calls made by every sync"""
+import contextlib
+import threading
+import time
+
+# Заявки не блокируются бюджетом, что бы не оставить счёт наполовину
+# синхронизированным
+UNLIMITED_SERVICES = ('orders',)
+
+
+class CallBudgetExceeded(Exception):
+    """sync would exceed api calls budget"""
+
+
+class SyncCalls:
+    """api calls made by one sync"""
+
+    def __init__(self, sync_id):
+        self.sync_id = sync_id
+        self.counts = {}
+        self.seconds = {}
+        self.start_time = time.monotonic()
+
+    @property
+    def total(self):
+        """total number of calls"""
+        return sum(self.counts.values())
+
+    def record(self, method, duration):
+        """record finished call"""
+        self.counts[method] = self.counts.get(method, 0) + 1
+        self.seconds[method] = self.seconds.get(method, 0.0) + duration
+
+    def summary(self, end_time=None):
+        """compact one line summary, time is measured until end_time"""
+        calls = ' '.join(f'{method}={count}/{self.seconds[method]:.3f}s'
+                         for method, count in sorted(self.counts.items()))
+        end_time = end_time or time.monotonic()
+        return (f'sync {self.sync_id} calls: {calls} total={self.total} '
+                f'time={end_time - self.start_time:.3f}s')
+
+
+class ServiceProxy:  # pylint: disable=R0903
+    """proxy for client service counting and timing calls"""
+
+    def __init__(self, service, service_name, accounting):
+        self._service = service
+        self._service_name = service_name
+        self._accounting = accounting
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not callable(attr):
+            return attr
+        method = f'{self._service_name}.{name}'
+
+        def counted(*args, **kwargs):
+            self._accounting.check_budget(method)
+            start = time.monotonic()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._accounting.record(method, time.monotonic() - start)
+        return counted
+
+
+class CountingClient:
+    """proxy for Client attributing every api call to the current sync"""
+
+    def __init__(self, client, budget=None):
+        self.client = client
+        self.budget = budget
+        self.totals = SyncCalls(None)
+        self.current = None
+        self.lock = threading.Lock()
+        self.services = {}
+
+    def __getattr__(self, name):
+        if name not in self.services:
+            self.services[name] = ServiceProxy(
+                getattr(self.client, name), name, self)
+        return self.services[name]
+
+    def check_budget(self, method):
+        """raise if call would exceed budget of the current sync"""
+        if (self.budget is None or self.current is None or
+                method.split('.')[0] in UNLIMITED_SERVICES):
+            return
+        with self.lock:
+            if self.current.total + 1 > self.budget:
+                raise CallBudgetExceeded(
+                    f'sync {self.current.sync_id} exceeds budget of '
+                    f'{self.budget} api calls on {method}')
+
+    def record(self, method, duration):
+        """record finished call"""
+        with self.lock:
+            self.totals.record(method, duration)
+            if self.current is not None:
+                self.current.record(method, duration)
+
+    @contextlib.contextmanager
+    def sync_scope(self, sync_id):
+        """attribute calls inside scope to sync"""
+        self.current = SyncCalls(sync_id)
+        try:
+            yield self.current
+        finally:
+            self.current = None
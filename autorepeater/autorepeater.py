@@ -1,19 +1,40 @@
 """A robot for automatically repeating operations of one account over another account"""
+import contextlib
 import dataclasses
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from decimal import Decimal, getcontext
 
-from tinkoff.invest import Client
-from tinkoff.invest.constants import INVEST_GRPC_API
 from tinkoff.invest import InstrumentIdType
 from tinkoff.invest import OrderDirection
 from tinkoff.invest import OrderType
 from tinkoff.invest import SecurityTradingStatus
 from tinkoff.invest import RequestError
+from tinkoff.invest.utils import decimal_to_quotation
+
+from autorepeater.accounting import CallBudgetExceeded
+from autorepeater.accounting import CountingClient
+from autorepeater.cancellation import SyncCancelled
+from autorepeater.cancellation import SyncContext
+from autorepeater.cancellation import SyncWorker
+from autorepeater.execution import OrderExecution
+from autorepeater.fx import FxRateUnavailable
+from autorepeater.fx import FxRates
+from autorepeater.fx import is_repeated
+from autorepeater.fx import price_rate
+from autorepeater.instruments import InstrumentCache
+from autorepeater.logs import LazyString
+from autorepeater.metrics import SyncMetrics
+from autorepeater.slicing import SliceScheduler
 
 DST_MONEY_RESERVED = '0.01'
 THRESHOLD = '0.004'
 IMPORTANT = 25
+# Предел одновременных запросов пула портфелей и инструментов, пулы не
+# вкладываются друг в друга
+PORTFOLIO_WORKERS = 8
 
 # Устанавливаем точность для Decimal
 getcontext().prec = 28
@@ -96,12 +117,58 @@ def currency_to_string(position):
     return result
 
 
+def position_value(position, rates=None):
+    """position full price in base currency by rates of currencies"""
+    value = currency_to_decimal(position)
+    if rates:
+        value *= rates[position.current_price.currency.lower()]
+    return value
+
+
+def value_positions(positions, rates, fx=None):
+    """repeated positions by uid, their value and value of all positions"""
+    repeated = {}
+    total_repeated = Decimal('0')
+    total = Decimal('0')
+    for position in positions:
+        value = position_value(position, rates)
+        total += value
+        if is_repeated(position, fx):
+            repeated[position.instrument_uid] = position
+            total_repeated += value
+    return (repeated, total_repeated, total)
+
+
 def get_quantity_position(position):
     """get quantity from position as Decimal"""
     return (Decimal(position.quantity.units) +
             Decimal(position.quantity.nano) / Decimal('1000000000'))
 
 
+def get_holdings(positions):
+    """get quantities of positions by instrument uid as strings"""
+    return {position.instrument_uid:
+            format_decimal(get_quantity_position(position))
+            for position in positions
+            if position.instrument_type != 'currency'}
+
+
+def security_uids(positions):
+    """uids of share and etf positions"""
+    return [position.instrument_uid for position in positions
+            if position.instrument_type in ['share', 'etf']]
+
+
+def changed_instruments(position, src_account):
+    """uids of securities named by src account event, None if unknown"""
+    if position is None or position.account_id != src_account:
+        return None
+    changed = {security.instrument_uid for security in position.securities}
+    if not changed or '' in changed:
+        return None
+    return changed
+
+
 def check_triggers(position, src_account, dst_account):
     """check triggers for sync accounts"""
     # Проверяем, что все ценные бумаги разблокированы
@@ -132,34 +199,100 @@ class OrderParams:
     quantity: int
     direction: OrderDirection
     order_type: OrderType
+    price: Decimal = None
 
 
 def get_max_sum_positions_price(sell_orders_params, buy_orders_params,
-                                src_positions, dst_positions):
-    """get max sum orders price for buy or sell orders"""
+                                src_positions, dst_positions, rates=None):
+    """get max sum orders price for buy or sell orders
+
+    prices are converted to base currency if rates are given
+    """
     total_sell = 0
     for order_params in sell_orders_params:
         position = dst_positions[order_params.instrument_id]
         total_sell += (currency_to_decimal_price(position) *
-                       order_params.quantity)
+                       price_rate(position, rates) * order_params.quantity)
 
     total_buy = 0
     for order_params in buy_orders_params:
         position = src_positions[order_params.instrument_id]
         total_buy += (currency_to_decimal_price(position) *
-                      order_params.quantity)
+                      price_rate(position, rates) * order_params.quantity)
 
     return max(total_sell, total_buy)
 
 
+def target_quantities(src_positions, ratio):
+    """target quantities of dst positions by instrument uid"""
+    return {item_id: ratio * get_quantity_position(item_value)
+            for item_id, item_value in src_positions.items()}
+
+
+def only_instruments(positions, instrument_uids):
+    """positions of given instruments only"""
+    return {item_id: positions[item_id] for item_id in instrument_uids
+            if item_id in positions}
+
+
+@dataclasses.dataclass
+class SyncPlan:
+    """struct for planned orders of dst account
+
+    delta plan keeps positions of changed instruments only
+    """
+    src_positions: dict
+    dst_positions: dict
+    ratio: Decimal
+    total_dst: Decimal
+    orders_params_sell: list
+    orders_params_buy: list
+    delta: bool = False
+
+    @property
+    def target_positions(self):
+        """target quantities of planned instruments"""
+        return target_quantities(self.src_positions, self.ratio)
+
+    def notional(self, rates=None):
+        """max sum of sell or buy orders price in base currency by rates"""
+        return get_max_sum_positions_price(self.orders_params_sell,
+                                           self.orders_params_buy,
+                                           self.src_positions,
+                                           self.dst_positions,
+                                           rates)
+
+    def tracking_error(self, rates=None):
+        """notional of planned orders as share of dst account"""
+        if not self.total_dst:
+            return Decimal('0')
+        return Decimal(self.notional(rates)) / self.total_dst
+
+
+@dataclasses.dataclass
+class SyncFeatures:
+    """collaborators of syncs, every optional feature lives in own module"""
+    instruments: InstrumentCache = dataclasses.field(
+        default_factory=InstrumentCache)
+    orders: OrderExecution = dataclasses.field(default_factory=OrderExecution)
+    fx: FxRates = None
+    journal: object = None
+    state: object = None
+    reconcile: object = None
+    delta: object = None
+
+
 class AutoRepeater:
     """Main class for automatically repeating operations of one account over another account."""
 
-    def __init__(self, client):
+    def __init__(self, client, features=None, metrics=None):
         self.client = client
+        self.features = features or SyncFeatures()
+        self.metrics = metrics or SyncMetrics()
         self.debug = False
         self.threshold = Decimal(THRESHOLD)
         self.reserve = Decimal(DST_MONEY_RESERVED)
+        self.current = SyncContext()
 
     def set_debug(self, debug):
         """set debug flag"""
@@ -183,67 +316,198 @@ class AutoRepeater:
             # Оставляем преобразование здесь, так как входной параметр float
             self.reserve = Decimal(str(reserve))
 
-    def postiton_to_string(self, position):
-        """convert position to human-readable string"""
+    def set_sync_deadline(self, sync_deadline):
+        """set end-to-end time budget of sync in seconds
+
+        with the budget triggers from stream are handled by a sync worker
+        and a newer trigger abandons the sync which is still planning
+        """
+        if sync_deadline is not None:
+            if sync_deadline <= 0:
+                raise ValueError("Sync deadline must be positive")
+        self.current.deadline = sync_deadline
+
+    def configure_pair(self, pair):
+        """apply thresholds of pair config in place between syncs
+
+        values missing in config are reset to defaults, caches and
+        stream are kept
+        """
+        drift = self.features.reconcile
+        with self.current.lock:
+            self.set_threshold(float(THRESHOLD) if pair.threshold is None
+                               else pair.threshold)
+            self.set_reserve(float(DST_MONEY_RESERVED) if pair.reserve is None
+                             else pair.reserve)
+            if drift is not None:
+                drift.set_band(pair.drift_band)
+        logging.log(IMPORTANT, 'конфигурация пары применена: порог %s, резерв '
+                    '%s, полоса сверки %s', self.threshold, self.reserve,
+                    (drift and drift.band) or self.threshold,
+                    extra=self.current.log_extra(account=pair.dst))
+
+    def postiton_to_string(self, position, cached_only=False):
+        """convert position to human-readable string
+
+        with cached_only instrument is taken from caches without api calls
+        and uid is shown if it is not cached, so the string may be
+        rendered by the logging thread
+        """
         if position.instrument_type == 'currency':
             return currency_to_string(position)
         if position.instrument_type in ['share', 'etf']:
-            instrument = self.get_instrument(position.instrument_uid)
+            if cached_only:
+                instrument = self.features.instruments.cached(
+                    position.instrument_uid)
+            else:
+                instrument = self.get_instrument(position.instrument_uid)
             quantity = format_decimal(get_quantity_position(position))
-            return (no_money_to_string(instrument) + ' - ' +
-                    quantity + ' - ' + currency_to_string(position))
+            name = (position.instrument_uid if instrument is None
+                    else no_money_to_string(instrument))
+            return (name + ' - ' + quantity + ' - ' +
+                    currency_to_string(position))
         return str(position)
 
     def get_instrument(self, instrument_id):
         """get instrument by instrument id"""
-        result = self.client.instruments.find_instrument(
-            query=instrument_id).instruments
+        instrument = self.features.instruments.find(instrument_id)
+        if instrument is not None:
+            return instrument
+        with self.metrics.stage('instrument_resolution',
+                                instrument_id=instrument_id):
+            response = self.client.instruments.find_instrument(
+                query=instrument_id)
+        result = response.instruments
         if len(result) == 1:
+            self.features.instruments.found[instrument_id] = result[0]
             return result[0]
         raise GetInstrumentException('error get instrument')
 
-    def print_portfolio_by_account(self, account):
-        """print detailed information about account"""
-        logging.log(IMPORTANT, '%s (%s)', account.name, account.id)
-        logging.log(IMPORTANT, '------------')
-        portfolio = self.client.operations.get_portfolio(account_id=account.id)
+    def _resolve_instruments(self, instrument_ids,
+                            max_workers=PORTFOLIO_WORKERS, executor=None):
+        """fill instruments cache for all unique missing instrument ids
+
+        executor - pool shared with other requests, without it own pool
+        of max_workers is used
+        """
+        missing = self.features.instruments.missing(instrument_ids)
+        if not missing:
+            return
+        pool = (ThreadPoolExecutor(max_workers=max_workers)
+                if executor is None else contextlib.nullcontext(executor))
+        with pool as workers:
+            list(workers.map(self.metrics.bind(self.get_instrument), missing))
+
+    def _portfolio_report(self, account, summary_only=False, portfolio=None):
+        """build report lines about account
+
+        portfolio - already fetched portfolio of account
+        """
+        if portfolio is None:
+            portfolio = self.client.operations.get_portfolio(
+                account_id=account.id)
+        lines = [f'{account.name} ({account.id})', '------------']
         total = Decimal('0')
+        if not summary_only:
+            self._resolve_instruments(security_uids(portfolio.positions))
         for position in portfolio.positions:
-            logging.log(IMPORTANT, self.postiton_to_string(position))
+            if not summary_only:
+                lines.append(self.postiton_to_string(position))
             total += currency_to_decimal(position)
-        logging.log(IMPORTANT, 'total: %s', str(total))
-        logging.log(IMPORTANT, '============')
+        lines.append(f'total: {total}')
+        lines.append('============')
+        return lines
 
-    def print_all_portfolio(self):
-        """print detailed information about all accounts"""
-        response = self.client.users.get_accounts()
-        for account in response.accounts:
-            self.print_portfolio_by_account(account)
+    def print_portfolio_by_account(self, account, summary_only=False):
+        """print detailed information about account"""
+        for line in self._portfolio_report(account, summary_only):
+            logging.log(IMPORTANT, line)
+
+    def print_all_portfolio(self, summary_only=False,
+                            max_workers=PORTFOLIO_WORKERS):
+        """print information about all accounts as soon as each is fetched
+
+        portfolios and instruments are requested by one pool, so at most
+        max_workers calls run concurrently
+        """
+        accounts = self.client.users.get_accounts().accounts
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.client.operations.get_portfolio,
+                                       account_id=account.id): account
+                       for account in accounts}
+            for future in as_completed(futures):
+                portfolio = future.result()
+                if not summary_only:
+                    self._resolve_instruments(
+                        security_uids(portfolio.positions), executor=executor)
+                for line in self._portfolio_report(futures[future],
+                                                   summary_only, portfolio):
+                    logging.log(IMPORTANT, line)
+
+    def get_portfolio(self, account_id):
+        """get portfolio of account for sync"""
+        self.current.budget.check('portfolio_fetch')
+        with self.metrics.stage('portfolio_fetch', account=account_id) as span:
+            portfolio = self.client.operations.get_portfolio(
+                account_id=account_id)
+            span.set_attributes(positions=len(portfolio.positions))
+        return portfolio
+
+    def get_instrument_by_uid(self, instrument_uid):
+        """get full instrument info with trading status and lot
+
+        instrument is requested at most once per sync and is reused by
+        next syncs until ttl of instrument cache expires
+        """
+        instrument = self.features.instruments.fresh(instrument_uid,
+                                                     self.current.sync_id)
+        if instrument is not None:
+            return instrument
+        # Торговый статус не берётся из справочника, он меняется за день
+        self.current.budget.check('instrument_resolution')
+        with self.metrics.stage('instrument_resolution',
+                                instrument_uid=instrument_uid):
+            response = self.client.instruments.get_instrument_by(
+                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_UID,
+                id=instrument_uid)
+        instrument = response.instrument
+        self.features.instruments.store(instrument_uid, self.current.sync_id,
+                                        instrument)
+        return instrument
+
+    def get_rates(self, positions):
+        """rates of position currencies by one call if fx is set"""
+        if self.features.fx is None:
+            return None
+        with self.metrics.stage('fx_rates'):
+            return self.features.fx.get({position.current_price.currency
+                                         for position in positions})
 
     def calc_ratio(self, src_account_id, dst_account_id):
-        """calc ratio and print src and dst accounts"""
+        """calc ratio and print src and dst accounts
+
+        with fx rates positions in all currencies are valued in base
+        currency, rates are kept in self.current.rates for the current sync
+        """
+        portfolio_src = self.get_portfolio(src_account_id)
+        portfolio_dst = self.get_portfolio(dst_account_id)
+        self.current.rates = self.get_rates(
+            list(portfolio_src.positions) + list(portfolio_dst.positions))
+
         logging.log(IMPORTANT, "src account")
-        portfolio_src = self.client.operations.get_portfolio(
-            account_id=src_account_id)
-        total_src = Decimal('0')
-        src_positions = {}
         for position in portfolio_src.positions:
-            logging.log(IMPORTANT, self.postiton_to_string(position))
-            if position.instrument_type != 'currency':
-                src_positions[position.instrument_uid] = position
-                total_src += currency_to_decimal(position)
+            logging.log(IMPORTANT, '%s',
+                        LazyString(self.postiton_to_string, position, True))
+        (src_positions, total_src, _) = value_positions(
+            portfolio_src.positions, self.current.rates, self.features.fx)
         logging.log(IMPORTANT, 'total: %s', str(total_src))
 
         logging.log(IMPORTANT, "dst account")
-        portfolio_dst = self.client.operations.get_portfolio(
-            account_id=dst_account_id)
-        total_dst = Decimal('0')
-        dst_positions = {}
         for position in portfolio_dst.positions:
-            logging.log(IMPORTANT, self.postiton_to_string(position))
-            if position.instrument_type != 'currency':
-                dst_positions[position.instrument_uid] = position
-            total_dst += currency_to_decimal(position)
+            logging.log(IMPORTANT, '%s',
+                        LazyString(self.postiton_to_string, position, True))
+        (dst_positions, _, total_dst) = value_positions(
+            portfolio_dst.positions, self.current.rates, self.features.fx)
         total_dst = total_dst * (Decimal('1') - self.reserve)
         logging.log(IMPORTANT, 'total: %s', str(total_dst))
 
@@ -254,9 +518,7 @@ class AutoRepeater:
         """calc extra positions from dst accounts for sell"""
         result = []
         for item_id, item_value in dst_positions.items():
-            instrument = self.client.instruments.get_instrument_by(
-                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_UID,
-                id=item_id).instrument
+            instrument = self.get_instrument_by_uid(item_id)
             if (instrument.trading_status != SecurityTradingStatus.
                     SECURITY_TRADING_STATUS_NORMAL_TRADING):
                 continue
@@ -267,7 +529,9 @@ class AutoRepeater:
                     logging.log(IMPORTANT,
                                 'Продать: %s %d лотов',
                                 no_money_to_string(instrument),
-                                quantity)
+                                quantity,
+                                extra=self.current.log_extra(
+                                    instrument_uid=item_id, lots=quantity))
                     result.append(
                         OrderParams(
                             instrument_id=item_id,
@@ -281,7 +545,9 @@ class AutoRepeater:
                     logging.log(IMPORTANT,
                                 'Продать: %s %d лотов',
                                 no_money_to_string(instrument),
-                                quantity)
+                                quantity,
+                                extra=self.current.log_extra(
+                                    instrument_uid=item_id, lots=quantity))
                     result.append(
                         OrderParams(
                             instrument_id=item_id,
@@ -295,9 +561,7 @@ class AutoRepeater:
         """calc missing positions from dst account for buy"""
         result = []
         for item_id, item_value in target_positions.items():
-            instrument = self.client.instruments.get_instrument_by(
-                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_UID,
-                id=item_id).instrument
+            instrument = self.get_instrument_by_uid(item_id)
             if (instrument.trading_status != SecurityTradingStatus.
                     SECURITY_TRADING_STATUS_NORMAL_TRADING):
                 continue
@@ -308,7 +572,9 @@ class AutoRepeater:
                     logging.log(IMPORTANT,
                                 'Купить: %s %d лотов',
                                 no_money_to_string(instrument),
-                                quantity)
+                                quantity,
+                                extra=self.current.log_extra(
+                                    instrument_uid=item_id, lots=quantity))
                     result.append(
                         OrderParams(
                             instrument_id=item_id,
@@ -324,7 +590,9 @@ class AutoRepeater:
                     logging.log(IMPORTANT,
                                 'Купить: %s %d лотов',
                                 no_money_to_string(instrument),
-                                quantity)
+                                quantity,
+                                extra=self.current.log_extra(
+                                    instrument_uid=item_id, lots=quantity))
                     result.append(
                         OrderParams(
                             instrument_id=item_id,
@@ -335,110 +603,315 @@ class AutoRepeater:
 
     def post_orders(self, dst_account_id, orders_params_sell,
                     orders_params_buy):
-        """post all orders"""
-        for order_params in orders_params_sell:
-            logging.log(IMPORTANT, order_params)
-            logging.log(IMPORTANT,
-                        self.client.orders.post_order(
-                            instrument_id=order_params.instrument_id,
-                            quantity=order_params.quantity,
-                            direction=order_params.direction,
-                            account_id=dst_account_id,
-                            order_type=order_params.order_type).order_id)
-        for order_params in orders_params_buy:
-            logging.log(IMPORTANT, order_params)
-            logging.log(IMPORTANT,
-                        self.client.orders.post_order(
-                            instrument_id=order_params.instrument_id,
-                            quantity=order_params.quantity,
-                            direction=order_params.direction,
-                            account_id=dst_account_id,
-                            order_type=order_params.order_type).order_id)
-
-    def sync_accounts(self, src_account_id, dst_account_id):
-        """sync positions from src account to dst account"""
+        """post all orders
+
+        returns False if sync deadline expired before all orders are posted
+        """
+        executor = self.features.orders.executor
+        if executor:
+            return executor.execute(self, dst_account_id,
+                                    orders_params_sell + orders_params_buy)
+        orders_params = orders_params_sell + orders_params_buy
+        for (index, order_params) in enumerate(orders_params):
+            if self.current.budget.expired():
+                logging.log(IMPORTANT, 'время синхронизации истекло, не '
+                            'отправлено заявок: %d', len(orders_params) - index,
+                            extra=self.current.log_extra(
+                                account=dst_account_id))
+                return False
+            self.post_order(dst_account_id, order_params)
+        return True
+
+    def post_order(self, dst_account_id, order_params, sequence=None):
+        """post one order and return response
+
+        order is retried with the same client order id after timeouts,
+        sequence is set for orders posted in background for an earlier
+        sync, they are not tracked as orders of the current sync
+        """
+        background = sequence is not None
+        if not background:
+            sequence = self.current.sequence
+        order_id = sequence.next_id(order_params.instrument_id,
+                                    order_params.direction)
+        extra = self.current.log_extra(
+            account=dst_account_id, instrument_uid=order_params.instrument_id,
+            lots=order_params.quantity, direction=order_params.direction.name,
+            client_order_id=order_id)
+        extra['sync_id'] = sequence.sync_id
+        # Копия, так как запись форматируется потоком логирования позже
+        logging.log(IMPORTANT, dataclasses.replace(order_params), extra=extra)
+        kwargs = {}
+        if order_params.price is not None:
+            kwargs['price'] = decimal_to_quotation(order_params.price)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                with self.metrics.stage(
+                        'post_order', account=dst_account_id,
+                        instrument_uid=order_params.instrument_id,
+                        lots=order_params.quantity,
+                        direction=order_params.direction.name,
+                        client_order_id=order_id, attempt=attempt) as span:
+                    response = self.client.orders.post_order(
+                        instrument_id=order_params.instrument_id,
+                        quantity=order_params.quantity,
+                        direction=order_params.direction,
+                        account_id=dst_account_id,
+                        order_type=order_params.order_type,
+                        order_id=order_id,
+                        **kwargs)
+                    span.set_attributes(
+                        order_id=response.order_id,
+                        status=response.execution_report_status.name)
+                break
+            except RequestError as err:
+                retries = self.features.orders.retries
+                if not retries.should_retry(attempt, err):
+                    self.metrics.order_failed()
+                    raise
+                delay = retries.delay(attempt)
+                logging.log(IMPORTANT, 'повтор заявки %s через %.1f с: %s',
+                            order_id, delay, err.code, extra=extra)
+                self.metrics.orders.inc(status='retried')
+                attempt += 1
+                time.sleep(delay)
+        extra['latency'] = time.monotonic() - start
+        extra['order_id'] = response.order_id
+        logging.log(IMPORTANT, response.order_id, extra=extra)
+        if self.features.journal is not None:
+            self.features.journal.add_order(self, dst_account_id, order_params,
+                                            response, extra)
+        if background:
+            self.metrics.orders.inc(status='posted')
+        else:
+            self.metrics.order_posted()
+            self.current.posted_orders.append(response)
+        return response
+
+    def sync_accounts(self, src_account_id, dst_account_id,
+                      trigger_time=None, changed=None):
+        """sync positions from src account to dst account
+
+        trigger_time - monotonic time of event which caused the sync,
+        changed - uids of src instruments changed by events, None for all
+        """
+        with self.current.lock:
+            start_time = time.monotonic()
+            started_at = time.time()
+            self.current.start()
+            self.metrics.begin_sync(trigger_time)
+            status = 'failed'
+            with self._calls_scope() as calls, \
+                    self.metrics.profile(self.current.sync_id,
+                                         dst_account_id), \
+                    self.metrics.trace('sync', trigger_time,
+                                       src_account=src_account_id,
+                                       dst_account=dst_account_id,
+                                       sync_id=self.current.sync_id) as span:
+                try:
+                    self.features.instruments.refresh_catalog()
+                    status = self._sync_accounts(src_account_id,
+                                                 dst_account_id, changed)
+                except SyncCancelled as err:
+                    status = 'cancelled'
+                    self.metrics.syncs.cancelled.inc()
+                    logging.log(IMPORTANT, '%s', err,
+                                extra=self.current.log_extra(
+                                    account=dst_account_id))
+                except FxRateUnavailable as err:
+                    logging.error(err)
+                finally:
+                    self.metrics.end_sync(start_time)
+                    if calls is not None:
+                        logging.log(IMPORTANT, '%s',
+                                    LazyString(calls.summary, time.monotonic()),
+                                    extra=self.current.log_extra(
+                                        calls=dict(calls.counts)))
+                    latency = time.monotonic() - start_time
+                    span.set_attributes(status=status)
+                    if (status not in ('posted', 'skipped') and
+                            self.features.delta is not None):
+                        self.features.delta.base = None
+                    logging.log(IMPORTANT, 'синхронизация %d завершена за %.3f с',
+                                self.current.sync_id, latency,
+                                extra=self.current.log_extra(
+                                    account=dst_account_id, latency=latency))
+                    if self.features.journal is not None:
+                        self.features.journal.add_sync(
+                            self, src_account_id, dst_account_id, status, {
+                                'started_at': started_at,
+                                'trigger_delay': (start_time - trigger_time
+                                                  if trigger_time else None),
+                                'latency': latency}, changed)
+
+    def _calls_scope(self):
+        """attribute api calls to the current sync if client counts them"""
+        if isinstance(self.client, CountingClient):
+            return self.client.sync_scope(self.current.sync_id)
+        return contextlib.nullcontext()
+
+    def plan_sync(self, src_account_id, dst_account_id, changed=None):
+        """fetch accounts and plan orders without posting them
+
+        both portfolios are always fetched for the ratio, delta plan keeps
+        positions of changed instruments only, so targets and instrument
+        lookups are limited to them
+        """
         (src_positions, dst_positions, ratio, total_dst) = (
             self.calc_ratio(src_account_id, dst_account_id))
-        target_positions = {}
-        for item_id, item_value in src_positions.items():
-            target_positions[item_id] = ratio * \
-                get_quantity_position(item_value)
-
-        orders_params_sell = self.calc_sell_positions(
-            dst_positions, target_positions)
-        orders_params_buy = self.calc_buy_positions(
-            src_positions, dst_positions, target_positions)
-
-        if (not self.debug) and (
-                get_max_sum_positions_price(orders_params_sell, orders_params_buy,
-                                            src_positions, dst_positions) >
-                total_dst * self.threshold):
-            self.post_orders(
-                dst_account_id,
-                orders_params_sell,
-                orders_params_buy)
+        changed = None if self.features.delta is None else (
+            self.features.delta.instruments(self, src_account_id,
+                                            dst_account_id, ratio, changed))
+        if changed is not None:
+            src_positions = only_instruments(src_positions, changed)
+            dst_positions = only_instruments(dst_positions, changed)
+        self.current.budget.check('planning')
+        with self.metrics.stage('planning', ratio=float(ratio),
+                                delta=changed is not None) as span:
+            target_positions = target_quantities(src_positions, ratio)
+            orders_params_sell = self.calc_sell_positions(
+                dst_positions, target_positions)
+            orders_params_buy = self.calc_buy_positions(
+                src_positions, dst_positions, target_positions)
+            span.set_attributes(sell_orders=len(orders_params_sell),
+                                buy_orders=len(orders_params_buy))
+        self.metrics.plans.inc(kind='full' if changed is None else 'delta')
+        return SyncPlan(src_positions=src_positions,
+                        dst_positions=dst_positions,
+                        ratio=ratio,
+                        total_dst=total_dst,
+                        orders_params_sell=orders_params_sell,
+                        orders_params_buy=orders_params_buy,
+                        delta=changed is not None)
+
+    def _sync_accounts(self, src_account_id, dst_account_id, changed=None):
+        """sync stages: fetch, planning, threshold check and posting
+
+        returns status of sync for journal: debug, skipped, posted or
+        truncated when sync deadline expired before all orders are posted,
+        delta base is kept only by completed syncs, state only when dst
+        has nothing left to post
+        """
+        executor = self.features.orders.executor
+        if isinstance(executor, SliceScheduler):
+            if changed is not None and executor.pending(dst_account_id):
+                # Частичный план не видит дочерние заявки других бумаг
+                changed = None
+            # План строится от текущих позиций, прежние дочерние заявки
+            # больше не нужны, даже если новых заявок не будет
+            executor.supersede(dst_account_id)
+        plan = self.current.plan = self.plan_sync(
+            src_account_id, dst_account_id, changed)
+        if self.debug:
+            return 'debug'
+        self.current.budget.check('threshold_check')
+        with self.metrics.stage('threshold_check'):
+            above_threshold = (plan.notional(self.current.rates) >
+                               plan.total_dst * self.threshold)
+        converged = None
+        if above_threshold:
+            status = 'posted'
+            if not self.features.orders.execute(self, dst_account_id, plan):
+                return 'truncated'
+            (posted, converged) = self.features.orders.converge(
+                self, src_account_id, dst_account_id)
+            if not posted:
+                return 'truncated'
+        else:
+            status = 'skipped'
+            self.metrics.syncs.skipped.inc()
+            if plan.delta:
+                # Мелкие изменения копятся до следующего плана
+                self.features.delta.note(changed)
+            else:
+                converged = plan
+        if not plan.delta and self.features.delta is not None:
+            self.features.delta.complete(src_account_id, dst_account_id,
+                                         plan.ratio)
+        if converged is not None and self.features.state is not None:
+            # Только без заявок позиции счёта назначения известны точно
+            self.features.state.save(src_account_id, dst_account_id,
+                                     converged)
+        return status
+
+    def _initial_sync(self, src, dst):
+        """sync accounts at start unless both match the last converged state"""
+        try:
+            if (self.features.state is not None and
+                    self.features.state.is_unchanged(self, src, dst)):
+                logging.log(IMPORTANT, 'позиции счетов не изменились, '
+                            'начальная синхронизация пропущена')
+            else:
+                self.sync_accounts(src, dst)
+        except (RequestError, CallBudgetExceeded) as err:
+            logging.error(err)
 
-    def mainflow(self, src, dst):
-        """sync accounts when changing"""
+    def _sync_changes(self, src, dst, trigger_time):
+        """sync instruments noted since the last sync, errors are logged"""
+        delta = self.features.delta
         try:
-            self.sync_accounts(src, dst)
-        except RequestError as err:
+            self.sync_accounts(src, dst, trigger_time=trigger_time,
+                               changed=delta.take() if delta else None)
+        except (RequestError, CallBudgetExceeded) as err:
             logging.error(err)
 
-        while True:
-            try:
-                for response in self.client.operations_stream.positions_stream(
-                        accounts=[src, dst]):
-                    if check_triggers(response.position, src, dst):
-                        self.sync_accounts(src, dst)
-                    else:
-                        logging.log(IMPORTANT, response)
-            except RequestError as err:
-                logging.error(err)
+    def _check_drift(self, src, dst, trigger):
+        """reconcile accounts and trigger sync on drift, errors are logged"""
+        try:
+            if self.features.reconcile.check(self, src, dst):
+                trigger(time.monotonic())
+        except (RequestError, CallBudgetExceeded, FxRateUnavailable) as err:
+            logging.error(err)
 
+    def _start_triggers(self, src, dst):
+        """start sync worker and reconciler of accounts if they are set
+
+        returns trigger(trigger_time, changed=None) which runs or schedules
+        sync of changed src instruments, None for all, and started
+        services to stop
+        """
+        worker = None
+        if self.current.deadline is not None:
+            worker = SyncWorker(lambda trigger_time: self._sync_changes(
+                src, dst, trigger_time)).start()
+
+        def trigger(trigger_time, changed=None):
+            if self.features.delta is not None:
+                self.features.delta.note(changed)
+            if worker:
+                self.current.preempt()
+                worker.trigger(trigger_time)
+            else:
+                self._sync_changes(src, dst, trigger_time)
+
+        def reconcile():
+            self._check_drift(src, dst, trigger)
+
+        services = []
+        if self.features.reconcile is not None:
+            services.append(self.features.reconcile.start(reconcile))
+        if worker:
+            services.append(worker)
+        return (trigger, services)
 
-@dataclasses.dataclass
-class RunnerParams:
-    """params for init Runner class"""
-    debug: bool
-    threshold: float
-    reserve: float
-
-
-class Runner:
-    """wrapper for launch autorwpeater"""
-
-    def __init__(self,
-                 token,
-                 src,
-                 dst,
-                 params=RunnerParams(debug=False,
-                                     threshold=None,
-                                     reserve=None)):
-        self.token = token
-        self.params = params
-        self.src = src
-        self.dst = dst
-        logging.addLevelName(IMPORTANT, 'IMPORTANT')
-        logging.getLogger().setLevel(IMPORTANT)
-
-    def run(self):
-        """run mainflow for server variant"""
-        with Client(token=self.token, target=INVEST_GRPC_API) as client:
-            autorepeater = AutoRepeater(client)
-            autorepeater.print_all_portfolio()
-            autorepeater.set_debug(self.params.debug)
-            autorepeater.set_threshold(self.params.threshold)
-            autorepeater.set_reserve(self.params.reserve)
-            if self.src and self.dst:
-                autorepeater.mainflow(self.src, self.dst)
-
-    def run_sync(self):
-        """run one sync for serverless varian"""
-        with Client(token=self.token, target=INVEST_GRPC_API) as client:
-            autorepeater = AutoRepeater(client)
-            autorepeater.set_debug(self.params.debug)
-            autorepeater.set_threshold(self.params.threshold)
-            autorepeater.set_reserve(self.params.reserve)
-            if self.src and self.dst:
-                autorepeater.sync_accounts(self.src, self.dst)
+    def mainflow(self, src, dst):
+        """sync accounts when changing"""
+        self._initial_sync(src, dst)
+        (trigger, services) = self._start_triggers(src, dst)
+        try:
+            while True:
+                try:
+                    for response in (self.client.operations_stream.
+                                     positions_stream(accounts=[src, dst])):
+                        if not check_triggers(response.position, src, dst):
+                            logging.log(IMPORTANT, response)
+                            continue
+                        trigger(time.monotonic(),
+                                changed_instruments(response.position, src))
+                except (RequestError, CallBudgetExceeded) as err:
+                    logging.error(err)
+        finally:
+            for service in services:
+                service.stop()
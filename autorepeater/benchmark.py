@@ -0,0 +1,175 @@
+"""Offline benchmark of syncs against the simulated client
+
+python -m autorepeater.benchmark --sizes 10 100 1000 --output bench.json
+"""
+import argparse
+import json
+import logging
+import math
+import platform
+import sys
+import time
+
+from autorepeater.accounting import CountingClient
+from autorepeater.autorepeater import IMPORTANT
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import SimulationFinished
+from autorepeater.simulation import generate_market
+from autorepeater.simulation import trigger_event
+
+SRC = 'src'
+DST = 'dst'
+
+
+def percentile(values, fraction):
+    """nearest rank percentile of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered), max(1, math.ceil(fraction * len(ordered))))
+    return ordered[index - 1]
+
+
+def make_autorepeater(size, latency, seed):
+    """autorepeater over counting simulated client"""
+    market = generate_market(size, seed=seed, src=SRC, dst=DST)
+    client = CountingClient(SimulatedClient(market, latency=latency))
+    return AutoRepeater(client), market
+
+
+def calls_per_sync(client, syncs):
+    """average calls per sync by method"""
+    return {method: count / syncs
+            for method, count in sorted(client.totals.counts.items())}
+
+
+def summarize(scenario, durations, client, **params):
+    """machine-readable result of scenario with params like size, latency
+
+    every duration is one sync
+    """
+    total = sum(durations)
+    syncs = len(durations)
+    return {
+        'scenario': scenario,
+        **params,
+        'syncs': syncs,
+        'seconds': total,
+        'syncs_per_sec': syncs / total if total else 0.0,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'calls_per_sync': client.totals.total / syncs if syncs else 0.0,
+        'calls': calls_per_sync(client, syncs) if syncs else {},
+    }
+
+
+def time_mainflow(autorepeater, src, dst):
+    """run mainflow until simulation is finished, durations of its syncs"""
+    durations = []
+    sync_accounts = autorepeater.sync_accounts
+
+    def timed_sync(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            sync_accounts(*args, **kwargs)
+        finally:
+            durations.append(time.perf_counter() - start)
+    autorepeater.sync_accounts = timed_sync
+    try:
+        autorepeater.mainflow(src, dst)
+    except SimulationFinished:
+        pass
+    return durations
+
+
+def bench_sync(size, syncs, latency, seed=0):
+    """repeat full sync of the same generated accounts state"""
+    autorepeater, market = make_autorepeater(size, latency, seed)
+    initial = market.snapshot()
+    durations = []
+    for _ in range(syncs):
+        market.restore(initial)
+        start = time.perf_counter()
+        autorepeater.sync_accounts(SRC, DST)
+        durations.append(time.perf_counter() - start)
+    return summarize('sync_accounts', durations, autorepeater.client,
+                     size=size, latency=latency)
+
+
+def bench_stream(size, events, latency, seed=0):
+    """burst of trigger events through mainflow"""
+    autorepeater, market = make_autorepeater(size, latency, seed)
+    market.stream_script = [(0, trigger_event(SRC)) for _ in range(events)]
+    start = time.perf_counter()
+    durations = time_mainflow(autorepeater, SRC, DST)
+    result = summarize('mainflow_burst', durations, autorepeater.client,
+                       size=size, latency=latency)
+    result['events'] = events
+    result['wall_seconds'] = time.perf_counter() - start
+    return result
+
+
+def bench_print(size, latency, summary_only, seed=0):
+    """print_all_portfolio over generated accounts"""
+    autorepeater, _ = make_autorepeater(size, latency, seed)
+    start = time.perf_counter()
+    autorepeater.print_all_portfolio(summary_only=summary_only)
+    duration = time.perf_counter() - start
+    scenario = ('print_all_portfolio_summary' if summary_only
+                else 'print_all_portfolio')
+    result = summarize(scenario, [duration], autorepeater.client,
+                       size=size, latency=latency)
+    del result['syncs_per_sec']
+    return result
+
+
+def run(sizes, syncs, events, latency, seed=0):
+    """run all scenarios"""
+    results = []
+    for size in sizes:
+        results.append(bench_sync(size, syncs, latency, seed))
+        results.append(bench_stream(size, events, latency, seed))
+        results.append(bench_print(size, latency, False, seed))
+        results.append(bench_print(size, latency, True, seed))
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def main(argv=None):
+    """main function"""
+    parser = argparse.ArgumentParser(description="autorepeater benchmark")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[10, 100, 1000],
+                        help="количество инструментов в портфеле")
+    parser.add_argument("--syncs", type=int, default=20,
+                        help="количество синхронизаций в каждом замере")
+    parser.add_argument("--events", type=int, default=20,
+                        help="количество событий в пачке для mainflow")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="задержка каждого запроса к API в секундах")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--with-logging", action='store_true',
+                        help="учитывать форматирование логов")
+    parser.add_argument("-o", "--output", type=str, help="файл для результатов")
+    args = parser.parse_args(argv)
+
+    if args.with_logging:
+        logging.getLogger().addHandler(logging.NullHandler())
+        logging.getLogger().setLevel(IMPORTANT)
+    else:
+        logging.getLogger().setLevel(logging.ERROR)
+
+    report = run(args.sizes, args.syncs, args.events, args.latency, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Time budget of syncs and cooperative cancellation by newer triggers"""
+import contextlib
+import math
+import threading
+import time
+import uuid
+
+from autorepeater.retries import OrderSequence
+
+
+class SyncCancelled(Exception):
+    """sync was abandoned in favour of a fresh run"""
+
+
+class SyncDeadlineExceeded(SyncCancelled):
+    """sync time budget is exhausted"""
+
+
+class SyncBudget:
+    """deadline and cancellation flag of one sync, checked between stages
+
+    posting - orders of sync are being posted, sync is not preempted then
+    """
+
+    def __init__(self, seconds=None):
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.cancelled = threading.Event()
+        self.posting = False
+
+    def remaining(self):
+        """seconds left until deadline"""
+        if self.deadline is None:
+            return math.inf
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        """check that deadline has passed"""
+        return self.remaining() <= 0
+
+    def cancel(self):
+        """ask sync to stop at the next check"""
+        self.cancelled.set()
+
+    def preempt(self):
+        """cancel sync in favour of a newer trigger unless it is posting"""
+        if not self.posting:
+            self.cancel()
+
+    def check(self, stage):
+        """raise if sync is cancelled or out of time before stage"""
+        if self.cancelled.is_set():
+            raise SyncCancelled(
+                f'синхронизация прервана новым событием перед этапом {stage}')
+        if self.expired():
+            raise SyncDeadlineExceeded(
+                f'время синхронизации истекло перед этапом {stage}')
+
+
+class SyncContext:
+    """state of the current sync of account pair
+
+    deadline - time budget of every sync in seconds, None is unlimited;
+    lock keeps one sync or drift check of the pair at a time; rates, plan
+    and posted orders are kept for stages of the sync
+    """
+
+    def __init__(self):
+        self.deadline = None
+        self.lock = threading.Lock()
+        self.sequence = OrderSequence(uuid.uuid4(), 0)
+        self.budget = SyncBudget()
+        self.rates = None
+        self.plan = None
+        self.posted_orders = []
+
+    @property
+    def run_id(self):
+        """id of the process run"""
+        return self.sequence.run_id
+
+    @property
+    def sync_id(self):
+        """number of the current sync in run"""
+        return self.sequence.sync_id
+
+    def start(self):
+        """start the next sync with fresh budget, caller holds the lock"""
+        self.sequence = OrderSequence(self.run_id, self.sync_id + 1)
+        self.budget = SyncBudget(self.deadline)
+        self.rates = None
+        self.plan = None
+        self.posted_orders = []
+
+    def log_extra(self, **fields):
+        """structured fields of log record for the current sync"""
+        fields['sync_id'] = self.sync_id
+        return fields
+
+    def preempt(self):
+        """abandon the current sync unless its orders are being posted"""
+        self.budget.preempt()
+
+    @contextlib.contextmanager
+    def own_budget(self, budget):
+        """run stages outside of sync under budget, sync budget is kept"""
+        sync_budget = self.budget
+        self.budget = budget
+        try:
+            yield budget
+        finally:
+            self.budget = sync_budget
+
+
+class SyncWorker:
+    """single background thread running syncs for triggers
+
+    triggers arriving while a sync runs are coalesced into one next run
+    with the earliest trigger time
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.condition = threading.Condition()
+        self.pending = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self.loop, name='sync-worker',
+                                       daemon=True)
+
+    def start(self):
+        """start worker thread"""
+        self.thread.start()
+        return self
+
+    def trigger(self, trigger_time):
+        """request a sync for trigger at monotonic time"""
+        with self.condition:
+            if self.pending is None:
+                self.pending = trigger_time
+            self.condition.notify()
+
+    def loop(self):
+        """run requested syncs until stopped"""
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                trigger_time = self.pending
+                self.pending = None
+            self.run(trigger_time)
+
+    def stop(self):
+        """run the pending sync if any and stop worker"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
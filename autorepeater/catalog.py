@@ -0,0 +1,151 @@
+"""Read-only instrument catalog shared by worker processes
+
+Catalog is a file of fixed size records sorted by uid. Workers map it
+into memory and find instruments by binary search, so the page cache
+holds one copy for all processes. Supervisor rewrites the file
+atomically and workers remap it when it changes. Trading status is not
+kept, it changes during the day and is always requested from API.
+"""
+import collections
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+MAGIC = b'ARCAT2\0\0'
+HEADER = struct.Struct('<8sI')
+# uid, ticker, name, instrument_type, currency, lot
+RECORD = struct.Struct('<36s16s64s8s8sI')
+UID_SIZE = 36
+CATALOG_FILE = 'instruments.catalog'
+# Интервал обновления справочника супервизором, секунды
+CATALOG_TTL = 60
+
+CatalogRecord = collections.namedtuple(
+    'CatalogRecord',
+    ('uid', 'ticker', 'name', 'instrument_type', 'currency', 'lot'))
+
+
+def encode(text, size):
+    """utf-8 bytes of text cut to size on character boundary"""
+    data = text.encode('utf-8')[:size]
+    return data.decode('utf-8', 'ignore').encode('utf-8')
+
+
+def decode(data):
+    """text from null padded bytes"""
+    return data.rstrip(b'\0').decode('utf-8')
+
+
+def uid_key(uid):
+    """uid as padded record key"""
+    key = uid.encode('ascii')
+    if len(key) > UID_SIZE:
+        raise ValueError(f'uid is too long for catalog: {uid}')
+    return key.ljust(UID_SIZE, b'\0')
+
+
+def write_catalog(path, records):
+    """atomically write records sorted by uid to catalog file"""
+    rows = sorted((uid_key(record.uid), record) for record in records)
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as catalog_file:
+            catalog_file.write(HEADER.pack(MAGIC, len(rows)))
+            for (key, record) in rows:
+                catalog_file.write(RECORD.pack(
+                    key, encode(record.ticker, 16), encode(record.name, 64),
+                    encode(record.instrument_type, 8),
+                    encode(record.currency, 8), record.lot))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def fetch_catalog(client):
+    """catalog records of all shares, etfs and currencies"""
+    records = []
+    for (instrument_type, method) in (
+            ('share', client.instruments.shares),
+            ('etf', client.instruments.etfs),
+            ('currency', client.instruments.currencies)):
+        for instrument in method().instruments:
+            records.append(CatalogRecord(
+                uid=instrument.uid, ticker=instrument.ticker,
+                name=instrument.name, instrument_type=instrument_type,
+                currency=instrument.currency, lot=instrument.lot))
+    return records
+
+
+class InstrumentCatalog:
+    """memory-mapped catalog file with lookup by uid"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.map = None
+        self.count = 0
+        self.version = None
+        self.refresh()
+
+    def refresh(self):
+        """remap catalog if the file was replaced, True if remapped"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return False
+        with open(self.path, 'rb') as catalog_file:
+            new_map = mmap.mmap(catalog_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        (magic, count) = (None, 0)
+        if len(new_map) >= HEADER.size:
+            (magic, count) = HEADER.unpack_from(new_map)
+        if magic != MAGIC or len(new_map) != HEADER.size + count * RECORD.size:
+            new_map.close()
+            raise ValueError(f'broken instrument catalog {self.path}')
+        with self.lock:
+            (old_map, self.map) = (self.map, new_map)
+            self.count = count
+            self.version = version
+        if old_map is not None:
+            old_map.close()
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def get(self, uid):
+        """record of instrument by uid, None if it is absent"""
+        try:
+            key = uid_key(uid)
+        except (ValueError, UnicodeEncodeError):
+            return None
+        with self.lock:
+            (low, high) = (0, self.count)
+            while low < high:
+                middle = (low + high) // 2
+                offset = HEADER.size + middle * RECORD.size
+                current = self.map[offset:offset + UID_SIZE]
+                if current < key:
+                    low = middle + 1
+                elif current > key:
+                    high = middle
+                else:
+                    fields = RECORD.unpack_from(self.map, offset)
+                    return CatalogRecord(
+                        *(decode(field) for field in fields[:5]), *fields[5:])
+        return None
+
+    def close(self):
+        """unmap catalog"""
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+                self.count = 0
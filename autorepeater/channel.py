@@ -0,0 +1,139 @@
+"""gRPC channel options and keeping the long-lived channel hot"""
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from tinkoff.invest import RequestError
+
+from autorepeater.autorepeater import IMPORTANT
+from autorepeater.autorepeater import PORTFOLIO_WORKERS
+from autorepeater.autorepeater import security_uids
+
+# Keepalive включается явно: частые пинги сервер API считает злоупотреблением
+# и закрывает соединение с GOAWAY too_many_pings
+KEEPALIVE_TIME = None
+KEEPALIVE_TIMEOUT = 10.0
+HEARTBEAT_INTERVAL = 60.0
+# Часы работы биржи по Москве, в которые поддерживается соединение
+MARKET_HOURS = (7, 24)
+MARKET_TIMEZONE = datetime.timezone(datetime.timedelta(hours=3))
+COMPRESSION = {
+    'none': grpc.Compression.NoCompression,
+    'deflate': grpc.Compression.Deflate,
+    'gzip': grpc.Compression.Gzip,
+}
+
+
+def channel_options(keepalive_time=KEEPALIVE_TIME,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                    max_message_size=None, compression=None):
+    """grpc channel arguments
+
+    keepalive_time and keepalive_timeout are in seconds, keepalive pings
+    are off without keepalive_time, max_message_size is in megabytes
+    """
+    options = []
+    if keepalive_time:
+        options += [
+            ('grpc.keepalive_time_ms', int(keepalive_time * 1000)),
+            ('grpc.keepalive_timeout_ms', int(keepalive_timeout * 1000)),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+        ]
+    if max_message_size:
+        size = int(max_message_size * 1024 * 1024)
+        options += [
+            ('grpc.max_receive_message_length', size),
+            ('grpc.max_send_message_length', size),
+        ]
+    if compression:
+        options.append(('grpc.default_compression_algorithm',
+                        int(COMPRESSION[compression])))
+    return options
+
+
+def parse_hours(value):
+    """hours range like 7-24 as tuple"""
+    (start, end) = (int(item) for item in value.split('-'))
+    if not 0 <= start < end <= 24:
+        raise ValueError(f'wrong hours range {value}')
+    return (start, end)
+
+
+def warm_up(autorepeater, src_account_id, dst_account_id,
+            max_workers=PORTFOLIO_WORKERS):
+    """prime channel and instrument caches before the stream starts
+
+    trading status is reused by syncs only with instrument ttl
+    """
+    start = time.monotonic()
+    positions = []
+    for account_id in (src_account_id, dst_account_id):
+        positions += autorepeater.client.operations.get_portfolio(
+            account_id=account_id).positions
+    bind = autorepeater.metrics.bind
+    missing = autorepeater.features.instruments.missing(
+        security_uids(positions))
+    instrument_uids = {position.instrument_uid for position in positions
+                       if position.instrument_type != 'currency'}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(bind(autorepeater.get_instrument), missing))
+        list(executor.map(bind(autorepeater.get_instrument_by_uid),
+                          instrument_uids))
+    logging.log(IMPORTANT, 'прогрев: %d инструментов за %.3f с',
+                len(instrument_uids), time.monotonic() - start)
+
+
+class Heartbeat:
+    """periodic lightweight call keeping the channel hot in market hours"""
+    name = 'heartbeat'
+
+    def __init__(self, call, interval=HEARTBEAT_INTERVAL, hours=MARKET_HOURS):
+        if interval <= 0:
+            raise ValueError("Heartbeat interval must be positive")
+        self.call = call
+        self.interval = interval
+        self.hours = hours
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def in_market_hours(self, now=None):
+        """check that time is within market hours"""
+        now = now or datetime.datetime.now(MARKET_TIMEZONE)
+        hour = now.astimezone(MARKET_TIMEZONE).hour
+        return self.hours[0] <= hour < self.hours[1]
+
+    def beat(self):
+        """make one call if market is open"""
+        if not self.in_market_hours():
+            return False
+        try:
+            self.call()
+        except RequestError as err:
+            logging.warning('heartbeat: %s', err)
+        return True
+
+    def delay(self):
+        """seconds until the next beat"""
+        return self.interval
+
+    def run(self):
+        """beat every interval until stopped"""
+        while not self.stopped.wait(self.delay()):
+            self.beat()
+
+    def start(self):
+        """beat in daemon thread"""
+        self.thread = threading.Thread(target=self.run, name=self.name,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """stop beating"""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,178 @@
+"""Config file of account pairs reloaded without restart
+
+Config is a TOML file with defaults at top level and a table per pair:
+
+    threshold = 0.004
+    reserve = 0.01
+
+    [[pairs]]
+    src = "src-account"
+    dst = "dst-account"
+    drift_band = 0.002
+
+Watcher rereads the file when it changes or on SIGHUP and updates running
+autorepeaters in place, so the stream, caches and channel are kept.
+"""
+import dataclasses
+import logging
+import os
+import signal
+import threading
+
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+# Как часто проверять изменение файла конфигурации, секунды
+CONFIG_POLL_INTERVAL = 5.0
+PAIR_VALUES = ('threshold', 'reserve', 'drift_band')
+
+
+@dataclasses.dataclass(frozen=True)
+class PairConfig:
+    """account pair with its sync thresholds"""
+    src: str
+    dst: str
+    threshold: float = None
+    reserve: float = None
+    drift_band: float = None
+
+
+def check_share(name, value):
+    """check that value is share between 0 and 1"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f'{name} must be a number')
+    if not 0 <= value <= 1:
+        raise ValueError(f'{name} must be between 0 and 1')
+
+
+def parse_config(data, defaults=None):
+    """pairs from parsed config
+
+    pair values fall back to top level values and then to defaults
+    """
+    unknown = set(data) - set(PAIR_VALUES) - {'pairs'}
+    if unknown:
+        raise ValueError(f'unknown config keys: {", ".join(sorted(unknown))}')
+    common = {key: value for key, value in (defaults or {}).items()
+              if value is not None}
+    common.update({key: data[key] for key in PAIR_VALUES if key in data})
+    pairs = []
+    for item in data.get('pairs', []):
+        unknown = set(item) - set(PAIR_VALUES) - {'src', 'dst'}
+        if unknown:
+            raise ValueError(
+                f'unknown pair keys: {", ".join(sorted(unknown))}')
+        if not isinstance(item.get('src'), str) or not isinstance(
+                item.get('dst'), str):
+            raise ValueError('pair must have src and dst accounts')
+        values = dict(common, **item)
+        for key in PAIR_VALUES:
+            if key in values:
+                check_share(key, values[key])
+        pairs.append(PairConfig(**values))
+    dsts = [pair.dst for pair in pairs]
+    if len(set(dsts)) != len(dsts):
+        raise ValueError('dst account is repeated in config')
+    return pairs
+
+
+def load_config(path, defaults=None):
+    """pairs from TOML config file"""
+    with open(path, 'rb') as config_file:
+        return parse_config(tomllib.load(config_file), defaults)
+
+
+def apply_pairs(autorepeaters, pairs):
+    """update running autorepeaters by dst account in place
+
+    pairs are started and stopped only by restart, pairs of other
+    processes are ignored
+    """
+    configured = {pair.dst: pair for pair in pairs}
+    for (dst, autorepeater) in autorepeaters.items():
+        pair = configured.get(dst)
+        if pair is None:
+            logging.warning('счёт назначения %s удалён из конфигурации, пара '
+                            'работает до перезапуска', dst)
+            continue
+        autorepeater.configure_pair(pair)
+
+
+class ConfigWatcher(threading.Thread):
+    """reload config on file change or SIGHUP and pass pairs to apply
+
+    config is watched by daemon thread, broken config is logged and the
+    previous one stays in effect
+    """
+
+    def __init__(self, path, apply, defaults=None,
+                 interval=CONFIG_POLL_INTERVAL):
+        if interval <= 0:
+            raise ValueError("Config poll interval must be positive")
+        super().__init__(name='config', daemon=True)
+        self.path = path
+        self.apply = apply
+        self.defaults = defaults
+        self.interval = interval
+        self.version = self.file_version()
+        self.requested = threading.Event()
+        self.stopped = threading.Event()
+
+    def file_version(self):
+        """inode, mtime and size of config file, None if it is absent"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def request(self, *_):
+        """reload config as soon as possible, also SIGHUP handler"""
+        self.requested.set()
+
+    def check(self):
+        """reload config if it changed or reload is requested
+
+        returns True if new config is applied
+        """
+        version = self.file_version()
+        if not self.requested.is_set() and version == self.version:
+            return False
+        self.requested.clear()
+        self.version = version
+        try:
+            pairs = load_config(self.path, self.defaults)
+        except (OSError, ValueError) as err:
+            logging.error('конфигурация %s не применена: %s', self.path, err)
+            return False
+        self.apply(pairs)
+        return True
+
+    def run(self):
+        """check config every interval until stopped"""
+        while True:
+            self.requested.wait(self.interval)
+            if self.stopped.is_set():
+                return
+            self.check()
+
+    def listen(self):
+        """request reload on SIGHUP, it is handled only in main thread"""
+        if (hasattr(signal, 'SIGHUP') and
+                threading.current_thread() is threading.main_thread()):
+            signal.signal(signal.SIGHUP, self.request)
+
+    def start(self):
+        """watch config in daemon thread and listen to SIGHUP"""
+        self.listen()
+        super().start()
+        return self
+
+    def stop(self):
+        """stop watching"""
+        self.stopped.set()
+        self.requested.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,103 @@
+"""Convergence rounds after orders of sync are posted
+
+Orders are planned from portfolios fetched before posting, so partial
+fills, rounding and buying power may leave dst account off target. When
+posted orders are final the plan is rebuilt from fresh state and
+residual orders are posted until dst is within threshold.
+"""
+import logging
+import time
+
+from tinkoff.invest import OrderExecutionReportStatus
+
+from autorepeater.autorepeater import format_decimal
+from autorepeater.metrics import TRACKING_ERROR_BUCKETS
+from autorepeater.slicing import SliceScheduler
+
+# Сколько ждать исполнения заявок перед раундом выравнивания и как часто
+# опрашивать их состояние, секунды
+CONVERGENCE_WAIT = 10.0
+ORDER_POLL_INTERVAL = 0.5
+PENDING_STATUSES = (
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL)
+
+
+class Convergence:
+    """re-planning rounds of dst account after posting orders
+
+    rounds and their residual tracking error are counted in registry
+    """
+
+    def __init__(self, registry, rounds=0, wait=CONVERGENCE_WAIT,
+                 level=logging.INFO):
+        if rounds < 0:
+            raise ValueError("Convergence rounds must be non-negative")
+        if wait < 0:
+            raise ValueError("Convergence wait must be non-negative")
+        self.rounds = rounds
+        self.wait = wait
+        self.level = level
+        self.completed = registry.counter(
+            'autorepeater_convergence_rounds',
+            'Number of convergence re-planning rounds')
+        self.tracking_error = registry.histogram(
+            'autorepeater_tracking_error',
+            'Residual tracking error of dst account after convergence round',
+            buckets=TRACKING_ERROR_BUCKETS)
+
+    def wait_orders_final(self, autorepeater, account_id):
+        """wait until orders posted by the current round are not pending"""
+        pending = [response.order_id
+                   for response in autorepeater.current.posted_orders
+                   if response.execution_report_status in PENDING_STATUSES]
+        deadline = time.monotonic() + self.wait
+        while pending and time.monotonic() < deadline:
+            time.sleep(ORDER_POLL_INTERVAL)
+            pending = [order_id for order_id in pending
+                       if autorepeater.client.orders.get_order_state(
+                           account_id=account_id,
+                           order_id=order_id).execution_report_status
+                       in PENDING_STATUSES]
+        return not pending
+
+    def run(self, autorepeater, src_account_id, dst_account_id):
+        """re-plan from fresh state and post residual orders
+
+        stops after rounds or when dst is within threshold, returns
+        (completed, converged): completed is False if posting of a round
+        is truncated by sync deadline, converged is the last plan if dst
+        is within threshold and None if convergence is not confirmed
+        """
+        executor = autorepeater.features.orders.executor
+        for round_number in range(1, self.rounds + 1):
+            if (isinstance(executor, SliceScheduler) and
+                    executor.pending(dst_account_id)):
+                logging.log(self.level, 'выравнивание отложено до исполнения '
+                            'дочерних заявок')
+                return (True, None)
+            if not self.wait_orders_final(autorepeater, dst_account_id):
+                logging.log(self.level, 'выравнивание остановлено, заявки не '
+                            'исполнены за %.1f с', self.wait)
+                return (True, None)
+            start = time.monotonic()
+            autorepeater.current.posted_orders = []
+            with autorepeater.metrics.stage('convergence_round'):
+                plan = autorepeater.plan_sync(src_account_id, dst_account_id)
+                error = plan.tracking_error(autorepeater.current.rates)
+                within = error <= autorepeater.threshold
+                posted = within or autorepeater.features.orders.execute(
+                    autorepeater, dst_account_id, plan)
+            self.completed.inc()
+            self.tracking_error.observe(float(error))
+            latency = time.monotonic() - start
+            logging.log(self.level, 'выравнивание %d: отклонение %s за %.3f с',
+                        round_number, format_decimal(error), latency,
+                        extra=autorepeater.current.log_extra(
+                            account=dst_account_id, round=round_number,
+                            tracking_error=float(error), latency=latency))
+            if within:
+                return (True, plan)
+            if not posted:
+                return (False, None)
+        return (True, None)
@@ -0,0 +1,70 @@
+"""Delta plans of src events
+
+An event of src account names the instruments it changed. While ratio of
+accounts stays within tolerance of the last full plan, only these
+instruments are re-planned, so targets and instrument lookups of the
+rest of portfolio are skipped. Instruments of events are noted until the
+next sync takes them, small changes below threshold are kept for the
+next plan.
+"""
+import logging
+import threading
+from decimal import Decimal
+
+from autorepeater.autorepeater import format_decimal
+
+
+class DeltaPlans:
+    """instruments of events and base of delta plans of account pair
+
+    tolerance - relative move of ratio allowing delta plans
+    """
+
+    def __init__(self, tolerance, level=logging.INFO):
+        if tolerance < 0:
+            raise ValueError("Delta tolerance must be non-negative")
+        # Оставляем преобразование здесь, так как входной параметр float
+        self.tolerance = Decimal(str(tolerance))
+        self.level = level
+        self.base = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def note(self, changed):
+        """remember instruments to re-plan by the next sync, None is all"""
+        with self.lock:
+            if changed is None or self.pending is None:
+                self.pending = None
+            else:
+                self.pending |= changed
+
+    def take(self):
+        """instruments noted since the last sync, None for full plan"""
+        with self.lock:
+            (changed, self.pending) = (self.pending, set())
+        return changed or None
+
+    def complete(self, src_account_id, dst_account_id, ratio):
+        """keep ratio of completed full plan as base of delta plans"""
+        self.base = (src_account_id, dst_account_id, ratio)
+
+    def instruments(self, autorepeater, src_account_id, dst_account_id,
+                    ratio, changed):
+        """instruments to re-plan or None for full plan
+
+        delta plan needs a completed full plan of the pair and ratio
+        within tolerance of its ratio
+        """
+        if changed is None or self.base is None:
+            return None
+        (src, dst, base_ratio) = self.base
+        if (src, dst) != (src_account_id, dst_account_id) or not base_ratio:
+            return None
+        if abs(ratio / base_ratio - 1) > self.tolerance:
+            logging.log(self.level, 'коэффициент изменился с %s до %s, полный '
+                        'план', format_decimal(base_ratio),
+                        format_decimal(ratio),
+                        extra=autorepeater.current.log_extra(
+                            account=dst_account_id))
+            return None
+        return changed
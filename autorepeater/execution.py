@@ -0,0 +1,318 @@
+"""Posting of planned orders and limit orders priced from order book depth
+
+Planned orders are posted at best price or by executor, buy orders may
+be fitted to buying power first. Limit orders are priced at the book
+level which covers their size, unfilled orders are cancelled after a
+timeout and replaced at fresh prices, what is left after the last
+attempt is posted at best price.
+"""
+import dataclasses
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderExecutionReportStatus
+from tinkoff.invest import OrderType
+from tinkoff.invest.utils import money_to_decimal
+from tinkoff.invest.utils import quotation_to_decimal
+
+from autorepeater.cancellation import SyncBudget
+from autorepeater.fx import price_rate
+from autorepeater.retries import RetryPolicy
+
+LIMIT_TIMEOUT = 5.0
+LIMIT_ATTEMPTS = 2
+BOOK_DEPTH = 20
+BOOK_WORKERS = 8
+
+FILLED = (OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,)
+FINISHED = (OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+            OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
+            OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED)
+
+
+def limit_price(order_book, direction, quantity):
+    """price of the book level covering quantity lots or None
+
+    buy orders walk asks, sell orders walk bids
+    """
+    levels = (order_book.asks if direction == OrderDirection.ORDER_DIRECTION_BUY
+              else order_book.bids)
+    covered = 0
+    for level in levels:
+        covered += level.quantity
+        if covered >= quantity:
+            return quotation_to_decimal(level.price)
+    return None
+
+
+# pylint: disable=R0913,R0917
+def fetch_order_books(client, instrument_ids, depth=BOOK_DEPTH,
+                      max_workers=BOOK_WORKERS, metrics=None):
+    """order books of all instruments fetched concurrently
+
+    metrics - sync metrics, every fetch is traced as child of the current span
+    """
+    instrument_ids = list(dict.fromkeys(instrument_ids))
+
+    def get_order_book(instrument_id):
+        return client.market_data.get_order_book(instrument_id=instrument_id,
+                                                 depth=depth)
+
+    def traced_order_book(instrument_id):
+        with metrics.stage('order_book_fetch', instrument_id=instrument_id):
+            return get_order_book(instrument_id)
+    fetch = (get_order_book if metrics is None
+             else metrics.bind(traced_order_book))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(instrument_ids, executor.map(fetch, instrument_ids)))
+# pylint: enable=R0913,R0917
+
+
+def best_price(order_params):
+    """order params for order at best price"""
+    return dataclasses.replace(order_params,
+                               order_type=OrderType.ORDER_TYPE_BESTPRICE,
+                               price=None)
+
+
+def fit_buy_orders(orders_params_buy, lot_costs, available):
+    """shrink buy orders to fit available money, largest deficit first
+
+    lot_costs - (currency, price of one lot) by instrument uid,
+    available - money by currency
+    """
+    available = dict(available)
+
+    def deficit(order_params):
+        return lot_costs[order_params.instrument_id][1] * order_params.quantity
+
+    result = []
+    for order_params in sorted(orders_params_buy, key=deficit, reverse=True):
+        (currency, lot_cost) = lot_costs[order_params.instrument_id]
+        money = available.get(currency, Decimal('0'))
+        quantity = order_params.quantity
+        if lot_cost > 0:
+            quantity = min(quantity, max(0, int(money // lot_cost)))
+        if quantity > 0:
+            available[currency] = money - lot_cost * quantity
+            result.append(dataclasses.replace(order_params, quantity=quantity))
+    return result
+
+
+class LimitOrderExecutor:
+    """posts orders as limit orders with cancel and replace on timeout"""
+
+    # pylint: disable=R0913,R0917
+    def __init__(self, timeout=LIMIT_TIMEOUT, attempts=LIMIT_ATTEMPTS,
+                 depth=BOOK_DEPTH, max_workers=BOOK_WORKERS,
+                 level=logging.INFO):
+        if timeout < 0:
+            raise ValueError("Limit timeout must be non-negative")
+        if attempts < 1:
+            raise ValueError("Limit attempts must be positive")
+        self.timeout = timeout
+        self.attempts = attempts
+        self.depth = depth
+        self.max_workers = max_workers
+        self.level = level
+    # pylint: enable=R0913,R0917
+
+    def price_orders(self, orders_params, order_books):
+        """limit order params priced from book, best price if book is thin"""
+        result = []
+        for order_params in orders_params:
+            price = limit_price(order_books[order_params.instrument_id],
+                                order_params.direction, order_params.quantity)
+            if price is None:
+                result.append(best_price(order_params))
+            else:
+                result.append(dataclasses.replace(
+                    order_params, order_type=OrderType.ORDER_TYPE_LIMIT,
+                    price=price))
+        return result
+
+    def unfilled(self, client, account_id, posted):
+        """cancel open orders and return params for their unfilled lots"""
+        result = []
+        for order_params, response in posted:
+            state = client.orders.get_order_state(account_id=account_id,
+                                                  order_id=response.order_id)
+            if state.execution_report_status not in FINISHED:
+                client.orders.cancel_order(account_id=account_id,
+                                           order_id=response.order_id)
+                # Перечитываем состояние, пока шла отмена заявка могла исполниться
+                state = client.orders.get_order_state(
+                    account_id=account_id, order_id=response.order_id)
+            if state.execution_report_status in FILLED:
+                continue
+            remaining = order_params.quantity - state.lots_executed
+            if remaining > 0:
+                result.append(dataclasses.replace(order_params,
+                                                  quantity=remaining))
+        return result
+
+    def execute(self, autorepeater, account_id, orders_params,
+                sequence=None):
+        """post orders of account until filled or attempts are exhausted
+
+        sequence - client order ids of orders posted in background, they
+        are not limited by budget of the current sync; returns False if
+        budget stopped execution with unposted lots
+        """
+        client = autorepeater.client
+        budget = (autorepeater.current.budget if sequence is None
+                  else SyncBudget())
+        pending = list(orders_params)
+        for attempt in range(1, self.attempts + 1):
+            if not pending:
+                return True
+            if self.stopped(budget, pending):
+                return False
+            with autorepeater.metrics.stage('order_book'):
+                order_books = fetch_order_books(
+                    client, [item.instrument_id for item in pending],
+                    self.depth, self.max_workers, autorepeater.metrics)
+            posted = []
+            for order_params in self.price_orders(pending, order_books):
+                response = autorepeater.post_order(account_id, order_params,
+                                                   sequence)
+                if (order_params.order_type == OrderType.ORDER_TYPE_LIMIT and
+                        response.execution_report_status not in FILLED):
+                    posted.append((order_params, response))
+            if not posted:
+                return True
+            # Ожидание прерывается новым событием и не выходит за дедлайн
+            # синхронизации, пока держится её блокировка
+            budget.cancelled.wait(max(0, min(self.timeout,
+                                             budget.remaining())))
+            pending = self.unfilled(client, account_id, posted)
+            if pending:
+                logging.log(self.level,
+                            'попытка %d: не исполнено заявок %d, лотов %d',
+                            attempt, len(pending),
+                            sum(item.quantity for item in pending))
+        if pending and self.stopped(budget, pending):
+            return False
+        for order_params in pending:
+            autorepeater.post_order(account_id, best_price(order_params),
+                                    sequence)
+        return True
+
+    def stopped(self, budget, pending):
+        """check that budget is cancelled or expired before posting pending"""
+        if not budget.cancelled.is_set() and not budget.expired():
+            return False
+        logging.log(self.level, 'время исполнения истекло, не отправлено '
+                    'заявок %d, лотов %d', len(pending),
+                    sum(item.quantity for item in pending))
+        return True
+
+
+class OrderExecution:
+    """posting of planned orders by executor with retries of timed out orders
+
+    orders are posted at best price without executor, buy orders are
+    fitted to buying power of dst account if it is checked, convergence
+    re-plans dst account after posting if it is set
+    """
+
+    # pylint: disable=R0913,R0917
+    def __init__(self, executor=None, retries=None, check_buying_power=False,
+                 convergence=None, level=logging.INFO):
+        if not isinstance(check_buying_power, bool):
+            raise TypeError("Check buying power flag must be boolean")
+        self.executor = executor
+        self.retries = retries or RetryPolicy()
+        self.check_buying_power = check_buying_power
+        self.convergence = convergence
+        self.level = level
+    # pylint: enable=R0913,R0917
+
+    @staticmethod
+    def buying_power(autorepeater, account_id):
+        """available money of account by currency by one api call"""
+        response = autorepeater.client.operations.get_withdraw_limits(
+            account_id=account_id)
+        available = {}
+        for money in response.money:
+            currency = money.currency.lower()
+            available[currency] = (available.get(currency, Decimal('0')) +
+                                   money_to_decimal(money))
+        return available
+
+    def fit_to_buying_power(self, autorepeater, dst_account_id, plan):
+        """buy orders of plan shrunk to buying power of dst account
+
+        proceeds of planned sells are not counted until they are filled,
+        convergence rounds buy the rest from refreshed withdraw limits
+        """
+        available = self.buying_power(autorepeater, dst_account_id)
+        lot_costs = {}
+        for order_params in plan.orders_params_buy:
+            position = plan.src_positions[order_params.instrument_id]
+            instrument = autorepeater.get_instrument_by_uid(
+                order_params.instrument_id)
+            lot_costs[order_params.instrument_id] = (
+                position.current_price.currency.lower(),
+                money_to_decimal(position.current_price) * instrument.lot)
+        result = fit_buy_orders(plan.orders_params_buy, lot_costs, available)
+        fitted = {order_params.instrument_id: order_params.quantity
+                  for order_params in result}
+        for order_params in plan.orders_params_buy:
+            quantity = fitted.get(order_params.instrument_id, 0)
+            if quantity < order_params.quantity:
+                logging.log(self.level,
+                            'Не хватает средств: %s %d из %d лотов',
+                            order_params.instrument_id, quantity,
+                            order_params.quantity,
+                            extra=autorepeater.current.log_extra(
+                                account=dst_account_id,
+                                instrument_uid=order_params.instrument_id,
+                                lots=quantity))
+        return result
+
+    @staticmethod
+    def by_contribution(autorepeater, orders_params, positions, rates=None):
+        """orders sorted by descending value in base currency"""
+        def value(order_params):
+            instrument = autorepeater.get_instrument_by_uid(
+                order_params.instrument_id)
+            position = positions[order_params.instrument_id]
+            return (money_to_decimal(position.current_price) *
+                    price_rate(position, rates) *
+                    instrument.lot * order_params.quantity)
+        return sorted(orders_params, key=value, reverse=True)
+
+    def execute(self, autorepeater, dst_account_id, plan):
+        """post orders of plan fitted to buying power if it is checked
+
+        newer triggers do not abandon the sync once posting has started,
+        orders are posted by descending contribution to tracking error,
+        returns False if posting is truncated by sync deadline
+        """
+        autorepeater.current.budget.posting = True
+        orders_params_buy = plan.orders_params_buy
+        if self.check_buying_power and orders_params_buy:
+            with autorepeater.metrics.stage('buying_power'):
+                orders_params_buy = self.fit_to_buying_power(
+                    autorepeater, dst_account_id, plan)
+        rates = autorepeater.current.rates
+        return autorepeater.post_orders(
+            dst_account_id,
+            self.by_contribution(autorepeater, plan.orders_params_sell,
+                                 plan.dst_positions, rates),
+            self.by_contribution(autorepeater, orders_params_buy,
+                                 plan.src_positions, rates))
+
+    def converge(self, autorepeater, src_account_id, dst_account_id):
+        """run convergence rounds if they are set
+
+        returns (completed, converged) of convergence, without it
+        convergence is not confirmed
+        """
+        if self.convergence is None:
+            return (True, None)
+        return self.convergence.run(autorepeater, src_account_id,
+                                    dst_account_id)
@@ -0,0 +1,113 @@
+"""Exchange rates of currencies to the base currency of accounts
+
+Rates are last prices of currency instruments, all missing or expired
+rates are fetched by one GetLastPrices call and cached for ttl seconds.
+"""
+import threading
+import time
+from decimal import Decimal
+
+from tinkoff.invest.utils import money_to_decimal
+from tinkoff.invest.utils import quotation_to_decimal
+
+BASE_CURRENCY = 'rub'
+FX_TTL = 30.0
+
+
+def price_rate(position, rates=None):
+    """rate of position price currency to base currency"""
+    if not rates:
+        return 1
+    return rates[position.current_price.currency.lower()]
+
+
+def is_repeated(position, fx=None):
+    """check that position is repeated by orders
+
+    base currency is never traded, foreign currencies are traded only if
+    fx rates are set to rebalance them
+    """
+    if position.instrument_type != 'currency':
+        return True
+    return fx is not None and fx.rebalance and fx.is_foreign(
+        position.instrument_uid)
+
+
+class FxRateUnavailable(Exception):
+    """no currency instrument or last price for currency"""
+
+
+class FxRates:
+    """cached rates of currencies to base currency
+
+    rebalance - repeat foreign currency positions by orders
+    """
+
+    def __init__(self, client, base=BASE_CURRENCY, ttl=FX_TTL,
+                 rebalance=False):
+        if ttl < 0:
+            raise ValueError("FX ttl must be non-negative")
+        if not isinstance(rebalance, bool):
+            raise TypeError("Rebalance currencies flag must be boolean")
+        self.client = client
+        self.base = base.lower()
+        self.ttl = ttl
+        self.rebalance = rebalance
+        self.instruments = None
+        self.rates = {}
+        self.lock = threading.Lock()
+
+    def currency_instruments(self):
+        """currency instruments by iso code, requested once"""
+        if self.instruments is None:
+            instruments = {}
+            for instrument in self.client.instruments.currencies().instruments:
+                instruments.setdefault(instrument.iso_currency_name.lower(),
+                                       instrument)
+            self.instruments = instruments
+        return self.instruments
+
+    def is_foreign(self, instrument_uid):
+        """check that currency position is not in base currency"""
+        return any(instrument.uid == instrument_uid and iso != self.base
+                   for iso, instrument in self.currency_instruments().items())
+
+    def fetch(self, currencies):
+        """fetch rates of currencies by one call"""
+        instruments = self.currency_instruments()
+        unknown = [currency for currency in currencies
+                   if currency not in instruments]
+        if unknown:
+            raise FxRateUnavailable(f'нет инструмента для валют {unknown}')
+        by_uid = {instruments[currency].uid: currency
+                  for currency in currencies}
+        response = self.client.market_data.get_last_prices(
+            instrument_id=list(by_uid))
+        expires = time.monotonic() + self.ttl
+        for last_price in response.last_prices:
+            currency = by_uid.get(last_price.instrument_uid)
+            if currency is None:
+                continue
+            nominal = money_to_decimal(instruments[currency].nominal)
+            self.rates[currency] = (
+                expires,
+                quotation_to_decimal(last_price.price) / (nominal or 1))
+        missing = [currency for currency in currencies
+                   if currency not in self.rates]
+        if missing:
+            raise FxRateUnavailable(f'нет курса для валют {missing}')
+
+    def get(self, currencies):
+        """rates to base currency by lowercase iso code"""
+        currencies = {currency.lower() for currency in currencies}
+        now = time.monotonic()
+        with self.lock:
+            stale = sorted(currency for currency in currencies - {self.base}
+                           if currency not in self.rates or
+                           self.rates[currency][0] <= now)
+            if stale:
+                self.fetch(stale)
+            rates = {currency: self.rates[currency][1]
+                     for currency in currencies - {self.base}}
+        rates[self.base] = Decimal('1')
+        return rates
@@ -0,0 +1,96 @@
+"""Caches of instruments resolved by syncs
+
+Instruments found by id keep static fields and are cached for the whole
+run, shared catalog of worker processes is used before requests. Full
+instruments with trading status are requested at most once per sync and
+are reused by next syncs until ttl expires.
+"""
+import logging
+import time
+
+from tinkoff.invest import Instrument
+
+# Время жизни кэша торгового статуса и лотности инструментов между
+# синхронизациями, секунды: по умолчанию статус запрашивается каждой
+# синхронизацией, что бы не торговать по устаревшему статусу
+INSTRUMENT_TTL = 0
+
+
+class InstrumentCache:
+    """instruments found by id and full instruments by uid
+
+    catalog - shared instrument catalog used instead of find requests
+    """
+
+    def __init__(self, ttl=INSTRUMENT_TTL, catalog=None):
+        if ttl < 0:
+            raise ValueError("Instrument ttl must be non-negative")
+        self.ttl = ttl
+        self.catalog = catalog
+        self.found = {}
+        self.by_uid = {}
+
+    def refresh_catalog(self):
+        """remap shared catalog if it was replaced, broken file is logged
+
+        previous catalog stays in use until the file is fixed
+        """
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.refresh()
+        except (OSError, ValueError) as err:
+            logging.error(err)
+
+    def from_catalog(self, instrument_uid):
+        """instrument from shared catalog, None if it is not there"""
+        if self.catalog is None:
+            return None
+        record = self.catalog.get(instrument_uid)
+        if record is None:
+            return None
+        return Instrument(
+            uid=record.uid, ticker=record.ticker, name=record.name,
+            instrument_type=record.instrument_type, currency=record.currency,
+            lot=record.lot)
+
+    def find(self, instrument_id):
+        """found or catalog instrument, None if it must be requested"""
+        instrument = self.found.get(instrument_id)
+        if instrument is None:
+            instrument = self.from_catalog(instrument_id)
+            if instrument is not None:
+                self.found[instrument_id] = instrument
+        return instrument
+
+    def missing(self, instrument_ids):
+        """instrument ids which were not found yet"""
+        return set(instrument_ids) - set(self.found)
+
+    def cached(self, instrument_uid):
+        """instrument from caches, None if it was not requested yet"""
+        instrument = self.found.get(instrument_uid)
+        if instrument is None:
+            cached = self.by_uid.get(instrument_uid)
+            instrument = cached[2] if cached else None
+        return instrument
+
+    def ticker(self, instrument_uid):
+        """ticker of full instrument if it is cached"""
+        cached = self.by_uid.get(instrument_uid)
+        return cached[2].ticker if cached else None
+
+    def fresh(self, instrument_uid, sync_id):
+        """full instrument requested by sync or not expired, else None"""
+        cached = self.by_uid.get(instrument_uid)
+        if cached is None:
+            return None
+        (cached_sync_id, expires, instrument) = cached
+        if cached_sync_id == sync_id or time.monotonic() < expires:
+            return instrument
+        return None
+
+    def store(self, instrument_uid, sync_id, instrument):
+        """cache full instrument requested by sync"""
+        self.by_uid[instrument_uid] = (
+            sync_id, time.monotonic() + self.ttl, instrument)
@@ -0,0 +1,278 @@
+"""Journal of syncs, plans and orders in embedded SQLite database
+
+Rows are queued by the robot and written by a background thread in
+batches, one transaction per batch, so syncs never wait for the disk.
+"""
+import datetime
+import json
+import logging
+import math
+import queue
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+
+from autorepeater.autorepeater import format_decimal
+from autorepeater.autorepeater import get_quantity_position
+
+JOURNAL_BATCH = 500
+# Окно поиска заявок вокруг заданного времени, секунды
+JOURNAL_WINDOW = 60.0
+
+COLUMNS = {
+    'syncs': ('run_id', 'sync_id', 'started_at', 'src_account', 'dst_account',
+              'trigger_delay', 'changed', 'status', 'total_dst', 'ratio',
+              'latency'),
+    'targets': ('run_id', 'sync_id', 'instrument_uid', 'held', 'target'),
+    'orders': ('run_id', 'sync_id', 'created_at', 'account', 'instrument_uid',
+               'ticker', 'direction', 'lots', 'price', 'state',
+               'client_order_id', 'order_id', 'latency'),
+}
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS syncs (
+        run_id TEXT NOT NULL,
+        sync_id INTEGER NOT NULL,
+        started_at REAL NOT NULL,
+        src_account TEXT,
+        dst_account TEXT,
+        trigger_delay REAL,
+        changed TEXT,
+        status TEXT,
+        total_dst TEXT,
+        ratio TEXT,
+        latency REAL,
+        PRIMARY KEY (run_id, sync_id))''',
+    '''CREATE TABLE IF NOT EXISTS targets (
+        run_id TEXT NOT NULL,
+        sync_id INTEGER NOT NULL,
+        instrument_uid TEXT NOT NULL,
+        held TEXT,
+        target TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS orders (
+        run_id TEXT NOT NULL,
+        sync_id INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        account TEXT,
+        instrument_uid TEXT NOT NULL,
+        ticker TEXT,
+        direction TEXT,
+        lots INTEGER,
+        price TEXT,
+        state TEXT,
+        client_order_id TEXT,
+        order_id TEXT,
+        latency REAL)''',
+    'CREATE INDEX IF NOT EXISTS syncs_time ON syncs (started_at)',
+    'CREATE INDEX IF NOT EXISTS syncs_account ON syncs (dst_account, started_at)',
+    'CREATE INDEX IF NOT EXISTS targets_sync ON targets (run_id, sync_id)',
+    'CREATE INDEX IF NOT EXISTS orders_time ON orders (created_at)',
+    'CREATE INDEX IF NOT EXISTS orders_account ON orders (account, created_at)',
+    'CREATE INDEX IF NOT EXISTS orders_instrument '
+    'ON orders (instrument_uid, created_at)',
+    'CREATE INDEX IF NOT EXISTS orders_ticker ON orders (ticker, created_at)',
+)
+
+
+def connect(path):
+    """open journal database and create missing tables and indexes"""
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    with connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+    return connection
+
+
+def insert_statement(table):
+    """insert statement with named parameters for table"""
+    columns = COLUMNS[table]
+    return (f'INSERT INTO {table} ({", ".join(columns)}) '
+            f'VALUES ({", ".join(":" + column for column in columns)})')
+
+
+def parse_time(value):
+    """unix time from iso datetime or number"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+class SyncJournal:
+    """queue of journal rows written by background thread"""
+
+    def __init__(self, path, batch_size=JOURNAL_BATCH):
+        if batch_size < 1:
+            raise ValueError("Journal batch size must be positive")
+        self.path = path
+        self.batch_size = batch_size
+        # Схема создаётся сразу, что бы ошибки открытия были видны при старте
+        connect(path).close()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='journal',
+                                       daemon=True)
+        self.thread.start()
+
+    def add(self, table, row):
+        """queue row of table, missing columns are NULL"""
+        self.queue.put((table, {column: row.get(column)
+                                for column in COLUMNS[table]}))
+
+    # pylint: disable=R0913,R0917
+    def add_sync(self, autorepeater, src_account_id, dst_account_id, status,
+                 timings, changed=None):
+        """queue the current sync of autorepeater with its plan
+
+        timings - started_at wall time, trigger_delay and latency of sync,
+        changed - src instruments of trigger events, None for full sync
+        """
+        key = {'run_id': str(autorepeater.current.run_id),
+               'sync_id': autorepeater.current.sync_id}
+        plan = autorepeater.current.plan
+        instruments = autorepeater.features.instruments
+        self.add('syncs', dict(
+            key, src_account=src_account_id, dst_account=dst_account_id,
+            status=status, **timings,
+            changed=json.dumps(sorted(changed)) if changed else None,
+            total_dst=format_decimal(plan.total_dst) if plan else None,
+            ratio=format_decimal(plan.ratio) if plan else None))
+        if plan is None:
+            return
+        targets = plan.target_positions
+        for item_id in set(targets) | set(plan.dst_positions):
+            held = plan.dst_positions.get(item_id)
+            self.add('targets', dict(
+                key, instrument_uid=item_id,
+                held=format_decimal(get_quantity_position(held)
+                                    if held else Decimal('0')),
+                target=format_decimal(targets.get(item_id, Decimal('0')))))
+        for order_params in plan.orders_params_sell + plan.orders_params_buy:
+            self.add('orders', dict(
+                key, created_at=timings['started_at'], account=dst_account_id,
+                instrument_uid=order_params.instrument_id,
+                ticker=instruments.ticker(order_params.instrument_id),
+                direction=order_params.direction.name,
+                lots=order_params.quantity, state='planned'))
+
+    def add_order(self, autorepeater, dst_account_id, order_params, response,
+                  extra):
+        """queue order posted by autorepeater
+
+        sync id, client order id and latency are taken from log extra of
+        order
+        """
+        instruments = autorepeater.features.instruments
+        self.add('orders', {
+            'run_id': str(autorepeater.current.run_id),
+            'sync_id': extra['sync_id'],
+            'created_at': time.time(), 'account': dst_account_id,
+            'instrument_uid': order_params.instrument_id,
+            'ticker': instruments.ticker(order_params.instrument_id),
+            'direction': order_params.direction.name,
+            'lots': order_params.quantity,
+            'price': (format_decimal(order_params.price)
+                      if order_params.price is not None else None),
+            'state': 'posted', 'client_order_id': extra['client_order_id'],
+            'order_id': response.order_id, 'latency': extra['latency']})
+    # pylint: enable=R0913,R0917
+
+    def run(self):
+        """write queued rows until closed"""
+        connection = connect(self.path)
+        try:
+            while True:
+                item = self.queue.get()
+                batch = []
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    self.write(connection, batch)
+                if item is None:
+                    return
+        finally:
+            connection.close()
+
+    @staticmethod
+    def write(connection, batch):
+        """write batch of rows in one transaction"""
+        rows = {}
+        for (table, row) in batch:
+            rows.setdefault(table, []).append(row)
+        try:
+            with connection:
+                for (table, table_rows) in rows.items():
+                    connection.executemany(insert_statement(table), table_rows)
+        except sqlite3.Error as err:
+            logging.error('не удалось записать журнал: %s', err)
+
+    def close(self):
+        """write queued rows and stop writer"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+def explain_orders(connection, instrument, at_time, window=JOURNAL_WINDOW):
+    """orders of instrument by uid or ticker near time with their syncs
+
+    every order has state of its sync: totals, ratio, instruments changed
+    by its trigger, held and target quantity of the instrument
+    """
+    rows = connection.execute(
+        '''SELECT orders.*, syncs.started_at, syncs.status, syncs.total_dst,
+               syncs.ratio, syncs.trigger_delay, syncs.changed, targets.held,
+               targets.target
+           FROM orders
+           LEFT JOIN syncs ON syncs.run_id = orders.run_id
+               AND syncs.sync_id = orders.sync_id
+           LEFT JOIN targets ON targets.run_id = orders.run_id
+               AND targets.sync_id = orders.sync_id
+               AND targets.instrument_uid = orders.instrument_uid
+           WHERE (orders.instrument_uid = :instrument
+                  OR orders.ticker = :instrument)
+               AND orders.created_at BETWEEN :start AND :end
+           ORDER BY abs(orders.created_at - :at_time), orders.state''',
+        {'instrument': instrument, 'at_time': at_time,
+         'start': at_time - window, 'end': at_time + window})
+    return [dict(row) for row in rows]
+
+
+def percentile(values, fraction):
+    """nearest rank percentile of sorted values"""
+    return values[min(len(values), max(1, math.ceil(fraction * len(values)))) - 1]
+
+
+def latency_stats(connection, since=None, until=None, account=None):
+    """count and latency percentiles of syncs by status"""
+    query = 'SELECT status, latency FROM syncs WHERE 1 = 1'
+    params = {}
+    if since is not None:
+        query += ' AND started_at >= :since'
+        params['since'] = since
+    if until is not None:
+        query += ' AND started_at < :until'
+        params['until'] = until
+    if account is not None:
+        query += ' AND dst_account = :account'
+        params['account'] = account
+    by_status = {}
+    for row in connection.execute(query, params):
+        by_status.setdefault(row['status'], []).append(row['latency'] or 0.0)
+    result = {}
+    for (status, latencies) in sorted(by_status.items()):
+        latencies.sort()
+        result[status] = {
+            'count': len(latencies),
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        }
+    return result
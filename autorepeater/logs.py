@@ -0,0 +1,68 @@
+"""Queue based logging pipeline with optional JSON records
+
+Records are put into a queue as is and are formatted and written by a
+background listener thread, so the sync hot path pays only for creating
+the record. Messages built from LazyString are rendered only if a record
+is actually emitted.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+from pythonjsonlogger.json import JsonFormatter
+
+JSON_FORMAT = '%(asctime)s %(levelname)s %(name)s %(message)s'
+
+
+class LazyString:  # pylint: disable=R0903
+    """message part rendered only when a record is formatted
+
+    it is rendered by the listener thread, so func must not call api and
+    args must not change after logging
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """queue handler leaving formatting to the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+
+class BackgroundListener(logging.handlers.QueueListener):
+    """queue listener which may be stopped more than once"""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def make_formatter(json_format):
+    """JSON or plain text formatter"""
+    if json_format:
+        return JsonFormatter(JSON_FORMAT)
+    return logging.Formatter(logging.BASIC_FORMAT)
+
+
+def setup_logging(level, json_format=False, stream=None):
+    """replace root handlers by queue pipeline, return started listener"""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(make_formatter(json_format))
+    records = queue.SimpleQueue()
+    listener = BackgroundListener(records, handler)
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,350 @@
+"""Sync metrics with export in Prometheus text format"""
+import bisect
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from autorepeater.tracing import NOOP_SPAN
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRACKING_ERROR_BUCKETS = (0.0005, 0.001, 0.002, 0.004, 0.01, 0.025, 0.05,
+                          0.1, 0.25)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label_value(value):
+    """escape label value for Prometheus text format"""
+    return (str(value).replace('\\', '\\\\')
+            .replace('\n', '\\n').replace('"', '\\"'))
+
+
+def format_labels(labels):
+    """format sorted labels pairs as {name="value",...}"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"'
+                          for name, value in labels) + '}'
+
+
+def format_value(value):
+    """format sample value"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter:
+    """monotonic counter with optional labels"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """increase counter"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """current counter value"""
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        """samples as (name, labels, value)"""
+        with self.lock:
+            return [(self.name + '_total', key, value)
+                    for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """cumulative histogram with optional labels"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """add observation"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        """number of observations"""
+        counts, _ = self.values.get(tuple(sorted(labels.items())), ([], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        """samples as (name, labels, value)"""
+        result = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    result.append((self.name + '_bucket',
+                                   key + (('le', format_value(bound)),),
+                                   cumulative))
+                result.append((self.name + '_sum', key, total))
+                result.append((self.name + '_count', key, cumulative))
+        return result
+
+
+class Registry:
+    """set of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """add metric to rendered ones"""
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        """create and register counter"""
+        return self.register(Counter(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        """create and register histogram"""
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        """render all metrics in Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(
+                    f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def registry_snapshot(registry):
+    """picklable metrics of registry for sending to another process"""
+    return [(metric.name, metric.kind, metric.documentation, metric.samples())
+            for metric in registry.metrics]
+
+
+class MergedRegistry:
+    """sum of registry snapshots reported by several sources
+
+    samples with the same name and labels are added, which is right for
+    counters and histogram buckets of one metric from several processes
+    """
+
+    def __init__(self, registries=()):
+        self.registries = list(registries)
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def update(self, source, snapshots):
+        """replace snapshots of source"""
+        with self.lock:
+            self.snapshots[source] = snapshots
+
+    def render(self):
+        """render merged metrics in Prometheus text format"""
+        with self.lock:
+            snapshots = [snapshot for source_snapshots in self.snapshots.values()
+                         for snapshot in source_snapshots]
+        snapshots += [registry_snapshot(registry)
+                      for registry in self.registries]
+        metrics = {}
+        for snapshot in snapshots:
+            for (name, kind, documentation, samples) in snapshot:
+                (_, _, values) = metrics.setdefault(
+                    name, (kind, documentation, {}))
+                for (sample_name, labels, value) in samples:
+                    key = (sample_name, labels)
+                    values[key] = values.get(key, 0) + value
+        lines = []
+        for name, (kind, documentation, values) in metrics.items():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (sample_name, labels), value in values.items():
+                lines.append(f'{sample_name}{format_labels(labels)} '
+                             f'{format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class SyncCounter(Counter):
+    """number of syncs run with numbers of skipped and cancelled ones"""
+
+    def __init__(self, registry):
+        super().__init__('autorepeater_syncs', 'Number of syncs run')
+        registry.register(self)
+        self.skipped = registry.counter(
+            'autorepeater_syncs_skipped',
+            'Number of syncs skipped below threshold')
+        self.cancelled = registry.counter(
+            'autorepeater_syncs_cancelled',
+            'Number of syncs abandoned by deadline or newer trigger')
+
+
+class OrderCounter(Counter):
+    """number of orders by status with latency from trigger to first order"""
+
+    def __init__(self, registry):
+        super().__init__('autorepeater_orders', 'Number of orders by status')
+        registry.register(self)
+        self.first_order_seconds = registry.histogram(
+            'autorepeater_trigger_to_first_order_seconds',
+            'Latency from trigger to first posted order in seconds')
+        self.trigger_time = None
+
+    def posted(self):
+        """count posted order and measure trigger to first order latency"""
+        self.inc(status='posted')
+        if self.trigger_time is not None:
+            self.first_order_seconds.observe(
+                time.monotonic() - self.trigger_time)
+            self.trigger_time = None
+
+
+class SyncMetrics(Registry):
+    """metrics of sync_accounts stages
+
+    stages are also spans of the current trace if tracer is set, syncs
+    selected by profiler are profiled
+    """
+
+    def __init__(self, tracer=None, profiler=None):
+        super().__init__()
+        self.tracer = tracer
+        self.profiler = profiler
+        self.stage_seconds = self.histogram(
+            'autorepeater_sync_stage_seconds',
+            'Duration of sync stages in seconds')
+        self.sync_seconds = self.histogram(
+            'autorepeater_sync_seconds',
+            'Duration of whole sync in seconds')
+        self.syncs = SyncCounter(self)
+        self.orders = OrderCounter(self)
+        self.plans = self.counter(
+            'autorepeater_plans', 'Number of sync plans by kind')
+
+    def begin_sync(self, trigger_time=None):
+        """start measuring sync caused by trigger at monotonic time"""
+        self.orders.trigger_time = trigger_time or time.monotonic()
+        self.syncs.inc()
+
+    def trace(self, name, start_time=None, **attributes):
+        """root span of sync trace if tracer is set"""
+        if self.tracer is None:
+            return contextlib.nullcontext(NOOP_SPAN)
+        return self.tracer.trace(name, start_time, **attributes)
+
+    def profile(self, sync_id, account_id=None):
+        """profile sync if it is selected by profiler"""
+        if self.profiler and self.profiler.should_profile(sync_id):
+            return self.profiler.profile(sync_id, account_id)
+        return contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def stage(self, name, **attributes):
+        """measure duration of sync stage, yields its span"""
+        start = time.monotonic()
+        try:
+            if self.tracer is None:
+                yield NOOP_SPAN
+            else:
+                with self.tracer.span(name, **attributes) as span:
+                    yield span
+        finally:
+            self.stage_seconds.observe(time.monotonic() - start, stage=name)
+
+    def bind(self, func):
+        """func running in pool threads as part of the current span"""
+        if self.tracer is None:
+            return func
+        tracer = self.tracer
+        parent = tracer.current()
+
+        def bound(*args, **kwargs):
+            with tracer.attach(parent):
+                return func(*args, **kwargs)
+        return bound
+
+    def order_posted(self):
+        """count posted order and measure trigger to first order latency"""
+        self.orders.posted()
+
+    def order_failed(self):
+        """count failed order"""
+        self.orders.inc(status='failed')
+
+    def end_sync(self, start_time):
+        """measure whole sync duration"""
+        self.sync_seconds.observe(time.monotonic() - start_time)
+        self.orders.trigger_time = None
+
+
+def write_textfile(registry, path):
+    """atomically write metrics to file for node_exporter textfile collector"""
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(registry.render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def start_textfile_exporter(registry, path, interval=15.0):
+    """periodically write metrics to file in daemon thread"""
+    def loop():
+        while True:
+            try:
+                write_textfile(registry, path)
+            except OSError as err:
+                logging.error('не удалось записать метрики в %s: %s', path, err)
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name='metrics-textfile',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def start_http_exporter(registry, port, addr='127.0.0.1'):
+    """serve metrics over http in daemon thread"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """handler for GET /metrics"""
+
+        def do_GET(self):  # pylint: disable=C0103
+            """return rendered metrics"""
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=W0622
+            """do not log every scrape"""
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='metrics-http', daemon=True)
+    thread.start()
+    return server
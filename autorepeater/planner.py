@@ -0,0 +1,111 @@
+"""Offline rebalance planning from saved portfolio snapshots
+
+Runs the same planning as sync_accounts (calc_ratio, calc_sell_positions,
+calc_buy_positions) against snapshots with no network at all. Snapshots
+are PortfolioResponse in the recording JSON format, catalog is a JSON
+list of instruments with uid, name, ticker, lot and trading_status.
+"""
+import json
+from decimal import Decimal
+
+from tinkoff.invest import FindInstrumentResponse
+from tinkoff.invest import Instrument
+from tinkoff.invest import InstrumentResponse
+from tinkoff.invest import InstrumentShort
+from tinkoff.invest import PortfolioResponse
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import currency_to_decimal_price
+from autorepeater.autorepeater import format_decimal
+from autorepeater.recording import from_jsonable
+from autorepeater.recording import read_recording
+from autorepeater.replay import ReplayClient
+
+SRC = 'src'
+DST = 'dst'
+
+
+def load_json(path):
+    """load json file"""
+    with open(path, encoding='utf-8') as json_file:
+        return json.load(json_file)
+
+
+def make_records(src_portfolio, dst_portfolio, instruments):
+    """recording records for offline client"""
+    records = [
+        {'t': 0.0, 'kind': 'portfolio', 'key': SRC, 'response': src_portfolio},
+        {'t': 0.0, 'kind': 'portfolio', 'key': DST, 'response': dst_portfolio},
+    ]
+    for instrument in instruments:
+        records.append({'t': 0.0, 'kind': 'instrument', 'key': instrument.uid,
+                        'response': InstrumentResponse(instrument=instrument)})
+        records.append({'t': 0.0, 'kind': 'find_instrument',
+                        'key': instrument.uid,
+                        'response': FindInstrumentResponse(instruments=[
+                            InstrumentShort(uid=instrument.uid,
+                                            name=instrument.name,
+                                            ticker=instrument.ticker)])})
+    return records
+
+
+def load_snapshots(src_path, dst_path, catalog_path):
+    """records from snapshot and catalog files"""
+    return make_records(
+        from_jsonable(PortfolioResponse, load_json(src_path)),
+        from_jsonable(PortfolioResponse, load_json(dst_path)),
+        [from_jsonable(Instrument, item) for item in load_json(catalog_path)])
+
+
+def load_from_recording(path, src_account_id, dst_account_id):
+    """records with the latest portfolios and instruments from recording"""
+    keys = {src_account_id: SRC, dst_account_id: DST}
+    latest = {}
+    for record in read_recording(path):
+        if record['kind'] == 'portfolio' and record['key'] in keys:
+            latest[('portfolio', keys[record['key']])] = record
+        elif record['kind'] in ('instrument', 'find_instrument'):
+            latest[(record['kind'], record['key'])] = record
+    if ('portfolio', SRC) not in latest or ('portfolio', DST) not in latest:
+        raise ValueError('recording has no portfolios of both accounts')
+    return [dict(record, t=0.0, key=key[1])
+            for key, record in latest.items()]
+
+
+def order_to_json(order_params, positions):
+    """order params with price as json compatible dict"""
+    price = currency_to_decimal_price(positions[order_params.instrument_id])
+    return {
+        'instrument_id': order_params.instrument_id,
+        'direction': order_params.direction.name,
+        'quantity': order_params.quantity,
+        'price': format_decimal(price),
+    }
+
+
+def plan_offline(records, thresholds, reserves):
+    """plans for every reserve and threshold combination"""
+    results = []
+    for reserve in reserves:
+        autorepeater = AutoRepeater(ReplayClient(records, speed=0.0))
+        autorepeater.set_debug(True)
+        autorepeater.set_reserve(reserve)
+        plan = autorepeater.plan_sync(SRC, DST)
+        notional = plan.notional(autorepeater.current.rates)
+        sell = [order_to_json(order_params, plan.dst_positions)
+                for order_params in plan.orders_params_sell]
+        buy = [order_to_json(order_params, plan.src_positions)
+               for order_params in plan.orders_params_buy]
+        for threshold in thresholds:
+            autorepeater.set_threshold(threshold)
+            results.append({
+                'reserve': reserve,
+                'threshold': threshold,
+                'ratio': format_decimal(plan.ratio),
+                'total_dst': format_decimal(plan.total_dst),
+                'notional': format_decimal(Decimal(notional)),
+                'post': notional > plan.total_dst * autorepeater.threshold,
+                'sell': sell,
+                'buy': buy,
+            })
+    return results
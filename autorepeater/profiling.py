@@ -0,0 +1,71 @@
+"""Profiling of sync_accounts invocations"""
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+
+class SyncProfiler:
+    """cProfile session around every Nth sync
+
+    profiler is shared by pairs of process, only one sync is profiled at
+    a time as cProfile sessions can not run in parallel threads
+    """
+
+    def __init__(self, directory, every=1, top=20, level=logging.INFO):
+        if every < 1:
+            raise ValueError("Profile every must be positive")
+        self.directory = directory
+        self.every = every
+        self.top = top
+        self.level = level
+        self.lock = threading.Lock()
+        self.active = False
+
+    def should_profile(self, sync_id):
+        """check that sync must be profiled"""
+        return sync_id % self.every == 0
+
+    def profile_path(self, sync_id, account_id=None):
+        """timestamped file name for profile of sync of account"""
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if account_id:
+            stamp = f'{account_id}-{stamp}'
+        return os.path.join(self.directory, f'sync-{stamp}-{sync_id}.prof')
+
+    def hot_functions(self, profiler):
+        """top functions by own time as text"""
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        return stream.getvalue()
+
+    @contextlib.contextmanager
+    def profile(self, sync_id, account_id=None):
+        """profile code inside scope and save results
+
+        scope is not profiled while another sync is profiled
+        """
+        with self.lock:
+            busy = self.active
+            self.active = True
+        if busy:
+            yield None
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            with self.lock:
+                self.active = False
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.profile_path(sync_id, account_id)
+            profiler.dump_stats(path)
+            logging.log(self.level, 'профиль синхронизации %d: %s\n%s',
+                        sync_id, path, self.hot_functions(profiler))
@@ -0,0 +1,156 @@
+"""Periodic reconciliation of dst account between stream triggers
+
+A missed stream event or a partial fill leaves dst account off target
+until the next trigger. Reconciler runs a cheap drift check in market
+hours with a jittered interval, so several robots do not hit the API at
+the same moment, and requests a full sync only when drift exceeds band.
+"""
+import logging
+import random
+from decimal import Decimal
+
+from autorepeater.autorepeater import currency_to_decimal_price
+from autorepeater.autorepeater import format_decimal
+from autorepeater.autorepeater import get_quantity_position
+from autorepeater.autorepeater import value_positions
+from autorepeater.cancellation import SyncBudget
+from autorepeater.cancellation import SyncCancelled
+from autorepeater.channel import MARKET_HOURS
+from autorepeater.channel import Heartbeat
+from autorepeater.fx import price_rate
+
+RECONCILE_INTERVAL = 600.0
+# Случайное отклонение интервала сверки, доля интервала
+RECONCILE_JITTER = 0.2
+
+
+def holdings_drift(src_positions, dst_positions, ratio, rates=None):
+    """value of sells or buys bringing dst to ratio of src, the larger one
+
+    lots are not taken into account, so it needs no instruments
+    """
+    total_sell = Decimal('0')
+    total_buy = Decimal('0')
+    for item_id in set(src_positions) | set(dst_positions):
+        position = src_positions.get(item_id) or dst_positions[item_id]
+        price = currency_to_decimal_price(position) * price_rate(position,
+                                                                 rates)
+        target = (ratio * get_quantity_position(src_positions[item_id])
+                  if item_id in src_positions else Decimal('0'))
+        held = (get_quantity_position(dst_positions[item_id])
+                if item_id in dst_positions else Decimal('0'))
+        if held > target:
+            total_sell += (held - target) * price
+        else:
+            total_buy += (target - held) * price
+    return max(total_sell, total_buy)
+
+
+class Reconciler(Heartbeat):
+    """periodic drift check in market hours with jittered interval"""
+    name = 'reconciler'
+
+    def __init__(self, call, interval=RECONCILE_INTERVAL,
+                 jitter=RECONCILE_JITTER, hours=MARKET_HOURS):
+        if not 0 <= jitter < 1:
+            raise ValueError("Reconcile jitter must be between 0 and 1")
+        super().__init__(call, interval=interval, hours=hours)
+        self.jitter = jitter
+        self.random = random.Random()
+
+    def delay(self):
+        """interval shifted by random jitter"""
+        return self.interval * (1 + self.random.uniform(-self.jitter,
+                                                        self.jitter))
+
+
+class DriftCheck:
+    """cheap drift checks of account pair escalating to full sync
+
+    band - drift share escalating check to sync, None is threshold of
+    pair; checks are counted in registry by result
+    """
+
+    # pylint: disable=R0913,R0917
+    def __init__(self, registry, interval=RECONCILE_INTERVAL,
+                 jitter=RECONCILE_JITTER, hours=MARKET_HOURS,
+                 level=logging.INFO):
+        if interval <= 0:
+            raise ValueError("Reconcile interval must be positive")
+        if not 0 <= jitter < 1:
+            raise ValueError("Reconcile jitter must be between 0 and 1")
+        self.interval = interval
+        self.jitter = jitter
+        self.hours = hours
+        self.level = level
+        self.band = None
+        self.checks = registry.counter(
+            'autorepeater_reconciliations',
+            'Number of periodic drift checks by result')
+    # pylint: enable=R0913,R0917
+
+    def set_band(self, band):
+        """set drift share escalating check to sync, None is threshold"""
+        if band is not None:
+            if band < 0 or band > 1:
+                raise ValueError("Drift band must be between 0 and 1")
+            # Оставляем преобразование здесь, так как входной параметр float
+            band = Decimal(str(band))
+        self.band = band
+
+    @staticmethod
+    def measure(autorepeater, src_account_id, dst_account_id, budget=None):
+        """share of dst account to trade to reach target by portfolios only
+
+        budget - limits portfolio requests of the check, by default it is
+        separate budget with sync deadline
+        """
+        with autorepeater.current.own_budget(
+                budget or SyncBudget(autorepeater.current.deadline)):
+            positions_src = autorepeater.get_portfolio(src_account_id).positions
+            positions_dst = autorepeater.get_portfolio(dst_account_id).positions
+        rates = autorepeater.get_rates(list(positions_src) +
+                                       list(positions_dst))
+        fx = autorepeater.features.fx
+        (src_positions, total_src, _) = value_positions(
+            positions_src, rates, fx)
+        (dst_positions, _, total_dst) = value_positions(
+            positions_dst, rates, fx)
+        total_dst = total_dst * (Decimal('1') - autorepeater.reserve)
+        if not total_src or not total_dst:
+            return Decimal('0')
+        return holdings_drift(src_positions, dst_positions,
+                              total_dst / total_src, rates) / total_dst
+
+    def check(self, autorepeater, src_account_id, dst_account_id):
+        """drift check between syncs, True if a full sync is needed
+
+        sync is needed when drift exceeds band or threshold, check shares
+        the single-flight guard with syncs and is skipped while a sync is
+        running
+        """
+        if autorepeater.current.lock.locked():
+            self.checks.inc(result='busy')
+            return False
+        try:
+            # Синхронизация, начатая после проверки, только задержит сверку
+            with autorepeater.current.lock, \
+                    autorepeater.metrics.stage('reconcile'):
+                drift = self.measure(autorepeater, src_account_id,
+                                     dst_account_id)
+        except SyncCancelled:
+            self.checks.inc(result='busy')
+            return False
+        band = autorepeater.threshold if self.band is None else self.band
+        escalate = drift > band
+        self.checks.inc(result='escalated' if escalate else 'in_band')
+        logging.log(self.level, 'сверка: отклонение %s', format_decimal(drift),
+                    extra=autorepeater.current.log_extra(
+                        account=dst_account_id, tracking_error=float(drift),
+                        escalated=escalate))
+        return escalate
+
+    def start(self, call):
+        """start reconciler running call with jittered interval"""
+        return Reconciler(call, interval=self.interval, jitter=self.jitter,
+                          hours=self.hours).start()
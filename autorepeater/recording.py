@@ -0,0 +1,169 @@
+"""Recording of positions_stream sessions
+
+Recording is an append-only JSONL file: stream responses, portfolios
+and instruments fetched during syncs with wall clock time. Responses
+are recorded by a client proxy, so syncs do not know about recording.
+"""
+import dataclasses
+import datetime
+import enum
+import json
+import threading
+import time
+import types
+import typing
+from decimal import Decimal
+
+from tinkoff.invest import FindInstrumentResponse
+from tinkoff.invest import InstrumentResponse
+from tinkoff.invest import PortfolioResponse
+from tinkoff.invest import PositionsStreamResponse
+from tinkoff.invest import WithdrawLimitsResponse
+
+KINDS = {
+    'stream': PositionsStreamResponse,
+    'portfolio': PortfolioResponse,
+    'instrument': InstrumentResponse,
+    'find_instrument': FindInstrumentResponse,
+    'withdraw_limits': WithdrawLimitsResponse,
+}
+# Вызовы API, ответы которых пишутся в запись: вид записи и аргумент ключа
+RECORDED_CALLS = {
+    'operations.get_portfolio': ('portfolio', 'account_id'),
+    'operations.get_withdraw_limits': ('withdraw_limits', 'account_id'),
+    'instruments.get_instrument_by': ('instrument', 'id'),
+    'instruments.find_instrument': ('find_instrument', 'query'),
+}
+
+
+def to_jsonable(value):
+    """convert api dataclass to json compatible value"""
+    if dataclasses.is_dataclass(value):
+        return {field.name: to_jsonable(getattr(value, field.name))
+                for field in dataclasses.fields(value)
+                if getattr(value, field.name) is not None}
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
+
+
+def from_jsonable(value_type, value):
+    """convert json compatible value back to value of value_type"""
+    if value is None:
+        return None
+    origin = typing.get_origin(value_type)
+    if origin is typing.Union:
+        value_type = next(arg for arg in typing.get_args(value_type)
+                          if arg is not types.NoneType)
+        return from_jsonable(value_type, value)
+    if origin in (list, typing.List):
+        (item_type,) = typing.get_args(value_type) or (typing.Any,)
+        return [from_jsonable(item_type, item) for item in value]
+    if dataclasses.is_dataclass(value_type):
+        hints = typing.get_type_hints(value_type)
+        return value_type(**{name: from_jsonable(hints[name], item)
+                             for name, item in value.items()
+                             if name in hints})
+    return from_scalar(value_type, value)
+
+
+def from_scalar(value_type, value):
+    """convert json scalar back to enum, datetime or decimal value_type"""
+    if not isinstance(value_type, type):
+        return value
+    if issubclass(value_type, enum.Enum):
+        return value_type(value)
+    if issubclass(value_type, datetime.datetime):
+        return datetime.datetime.fromisoformat(value)
+    if issubclass(value_type, Decimal):
+        return Decimal(value)
+    return value
+
+
+class StreamRecorder:
+    """append-only JSONL recorder of stream responses and fetched state"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # pylint: disable=R1732
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def record(self, kind, response, key=None):
+        """append one record"""
+        line = json.dumps({
+            't': round(time.time(), 6),
+            'kind': kind,
+            'key': key,
+            'response': to_jsonable(response),
+        }, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        """close recording file"""
+        self.file.close()
+
+
+class RecordingService:  # pylint: disable=R0903
+    """proxy for client service recording responses of its calls"""
+
+    def __init__(self, service, service_name, recorder):
+        self._service = service
+        self._service_name = service_name
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        method = f'{self._service_name}.{name}'
+        if method == 'operations_stream.positions_stream':
+            def recorded_stream(*args, **kwargs):
+                for response in attr(*args, **kwargs):
+                    self._recorder.record('stream', response)
+                    yield response
+            return recorded_stream
+        if method not in RECORDED_CALLS:
+            return attr
+        (kind, key) = RECORDED_CALLS[method]
+
+        def recorded(*args, **kwargs):
+            response = attr(*args, **kwargs)
+            self._recorder.record(kind, response, kwargs.get(key))
+            return response
+        return recorded
+
+
+class RecordingClient:  # pylint: disable=R0903
+    """proxy for Client recording stream responses and fetched state"""
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+        self.services = {}
+
+    def __getattr__(self, name):
+        if name not in self.services:
+            self.services[name] = RecordingService(
+                getattr(self.client, name), name, self.recorder)
+        return self.services[name]
+
+
+def read_recording(path):
+    """records of recording file with responses restored to dataclasses"""
+    records = []
+    with open(path, encoding='utf-8') as recording:
+        for line in recording:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record['response'] = from_jsonable(KINDS[record['kind']],
+                                               record['response'])
+            records.append(record)
+    return records
@@ -0,0 +1,166 @@
+"""Replay of recorded positions_stream sessions
+
+Feeds a recording back through mainflow at original or accelerated
+speed against a client answering from the recording:
+
+    python -m autorepeater.replay session.jsonl --src SRC --dst DST --speed 10
+"""
+import argparse
+import bisect
+import collections
+import json
+import logging
+import sys
+import time
+import uuid
+
+from tinkoff.invest import PostOrderResponse
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import check_triggers
+from autorepeater.benchmark import percentile
+from autorepeater.benchmark import time_mainflow
+from autorepeater.recording import read_recording
+from autorepeater.simulation import SimulationFinished
+
+
+class ReplayState:  # pylint: disable=R0903
+    """recorded responses indexed by key and time"""
+
+    def __init__(self, records, speed):
+        self.speed = speed
+        self.stream = collections.deque(
+            record for record in records if record['kind'] == 'stream')
+        self.responses = {}
+        for record in records:
+            if record['kind'] != 'stream':
+                self.responses.setdefault(
+                    (record['kind'], record['key']), []).append(
+                        (record['t'], record['response']))
+        self.now = 0.0
+        self.orders = []
+
+    def response(self, kind, key):
+        """first response recorded after the current stream time"""
+        recorded = self.responses.get((kind, key))
+        if not recorded:
+            raise KeyError(f'{kind} {key} is absent in recording')
+        index = bisect.bisect_left([item[0] for item in recorded], self.now)
+        return recorded[min(index, len(recorded) - 1)][1]
+
+
+class ReplayService:  # pylint: disable=R0903
+    """base for services of replay client"""
+
+    def __init__(self, state):
+        self.state = state
+
+
+class ReplayInstruments(ReplayService):
+    """instruments service from recording"""
+
+    def find_instrument(self, query):
+        """recorded instrument search"""
+        return self.state.response('find_instrument', query)
+
+    # pylint: disable=W0622,C0103
+    def get_instrument_by(self, id_type, id):
+        """recorded instrument"""
+        del id_type
+        return self.state.response('instrument', id)
+    # pylint: enable=W0622,C0103
+
+
+class ReplayOperations(ReplayService):
+    """operations service from recording"""
+
+    def get_portfolio(self, account_id):
+        """recorded portfolio"""
+        return self.state.response('portfolio', account_id)
+
+    def get_withdraw_limits(self, account_id):
+        """recorded available money"""
+        return self.state.response('withdraw_limits', account_id)
+
+
+class ReplayOrders(ReplayService):  # pylint: disable=R0903
+    """orders service accepting every order"""
+
+    def post_order(self, **kwargs):
+        """accept order"""
+        self.state.orders.append(kwargs)
+        return PostOrderResponse(order_id=str(uuid.uuid4()))
+
+
+class ReplayOperationsStream(ReplayService):  # pylint: disable=R0903
+    """stream of recorded responses at original or accelerated speed"""
+
+    def positions_stream(self, accounts):
+        """recorded stream responses"""
+        del accounts
+        previous = None
+        while self.state.stream:
+            record = self.state.stream.popleft()
+            if previous is not None and self.state.speed:
+                time.sleep(max(0.0, record['t'] - previous) / self.state.speed)
+            previous = record['t']
+            self.state.now = record['t']
+            yield record['response']
+        raise SimulationFinished()
+
+
+class ReplayClient:  # pylint: disable=R0903
+    """client answering from recording"""
+
+    def __init__(self, records, speed=1.0):
+        self.state = ReplayState(records, speed)
+        self.instruments = ReplayInstruments(self.state)
+        self.operations = ReplayOperations(self.state)
+        self.orders = ReplayOrders(self.state)
+        self.operations_stream = ReplayOperationsStream(self.state)
+
+
+def replay(records, src, dst, speed=0.0, configure=None):
+    """feed recording through mainflow and measure syncs
+
+    speed - acceleration of recorded pauses, 0 replays without pauses;
+    configure - optional callable tuning AutoRepeater before replay
+    """
+    client = ReplayClient(records, speed)
+    autorepeater = AutoRepeater(client)
+    if configure:
+        configure(autorepeater)
+    triggers = sum(1 for record in client.state.stream
+                   if check_triggers(record['response'].position, src, dst))
+    events = len(client.state.stream)
+    start = time.perf_counter()
+    durations = time_mainflow(autorepeater, src, dst)
+    return {
+        'events': events,
+        'triggers': triggers,
+        'syncs': len(durations),
+        'orders': len(client.state.orders),
+        'wall_seconds': time.perf_counter() - start,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    """main function"""
+    parser = argparse.ArgumentParser(description="autorepeater replay")
+    parser.add_argument("recording", type=str, help="файл записи сессии")
+    parser.add_argument("-s", "--src", type=str, required=True)
+    parser.add_argument("-d", "--dst", type=str, required=True)
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="ускорение пауз между событиями, 0 - без пауз")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.ERROR)
+    report = replay(read_recording(args.recording), args.src, args.dst,
+                    args.speed)
+    json.dump(report, sys.stdout, indent=1)
+    sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Deadlines of api calls and idempotent retries of orders
+
+Every unary call gets an explicit deadline by client interceptor. Orders
+carry a deterministic client order id, so a retry of a timed out order
+is deduplicated by the broker instead of posting it twice.
+"""
+import collections
+import threading
+import uuid
+
+import grpc
+
+# Дедлайны запросов, секунды: заявки короче, что бы медленный шлюз не
+# задерживал синхронизацию
+CALL_DEADLINE = 10.0
+ORDER_DEADLINE = 3.0
+ORDER_RETRIES = 3
+RETRY_BACKOFF = 0.2
+ORDERS_SERVICE = '/tinkoff.public.invest.api.contract.v1.OrdersService/'
+RETRYABLE_CODES = (grpc.StatusCode.DEADLINE_EXCEEDED,
+                   grpc.StatusCode.UNAVAILABLE)
+
+
+def client_order_id(run_id, sync_id, instrument_id, direction, sequence=0):
+    """deterministic order id of sync, instrument, direction
+
+    sequence distinguishes orders of the same instrument and direction
+    posted by one sync, e.g. by convergence rounds or child orders
+    """
+    return str(uuid.uuid5(run_id, f'{sync_id}:{instrument_id}:'
+                                  f'{int(direction)}:{sequence}'))
+
+
+class OrderSequence:
+    """client order ids of orders posted for one sync
+
+    every instrument and direction has its own sequence, scoped sequences
+    of child orders are posted for the sync after it has finished and must
+    not reuse ids of orders of the sync itself
+    """
+
+    def __init__(self, run_id, sync_id, scope=None):
+        self.run_id = run_id
+        self.sync_id = sync_id
+        self.scope = scope
+        self.sequences = {}
+        self.lock = threading.Lock()
+
+    def next_id(self, instrument_id, direction):
+        """client order id for the next order of instrument and direction"""
+        key = (instrument_id, direction)
+        with self.lock:
+            sequence = self.sequences.get(key, 0)
+            self.sequences[key] = sequence + 1
+        sync_id = (self.sync_id if self.scope is None
+                   else f'{self.sync_id}:{self.scope}')
+        return client_order_id(self.run_id, sync_id, *key, sequence)
+
+    def scoped(self, scope):
+        """new sequence of the same sync for orders posted in background"""
+        return OrderSequence(self.run_id, self.sync_id, scope)
+
+
+def backoff_delay(attempt, base=RETRY_BACKOFF):
+    """exponential delay before retry attempt counted from zero"""
+    return base * 2 ** attempt
+
+
+class RetryPolicy:
+    """idempotent retries of timed out orders with exponential backoff"""
+
+    def __init__(self, retries=ORDER_RETRIES, backoff=RETRY_BACKOFF):
+        if retries < 0:
+            raise ValueError("Order retries must be non-negative")
+        if backoff < 0:
+            raise ValueError("Retry backoff must be non-negative")
+        self.retries = retries
+        self.backoff = backoff
+
+    def should_retry(self, attempt, err):
+        """check that order failed by err on attempt from zero is retried"""
+        return attempt < self.retries and err.code in RETRYABLE_CODES
+
+    def delay(self, attempt):
+        """seconds before retry of attempt counted from zero"""
+        return backoff_delay(attempt, self.backoff)
+
+
+class ClientCallDetails(
+        collections.namedtuple(
+            'ClientCallDetails',
+            ('method', 'timeout', 'metadata', 'credentials',
+             'wait_for_ready', 'compression')),
+        grpc.ClientCallDetails):
+    """call details with replaced timeout"""
+
+
+class DeadlineInterceptor(grpc.UnaryUnaryClientInterceptor):
+    """interceptor setting deadline of unary calls without one"""
+
+    def __init__(self, call_deadline=CALL_DEADLINE,
+                 order_deadline=ORDER_DEADLINE):
+        if call_deadline <= 0 or order_deadline <= 0:
+            raise ValueError("Deadlines must be positive")
+        self.call_deadline = call_deadline
+        self.order_deadline = order_deadline
+
+    def deadline(self, method):
+        """deadline of method in seconds"""
+        if isinstance(method, bytes):
+            method = method.decode()
+        if method.startswith(ORDERS_SERVICE):
+            return self.order_deadline
+        return self.call_deadline
+
+    def intercept_unary_unary(self, continuation, client_call_details,
+                              request):
+        """set deadline of call by its method unless caller set one"""
+        if client_call_details.timeout is None:
+            client_call_details = ClientCallDetails(
+                method=client_call_details.method,
+                timeout=self.deadline(client_call_details.method),
+                metadata=client_call_details.metadata,
+                credentials=client_call_details.credentials,
+                wait_for_ready=client_call_details.wait_for_ready,
+                compression=client_call_details.compression)
+        return continuation(client_call_details, request)
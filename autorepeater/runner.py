@@ -0,0 +1,613 @@
+"""Launch of autorepeater for one pair, shards of pairs and one sync"""
+import dataclasses
+import json
+import logging
+import os
+import signal
+import threading
+
+from tinkoff.invest import Client
+from tinkoff.invest import RequestError
+from tinkoff.invest.constants import INVEST_GRPC_API
+
+from autorepeater.accounting import CountingClient
+from autorepeater.autorepeater import IMPORTANT
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.catalog import CATALOG_FILE
+from autorepeater.catalog import CATALOG_TTL
+from autorepeater.catalog import InstrumentCatalog
+from autorepeater.catalog import fetch_catalog
+from autorepeater.catalog import write_catalog
+from autorepeater.channel import KEEPALIVE_TIME
+from autorepeater.channel import KEEPALIVE_TIMEOUT
+from autorepeater.channel import MARKET_HOURS
+from autorepeater.channel import Heartbeat
+from autorepeater.channel import channel_options
+from autorepeater.channel import warm_up
+from autorepeater.config import ConfigWatcher
+from autorepeater.config import apply_pairs
+from autorepeater.config import load_config
+from autorepeater.convergence import CONVERGENCE_WAIT
+from autorepeater.convergence import Convergence
+from autorepeater.delta import DeltaPlans
+from autorepeater.execution import LIMIT_ATTEMPTS
+from autorepeater.execution import LIMIT_TIMEOUT
+from autorepeater.execution import LimitOrderExecutor
+from autorepeater.execution import OrderExecution
+from autorepeater.fx import FX_TTL
+from autorepeater.fx import FxRates
+from autorepeater.instruments import InstrumentCache
+from autorepeater.journal import SyncJournal
+from autorepeater.logs import setup_logging
+from autorepeater.metrics import SyncMetrics
+from autorepeater.metrics import registry_snapshot
+from autorepeater.metrics import start_http_exporter
+from autorepeater.metrics import start_textfile_exporter
+from autorepeater.metrics import write_textfile
+from autorepeater.profiling import SyncProfiler
+from autorepeater.reconcile import RECONCILE_JITTER
+from autorepeater.reconcile import DriftCheck
+from autorepeater.recording import RecordingClient
+from autorepeater.recording import StreamRecorder
+from autorepeater.retries import CALL_DEADLINE
+from autorepeater.retries import ORDER_DEADLINE
+from autorepeater.retries import ORDER_RETRIES
+from autorepeater.retries import RETRY_BACKOFF
+from autorepeater.retries import DeadlineInterceptor
+from autorepeater.retries import RetryPolicy
+from autorepeater.slicing import SLICE_INTERVAL
+from autorepeater.slicing import SliceScheduler
+from autorepeater.state import StateFile
+from autorepeater.supervisor import METRICS_INTERVAL
+from autorepeater.supervisor import Supervisor
+from autorepeater.supervisor import shard_pairs
+from autorepeater.tracing import TRACE_SAMPLE
+from autorepeater.tracing import TraceExporter
+from autorepeater.tracing import Tracer
+
+
+@dataclasses.dataclass
+class BudgetParams:
+    """limits of one sync"""
+    calls: int = None
+    deadline: float = None
+
+
+@dataclasses.dataclass
+class FxParams:
+    """valuation and rebalancing of positions in foreign currencies"""
+    multi_currency: bool = False
+    ttl: float = FX_TTL
+    rebalance: bool = False
+
+
+@dataclasses.dataclass
+class ReconcileParams:
+    """periodic drift checks between stream events"""
+    interval: float = None
+    jitter: float = RECONCILE_JITTER
+    hours: tuple = MARKET_HOURS
+
+
+@dataclasses.dataclass
+class InstrumentParams:
+    """instrument caches and catalog shared by worker processes"""
+    ttl: float = None
+    catalog_file: str = CATALOG_FILE
+    catalog_ttl: float = CATALOG_TTL
+
+
+@dataclasses.dataclass
+class PairsParams:
+    """account pairs of supervisor mode and config of pairs"""
+    config_file: str = None
+    pairs_file: str = None
+    workers: int = None
+
+
+@dataclasses.dataclass
+class SyncParams:
+    """params of syncs of a pair"""
+    state_file: str = None
+    delta_tolerance: float = None
+    budget: BudgetParams = dataclasses.field(default_factory=BudgetParams)
+    fx: FxParams = dataclasses.field(default_factory=FxParams)
+    reconcile: ReconcileParams = dataclasses.field(
+        default_factory=ReconcileParams)
+    instruments: InstrumentParams = dataclasses.field(
+        default_factory=InstrumentParams)
+    pairs: PairsParams = dataclasses.field(default_factory=PairsParams)
+
+
+@dataclasses.dataclass
+class LimitParams:
+    """limit orders priced from order book"""
+    timeout: float = LIMIT_TIMEOUT
+    attempts: int = LIMIT_ATTEMPTS
+
+
+@dataclasses.dataclass
+class SliceParams:
+    """slicing of large orders into child orders"""
+    notional: float = None
+    depth_share: float = None
+    interval: float = SLICE_INTERVAL
+
+
+@dataclasses.dataclass
+class RetryParams:
+    """idempotent retries of orders after timeouts"""
+    retries: int = ORDER_RETRIES
+    backoff: float = RETRY_BACKOFF
+
+
+@dataclasses.dataclass
+class ConvergenceParams:
+    """re-planning rounds after orders are posted"""
+    rounds: int = 0
+    wait: float = CONVERGENCE_WAIT
+
+
+@dataclasses.dataclass
+class ExecutionParams:
+    """params of posting orders"""
+    mode: str = 'bestprice'
+    check_buying_power: bool = False
+    limit: LimitParams = dataclasses.field(default_factory=LimitParams)
+    slicing: SliceParams = dataclasses.field(default_factory=SliceParams)
+    retries: RetryParams = dataclasses.field(default_factory=RetryParams)
+    convergence: ConvergenceParams = dataclasses.field(
+        default_factory=ConvergenceParams)
+
+
+@dataclasses.dataclass
+class ChannelParams:
+    """grpc channel keepalive, message size and compression"""
+    keepalive_time: float = KEEPALIVE_TIME
+    keepalive_timeout: float = KEEPALIVE_TIMEOUT
+    max_message_size: float = None
+    compression: str = None
+
+
+@dataclasses.dataclass
+class DeadlineParams:
+    """deadlines of api calls and orders in seconds"""
+    call: float = CALL_DEADLINE
+    order: float = ORDER_DEADLINE
+
+
+@dataclasses.dataclass
+class HeartbeatParams:
+    """periodic lightweight call in market hours"""
+    interval: float = None
+    hours: tuple = MARKET_HOURS
+
+
+@dataclasses.dataclass
+class ConnectionParams:
+    """params of connection to api"""
+    target: str = INVEST_GRPC_API
+    channel: ChannelParams = dataclasses.field(default_factory=ChannelParams)
+    deadlines: DeadlineParams = dataclasses.field(
+        default_factory=DeadlineParams)
+    heartbeat: HeartbeatParams = dataclasses.field(
+        default_factory=HeartbeatParams)
+    warm_up: bool = False
+
+
+@dataclasses.dataclass
+class MetricsParams:
+    """export of metrics in Prometheus format"""
+    port: int = None
+    file: str = None
+
+
+@dataclasses.dataclass
+class TraceParams:
+    """tracing of syncs"""
+    target: str = None
+    sample: float = TRACE_SAMPLE
+    slow: float = None
+
+
+@dataclasses.dataclass
+class ProfileParams:
+    """profiling of syncs"""
+    directory: str = None
+    every: int = 1
+    top: int = 20
+
+
+@dataclasses.dataclass
+class OutputParams:
+    """params of logs, recordings, journal, metrics, traces and profiles"""
+    print_portfolio: str = None
+    log_json: bool = False
+    record_file: str = None
+    journal_file: str = None
+    metrics: MetricsParams = dataclasses.field(default_factory=MetricsParams)
+    trace: TraceParams = dataclasses.field(default_factory=TraceParams)
+    profile: ProfileParams = dataclasses.field(default_factory=ProfileParams)
+
+
+@dataclasses.dataclass
+class RunnerParams:
+    """params for init Runner class"""
+    debug: bool
+    threshold: float
+    reserve: float
+    sync: SyncParams = dataclasses.field(default_factory=SyncParams)
+    orders: ExecutionParams = dataclasses.field(
+        default_factory=ExecutionParams)
+    connection: ConnectionParams = dataclasses.field(
+        default_factory=ConnectionParams)
+    outputs: OutputParams = dataclasses.field(default_factory=OutputParams)
+
+
+def load_pairs(path):
+    """account pairs from json list of [src, dst]"""
+    with open(path, encoding='utf-8') as pairs_file:
+        items = json.load(pairs_file)
+    if not isinstance(items, list) or not all(
+            isinstance(item, list) and len(item) == 2 and
+            all(isinstance(account, str) for account in item)
+            for item in items):
+        raise ValueError('pairs file must be a list of [src, dst] accounts')
+    return [tuple(item) for item in items]
+
+
+# pylint: disable=R0913,R0917
+def run_worker(index, pairs, metrics_queue, token, params, catalog_path):
+    """entry of worker process serving shard of account pairs"""
+    Runner(token, None, None, params).run_pairs(index, pairs, metrics_queue,
+                                                catalog_path)
+# pylint: enable=R0913,R0917
+
+
+class Runner:
+    """wrapper for launch autorwpeater"""
+
+    def __init__(self,
+                 token,
+                 src,
+                 dst,
+                 params=RunnerParams(debug=False,
+                                     threshold=None,
+                                     reserve=None)):
+        self.token = token
+        self.params = params
+        self.src = src
+        self.dst = dst
+        logging.addLevelName(IMPORTANT, 'IMPORTANT')
+        setup_logging(IMPORTANT, json_format=params.outputs.log_json)
+
+    def run(self):
+        """run mainflow for server variant"""
+        outputs = self.params.outputs
+        recorder = None
+        if self.src and self.dst and outputs.record_file:
+            recorder = StreamRecorder(outputs.record_file)
+        with Client(token=self.token, target=self.params.connection.target,
+                    options=self.make_channel_options(),
+                    interceptors=self.make_interceptors()) as client:
+            autorepeater = self.make_autorepeater(
+                client if recorder is None else
+                RecordingClient(client, recorder))
+            if outputs.print_portfolio:
+                autorepeater.print_all_portfolio(
+                    summary_only=outputs.print_portfolio == 'summary')
+            self.export_metrics(autorepeater)
+            if self.src and self.dst:
+                if self.params.connection.warm_up:
+                    try:
+                        warm_up(autorepeater, self.src, self.dst)
+                    except RequestError as err:
+                        logging.error(err)
+                heartbeat = self.make_heartbeat(client)
+                watcher = self.make_config_watcher({self.dst: autorepeater})
+                try:
+                    autorepeater.mainflow(self.src, self.dst)
+                finally:
+                    if watcher:
+                        watcher.stop()
+                    if heartbeat:
+                        heartbeat.stop()
+                    if autorepeater.features.journal:
+                        autorepeater.features.journal.close()
+                    if autorepeater.metrics.tracer:
+                        autorepeater.metrics.tracer.close()
+                    if recorder:
+                        recorder.close()
+
+    def make_autorepeater(self, client, outputs=None):
+        """autorepeater over counting client with params applied
+
+        outputs - journal, tracer and profiler shared by pairs of worker,
+        they are created for autorepeater if it is not set
+        """
+        (journal, tracer, profiler) = outputs or self.make_outputs()
+        sync = self.params.sync
+        metrics = SyncMetrics(tracer=tracer, profiler=profiler)
+        client = CountingClient(client, budget=sync.budget.calls)
+        features = SyncFeatures(orders=self.make_orders(metrics),
+                                fx=self.make_fx(client), journal=journal)
+        if sync.instruments.ttl is not None:
+            features.instruments = InstrumentCache(ttl=sync.instruments.ttl)
+        if sync.state_file:
+            features.state = StateFile(sync.state_file)
+        if sync.delta_tolerance is not None:
+            features.delta = DeltaPlans(sync.delta_tolerance, level=IMPORTANT)
+        if sync.reconcile.interval is not None:
+            features.reconcile = DriftCheck(
+                metrics, interval=sync.reconcile.interval,
+                jitter=sync.reconcile.jitter, hours=sync.reconcile.hours,
+                level=IMPORTANT)
+        autorepeater = AutoRepeater(client, features, metrics)
+        autorepeater.set_debug(self.params.debug)
+        autorepeater.set_threshold(self.params.threshold)
+        autorepeater.set_reserve(self.params.reserve)
+        autorepeater.set_sync_deadline(sync.budget.deadline)
+        return autorepeater
+
+    def run_supervisor(self):
+        """shard account pairs across worker processes sharing catalog"""
+        pairs_params = self.params.sync.pairs
+        instruments = self.params.sync.instruments
+        metrics = self.params.outputs.metrics
+        if pairs_params.pairs_file:
+            pairs = load_pairs(pairs_params.pairs_file)
+        else:
+            pairs = [(pair.src, pair.dst) for pair in load_config(
+                pairs_params.config_file, self.config_defaults())]
+        shards = shard_pairs(pairs, pairs_params.workers or os.cpu_count())
+        with Client(token=self.token, target=self.params.connection.target,
+                    options=self.make_channel_options(),
+                    interceptors=self.make_interceptors()) as client:
+            def refresh():
+                try:
+                    write_catalog(instruments.catalog_file,
+                                  fetch_catalog(client))
+                except (RequestError, OSError) as err:
+                    logging.error('не удалось обновить справочник: %s', err)
+
+            refresh()
+            supervisor = Supervisor(
+                run_worker, shards,
+                args=(self.token, self.params, instruments.catalog_file),
+                level=IMPORTANT)
+            supervisor.set_refresh(refresh, instruments.catalog_ttl)
+            if pairs_params.config_file and hasattr(signal, 'SIGHUP'):
+                def reload(signum, frame):
+                    supervisor.signal_workers(signum, frame)
+                    if not pairs_params.pairs_file:
+                        self.check_config_pairs(pairs)
+                signal.signal(signal.SIGHUP, reload)
+            if metrics.port:
+                start_http_exporter(supervisor.registry, metrics.port)
+            if metrics.file:
+                start_textfile_exporter(supervisor.registry, metrics.file)
+            logging.log(IMPORTANT, 'супервизор: %d пар счетов в %d процессах',
+                        len(pairs), len(shards))
+            supervisor.start().run()
+
+    def check_config_pairs(self, pairs):
+        """warn that pairs added to or removed from config need restart"""
+        try:
+            configured = [(pair.src, pair.dst) for pair in load_config(
+                self.params.sync.pairs.config_file, self.config_defaults())]
+        except (OSError, ValueError):
+            # Ошибку конфигурации покажут воркеры
+            return
+        if set(configured) != set(pairs):
+            logging.warning('пары счетов в конфигурации изменились: в режиме '
+                            'супервизора пары добавляются и удаляются только '
+                            'перезапуском')
+
+    def run_pairs(self, index, pairs, metrics_queue, catalog_path):
+        """run mainflow of every pair of shard in own thread on one client
+
+        worker exits when any pair stops, supervisor restarts it
+        """
+        autorepeaters = {}
+        watcher = self.config_watcher(autorepeaters)
+        if watcher:
+            # SIGHUP от супервизора не должен завершать запускающийся воркер
+            watcher.listen()
+        outputs = self.make_outputs(index)
+        with Client(token=self.token, target=self.params.connection.target,
+                    options=self.make_channel_options(),
+                    interceptors=self.make_interceptors()) as client:
+            threads = self.start_pairs(client, pairs, outputs,
+                                       InstrumentCatalog(catalog_path),
+                                       autorepeaters)
+            self.make_config_watcher(autorepeaters, watcher)
+            while all(thread.is_alive() for thread in threads):
+                metrics_queue.put((index, [
+                    registry_snapshot(autorepeater.metrics)
+                    for autorepeater in autorepeaters.values()]))
+                threads[0].join(METRICS_INTERVAL)
+            logging.error('воркер %d: синхронизация пары остановилась', index)
+        (journal, tracer, _) = outputs
+        if journal:
+            journal.close()
+        if tracer:
+            tracer.close()
+
+    # pylint: disable=R0913,R0917
+    def start_pairs(self, client, pairs, outputs, catalog, autorepeaters):
+        """start mainflow of every pair in own thread
+
+        autorepeaters are added to dict by dst account, returns threads
+        """
+        state_file = self.params.sync.state_file
+        threads = []
+        for (src, dst) in pairs:
+            autorepeater = self.make_autorepeater(client, outputs)
+            autorepeater.features.instruments.catalog = catalog
+            if state_file:
+                autorepeater.features.state = StateFile(f'{state_file}.{dst}')
+            autorepeaters[dst] = autorepeater
+            threads.append(threading.Thread(
+                target=autorepeater.mainflow, args=(src, dst),
+                name=f'pair-{dst}', daemon=True))
+        for thread in threads:
+            thread.start()
+        return threads
+    # pylint: enable=R0913,R0917
+
+    def run_sync(self):
+        """run one sync for serverless varian"""
+        config_file = self.params.sync.pairs.config_file
+        with Client(token=self.token, target=self.params.connection.target,
+                    options=self.make_channel_options(),
+                    interceptors=self.make_interceptors()) as client:
+            autorepeater = self.make_autorepeater(client)
+            if config_file:
+                apply_pairs({self.dst: autorepeater}, load_config(
+                    config_file, self.config_defaults()))
+            if self.src and self.dst:
+                autorepeater.sync_accounts(self.src, self.dst)
+            executor = autorepeater.features.orders.executor
+            if isinstance(executor, SliceScheduler):
+                executor.wait()
+            if autorepeater.features.journal:
+                autorepeater.features.journal.close()
+            if autorepeater.metrics.tracer:
+                autorepeater.metrics.tracer.close()
+            if self.params.outputs.metrics.file:
+                write_textfile(autorepeater.metrics,
+                               self.params.outputs.metrics.file)
+
+    def make_channel_options(self):
+        """grpc channel arguments from params"""
+        channel = self.params.connection.channel
+        return channel_options(keepalive_time=channel.keepalive_time,
+                               keepalive_timeout=channel.keepalive_timeout,
+                               max_message_size=channel.max_message_size,
+                               compression=channel.compression)
+
+    def make_heartbeat(self, client):
+        """start periodic lightweight call if it is enabled
+
+        heartbeat goes past CountingClient to keep sync call counts clean
+        """
+        heartbeat = self.params.connection.heartbeat
+        if not heartbeat.interval:
+            return None
+        return Heartbeat(client.users.get_accounts,
+                         interval=heartbeat.interval,
+                         hours=heartbeat.hours).start()
+
+    def config_defaults(self):
+        """pair values from command line used when config omits them"""
+        return {'threshold': self.params.threshold,
+                'reserve': self.params.reserve}
+
+    def config_watcher(self, autorepeaters):
+        """watcher applying config to autorepeaters by dst if config is set"""
+        config_file = self.params.sync.pairs.config_file
+        if not config_file:
+            return None
+        return ConfigWatcher(
+            config_file,
+            lambda pairs: apply_pairs(autorepeaters, pairs),
+            defaults=self.config_defaults())
+
+    def make_config_watcher(self, autorepeaters, watcher=None):
+        """apply config to autorepeaters by dst and watch it for changes"""
+        watcher = watcher or self.config_watcher(autorepeaters)
+        if watcher is None:
+            return None
+        apply_pairs(autorepeaters, load_config(
+            self.params.sync.pairs.config_file, self.config_defaults()))
+        return watcher.start()
+
+    def make_fx(self, client):
+        """create fx rates if multi-currency valuation is enabled"""
+        fx = self.params.sync.fx
+        if not (fx.multi_currency or fx.rebalance):
+            return None
+        return FxRates(client, ttl=fx.ttl, rebalance=fx.rebalance)
+
+    def make_journal(self):
+        """create journal of syncs if it is enabled"""
+        if not self.params.outputs.journal_file:
+            return None
+        return SyncJournal(self.params.outputs.journal_file)
+
+    def make_outputs(self, worker=None):
+        """create journal, tracer and profiler of syncs
+
+        trace file and profiles of worker process get its index, so
+        workers do not write to the same files
+        """
+        return (self.make_journal(), self.make_tracer(worker),
+                self.make_profiler(worker))
+
+    def make_tracer(self, worker=None):
+        """create tracer of syncs if tracing is enabled"""
+        trace = self.params.outputs.trace
+        target = trace.target
+        if not target:
+            return None
+        if worker is not None and not target.startswith(('http://',
+                                                         'https://')):
+            target = f'{target}.{worker}'
+        return Tracer(TraceExporter(target), sample=trace.sample,
+                      slow=trace.slow)
+
+    def make_interceptors(self):
+        """client interceptors setting deadlines of api calls"""
+        deadlines = self.params.connection.deadlines
+        return [DeadlineInterceptor(call_deadline=deadlines.call,
+                                    order_deadline=deadlines.order)]
+
+    def make_profiler(self, worker=None):
+        """create profiler if profiling is enabled"""
+        profile = self.params.outputs.profile
+        if not profile.directory:
+            return None
+        directory = profile.directory
+        if worker is not None:
+            directory = os.path.join(directory, f'worker-{worker}')
+        return SyncProfiler(directory, every=profile.every, top=profile.top,
+                            level=IMPORTANT)
+
+    def make_orders(self, metrics):
+        """create posting of orders with limit orders and slicing executor
+
+        convergence rounds are counted in sync metrics
+        """
+        orders = self.params.orders
+        executor = None
+        if orders.mode == 'limit':
+            executor = LimitOrderExecutor(timeout=orders.limit.timeout,
+                                          attempts=orders.limit.attempts,
+                                          level=IMPORTANT)
+        if orders.slicing.notional or orders.slicing.depth_share:
+            executor = SliceScheduler(
+                max_notional=orders.slicing.notional,
+                depth_share=orders.slicing.depth_share,
+                interval=orders.slicing.interval,
+                executor=executor,
+                level=IMPORTANT)
+        retries = orders.retries
+        return OrderExecution(
+            executor=executor,
+            retries=RetryPolicy(retries=retries.retries,
+                                backoff=retries.backoff),
+            check_buying_power=orders.check_buying_power,
+            convergence=Convergence(metrics,
+                                    rounds=orders.convergence.rounds,
+                                    wait=orders.convergence.wait,
+                                    level=IMPORTANT),
+            level=IMPORTANT)
+
+    def export_metrics(self, autorepeater):
+        """start configured metrics exporters"""
+        metrics = self.params.outputs.metrics
+        if metrics.port:
+            start_http_exporter(autorepeater.metrics, metrics.port)
+        if metrics.file:
+            start_textfile_exporter(autorepeater.metrics, metrics.file)
@@ -0,0 +1,440 @@
+"""Simulated in-process Tinkoff client for benchmarks and offline runs"""
+import dataclasses
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from tinkoff.invest import Account
+from tinkoff.invest import AccountStatus
+from tinkoff.invest import AccountType
+from tinkoff.invest import CurrenciesResponse
+from tinkoff.invest import Currency
+from tinkoff.invest import FindInstrumentResponse
+from tinkoff.invest import GetAccountsResponse
+from tinkoff.invest import GetLastPricesResponse
+from tinkoff.invest import GetOrderBookResponse
+from tinkoff.invest import Instrument
+from tinkoff.invest import InstrumentIdType
+from tinkoff.invest import InstrumentResponse
+from tinkoff.invest import InstrumentShort
+from tinkoff.invest import LastPrice
+from tinkoff.invest import MoneyValue
+from tinkoff.invest import Order
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderExecutionReportStatus
+from tinkoff.invest import OrderState
+from tinkoff.invest import OrderType
+from tinkoff.invest import PortfolioPosition
+from tinkoff.invest import PortfolioResponse
+from tinkoff.invest import PositionData
+from tinkoff.invest import PositionsMoney
+from tinkoff.invest import PositionsSecurities
+from tinkoff.invest import PositionsStreamResponse
+from tinkoff.invest import PostOrderResponse
+from tinkoff.invest import Quotation
+from tinkoff.invest import SecurityTradingStatus
+from tinkoff.invest import WithdrawLimitsResponse
+from tinkoff.invest.utils import quotation_to_decimal
+
+BASE_CURRENCY = 'rub'
+BASE_CURRENCY_UID = 'rub-uid'
+NANO = Decimal('1000000000')
+# Лотов на каждом уровне стакана и шаг цены между уровнями
+BOOK_LEVEL_LOTS = 10
+BOOK_STEP = Decimal('0.001')
+
+
+class SimulationFinished(Exception):
+    """scripted stream is exhausted"""
+
+
+def to_quotation(value):
+    """convert Decimal to Quotation"""
+    units = int(value)
+    return Quotation(units=units, nano=int((value - units) * NANO))
+
+
+def to_money(value, currency=BASE_CURRENCY):
+    """convert Decimal to MoneyValue"""
+    quotation = to_quotation(value)
+    return MoneyValue(currency=currency, units=quotation.units,
+                      nano=quotation.nano)
+
+
+@dataclasses.dataclass
+class SimInstrument:
+    """instrument of simulated market, it is always traded normally"""
+    uid: str
+    name: str
+    ticker: str
+    price: Decimal
+    lot: int = 1
+    instrument_type: str = 'share'
+    # Для инструментов типа currency это сама валюта, а цена указывается
+    # в базовой валюте
+    currency: str = BASE_CURRENCY
+
+    @property
+    def price_currency(self):
+        """currency of price"""
+        if self.instrument_type == 'currency':
+            return BASE_CURRENCY
+        return self.currency
+
+
+@dataclasses.dataclass
+class SimAccount:
+    """account of simulated market"""
+    account_id: str
+    name: str
+    cash: Decimal = Decimal('0')
+    holdings: dict = dataclasses.field(default_factory=dict)
+
+
+class SimulatedMarket:
+    """state of simulated market: instruments, accounts and orders"""
+
+    def __init__(self, instruments=(), accounts=()):
+        self.instruments = {item.uid: item for item in instruments}
+        self.accounts = {item.account_id: item for item in accounts}
+        self.orders = []
+        self.order_states = {}
+        self.client_orders = {}
+        self.stream_script = []
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """copy of accounts state"""
+        return {account_id: dataclasses.replace(
+            account, holdings=dict(account.holdings))
+            for account_id, account in self.accounts.items()}
+
+    def restore(self, snapshot):
+        """restore accounts state from snapshot"""
+        self.accounts = {account_id: dataclasses.replace(
+            account, holdings=dict(account.holdings))
+            for account_id, account in snapshot.items()}
+
+    def portfolio(self, account_id):
+        """portfolio of account as api response"""
+        account = self.accounts.get(account_id)
+        if account is None:
+            return PortfolioResponse(positions=[])
+        positions = [PortfolioPosition(
+            instrument_type='currency',
+            instrument_uid=BASE_CURRENCY_UID,
+            current_price=to_money(Decimal('1')),
+            quantity=to_quotation(account.cash))]
+        for uid, quantity in account.holdings.items():
+            instrument = self.instruments[uid]
+            positions.append(PortfolioPosition(
+                instrument_type=instrument.instrument_type,
+                instrument_uid=uid,
+                current_price=to_money(instrument.price,
+                                       instrument.price_currency),
+                quantity=to_quotation(quantity)))
+        return PortfolioResponse(positions=positions)
+
+    def rate(self, currency):
+        """rate of currency to base currency by currency instrument"""
+        if currency == BASE_CURRENCY:
+            return Decimal('1')
+        return next(instrument.price
+                    for instrument in self.instruments.values()
+                    if instrument.instrument_type == 'currency' and
+                    instrument.currency == currency)
+
+    def execute(self, account_id, instrument_id, quantity, direction):
+        """fill market order at current price"""
+        instrument = self.instruments[instrument_id]
+        pieces = Decimal(quantity * instrument.lot)
+        if direction == OrderDirection.ORDER_DIRECTION_SELL:
+            pieces = -pieces
+        with self.lock:
+            account = self.accounts[account_id]
+            holding = account.holdings.get(instrument_id, Decimal('0'))
+            account.holdings[instrument_id] = holding + pieces
+            if account.holdings[instrument_id] == 0:
+                del account.holdings[instrument_id]
+            account.cash -= (pieces * instrument.price *
+                             self.rate(instrument.price_currency))
+            order_id = str(uuid.uuid4())
+            self.orders.append((order_id, account_id, instrument_id,
+                                quantity, direction))
+        return order_id
+
+    def order_book(self, instrument_id, depth):
+        """order book around current price of instrument"""
+        price = self.instruments[instrument_id].price
+        step = max(Decimal('0.01'),
+                   (price * BOOK_STEP).quantize(Decimal('0.01')))
+        return GetOrderBookResponse(
+            depth=depth,
+            instrument_uid=instrument_id,
+            bids=[Order(price=to_quotation(price - step * level),
+                        quantity=BOOK_LEVEL_LOTS)
+                  for level in range(1, depth + 1)],
+            asks=[Order(price=to_quotation(price + step * level),
+                        quantity=BOOK_LEVEL_LOTS)
+                  for level in range(1, depth + 1)])
+
+    def crosses(self, instrument_id, direction, price):
+        """check that limit price is marketable at current price"""
+        current = self.instruments[instrument_id].price
+        if direction == OrderDirection.ORDER_DIRECTION_BUY:
+            return price >= current
+        return price <= current
+
+
+def trigger_event(account_id, instrument_uid=''):
+    """stream response which triggers sync of the source account"""
+    return PositionsStreamResponse(position=PositionData(
+        account_id=account_id,
+        money=[],
+        securities=[PositionsSecurities(instrument_uid=instrument_uid,
+                                        blocked=0, balance=1)]))
+
+
+def deposit_event(account_id):
+    """stream response which triggers sync of the destination account"""
+    return PositionsStreamResponse(position=PositionData(
+        account_id=account_id,
+        money=[PositionsMoney(available_value=to_money(Decimal('1')),
+                              blocked_value=to_money(Decimal('0')))],
+        securities=[]))
+
+
+class SimulatedService:  # pylint: disable=R0903
+    """base for services with simulated network latency"""
+
+    def __init__(self, market, latency):
+        self.market = market
+        self.latency = latency
+
+    def wait(self):
+        """simulate network round trip"""
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class SimulatedInstruments(SimulatedService):
+    """instruments service"""
+
+    def find_instrument(self, query):
+        """find instrument by uid"""
+        self.wait()
+        instrument = self.market.instruments.get(query)
+        if instrument is None:
+            return FindInstrumentResponse(instruments=[])
+        return FindInstrumentResponse(instruments=[InstrumentShort(
+            uid=instrument.uid, name=instrument.name,
+            ticker=instrument.ticker,
+            instrument_type=instrument.instrument_type)])
+
+    def currencies(self):
+        """currency instruments including base currency"""
+        self.wait()
+        instruments = [Currency(uid=BASE_CURRENCY_UID, name=BASE_CURRENCY,
+                                ticker=BASE_CURRENCY.upper(), lot=1,
+                                nominal=to_money(Decimal('1')),
+                                iso_currency_name=BASE_CURRENCY)]
+        for instrument in self.market.instruments.values():
+            if instrument.instrument_type == 'currency':
+                instruments.append(Currency(
+                    uid=instrument.uid, name=instrument.name,
+                    ticker=instrument.ticker, lot=instrument.lot,
+                    nominal=to_money(Decimal('1'), instrument.currency),
+                    iso_currency_name=instrument.currency))
+        return CurrenciesResponse(instruments=instruments)
+
+    # pylint: disable=W0622,C0103
+    def get_instrument_by(self, id_type, id):
+        """get instrument by uid"""
+        assert id_type == InstrumentIdType.INSTRUMENT_ID_TYPE_UID
+        self.wait()
+        instrument = self.market.instruments[id]
+        return InstrumentResponse(instrument=Instrument(
+            uid=instrument.uid, name=instrument.name,
+            ticker=instrument.ticker, lot=instrument.lot,
+            currency=instrument.price_currency,
+            instrument_type=instrument.instrument_type,
+            trading_status=(SecurityTradingStatus.
+                            SECURITY_TRADING_STATUS_NORMAL_TRADING)))
+    # pylint: enable=W0622,C0103
+
+
+class SimulatedOperations(SimulatedService):
+    """operations service"""
+
+    def get_portfolio(self, account_id):
+        """portfolio of account"""
+        self.wait()
+        return self.market.portfolio(account_id)
+
+    def get_withdraw_limits(self, account_id):
+        """available money of account"""
+        self.wait()
+        account = self.market.accounts[account_id]
+        return WithdrawLimitsResponse(money=[to_money(account.cash)],
+                                      blocked=[], blocked_guarantee=[])
+
+
+class SimulatedOrders(SimulatedService):
+    """orders service filling every marketable order at once
+
+    limit orders priced worse than the current price stay open until
+    cancelled
+    """
+
+    # pylint: disable=R0913,R0917
+    def post_order(self, quantity, direction, account_id, order_type,
+                   instrument_id, price=None, **kwargs):
+        """post market or limit order, order_id makes retries idempotent"""
+        self.wait()
+        client_order_id = kwargs.get('order_id')
+        with self.market.lock:
+            if client_order_id in self.market.client_orders:
+                state = self.market.order_states[
+                    self.market.client_orders[client_order_id]]
+                return PostOrderResponse(
+                    order_id=state.order_id,
+                    execution_report_status=state.execution_report_status,
+                    lots_requested=state.lots_requested,
+                    lots_executed=state.lots_executed)
+        if (order_type == OrderType.ORDER_TYPE_LIMIT and
+                not self.market.crosses(instrument_id, direction,
+                                        quotation_to_decimal(price))):
+            order_id = str(uuid.uuid4())
+            status = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+            executed = 0
+        else:
+            order_id = self.market.execute(account_id, instrument_id,
+                                           quantity, direction)
+            status = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+            executed = quantity
+        state = OrderState(order_id=order_id, execution_report_status=status,
+                           lots_requested=quantity, lots_executed=executed)
+        with self.market.lock:
+            self.market.order_states[order_id] = state
+            if client_order_id:
+                self.market.client_orders[client_order_id] = order_id
+        return PostOrderResponse(order_id=order_id,
+                                 execution_report_status=status,
+                                 lots_requested=quantity,
+                                 lots_executed=executed)
+    # pylint: enable=R0913,R0917
+
+    def get_order_state(self, account_id, order_id):
+        """state of order"""
+        del account_id
+        self.wait()
+        return self.market.order_states[order_id]
+
+    def cancel_order(self, account_id, order_id):
+        """cancel open order"""
+        del account_id
+        self.wait()
+        with self.market.lock:
+            state = self.market.order_states[order_id]
+            if (state.execution_report_status ==
+                    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW):
+                self.market.order_states[order_id] = dataclasses.replace(
+                    state, execution_report_status=(
+                        OrderExecutionReportStatus.
+                        EXECUTION_REPORT_STATUS_CANCELLED))
+
+
+class SimulatedMarketData(SimulatedService):
+    """market data service"""
+
+    def get_order_book(self, instrument_id, depth):
+        """order book of instrument"""
+        self.wait()
+        return self.market.order_book(instrument_id, depth)
+
+    def get_last_prices(self, instrument_id):
+        """last prices of instruments"""
+        self.wait()
+        return GetLastPricesResponse(last_prices=[LastPrice(
+            instrument_uid=uid,
+            price=to_quotation(self.market.instruments[uid].price))
+            for uid in instrument_id])
+
+
+class SimulatedUsers(SimulatedService):
+    """users service"""
+
+    def get_accounts(self):
+        """all accounts of market"""
+        self.wait()
+        return GetAccountsResponse(accounts=[Account(
+            id=account.account_id,
+            name=account.name,
+            type=AccountType.ACCOUNT_TYPE_TINKOFF,
+            status=AccountStatus.ACCOUNT_STATUS_OPEN)
+            for account in self.market.accounts.values()])
+
+
+class SimulatedOperationsStream(SimulatedService):
+    """operations stream replaying market.stream_script
+
+    script items are (delay in seconds, response); when the script is
+    exhausted SimulationFinished is raised to stop mainflow
+    """
+
+    def positions_stream(self, accounts):
+        """stream of positions changes"""
+        del accounts
+        while self.market.stream_script:
+            delay, response = self.market.stream_script.pop(0)
+            if delay:
+                time.sleep(delay)
+            yield response
+        raise SimulationFinished()
+
+
+class SimulatedClient:  # pylint: disable=R0903
+    """in-process replacement of tinkoff.invest Client services"""
+
+    def __init__(self, market, latency=0.0):
+        self.market = market
+        self.instruments = SimulatedInstruments(market, latency)
+        self.operations = SimulatedOperations(market, latency)
+        self.orders = SimulatedOrders(market, latency)
+        self.users = SimulatedUsers(market, latency)
+        self.market_data = SimulatedMarketData(market, latency)
+        self.operations_stream = SimulatedOperationsStream(market, 0.0)
+
+
+def generate_market(size, seed=0, src='src', dst='dst', dst_scale=10):
+    """generate market with source and destination accounts
+
+    the destination holds scaled and perturbed source positions plus some
+    positions absent in the source, so a sync has to buy and sell
+    """
+    rnd = random.Random(seed)
+    instruments = []
+    for index in range(size + size // 10 + 1):
+        instruments.append(SimInstrument(
+            uid=f'uid-{index}',
+            name=f'instrument {index}',
+            ticker=f'T{index}',
+            price=Decimal(rnd.randint(100, 500000)) / 100,
+            lot=rnd.choice([1, 1, 10, 100]),
+            instrument_type=rnd.choice(['share', 'etf'])))
+    src_account = SimAccount(account_id=src, name='source',
+                             cash=Decimal('1000'))
+    dst_account = SimAccount(account_id=dst, name='destination',
+                             cash=Decimal('100000'))
+    for instrument in instruments[:size]:
+        lots = rnd.randint(1, 20)
+        src_account.holdings[instrument.uid] = Decimal(lots * instrument.lot)
+        dst_lots = round(lots * dst_scale * rnd.uniform(0.8, 1.2))
+        if dst_lots:
+            dst_account.holdings[instrument.uid] = Decimal(
+                dst_lots * instrument.lot)
+    for instrument in instruments[size:]:
+        dst_account.holdings[instrument.uid] = Decimal(instrument.lot)
+    return SimulatedMarket(instruments, [src_account, dst_account])
@@ -0,0 +1,257 @@
+"""Slicing of large orders into time-spaced child orders
+
+Orders with notional or share of the order book depth above the limits
+are split into child orders posted every interval seconds in background,
+instruments are sliced in parallel. A newer sync of the account
+supersedes slices which are still pending, as its plan already accounts
+for what was filled.
+"""
+import concurrent.futures
+import dataclasses
+import functools
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import RequestError
+from tinkoff.invest.utils import quotation_to_decimal
+
+from autorepeater.execution import BOOK_DEPTH
+from autorepeater.execution import fetch_order_books
+
+SLICE_INTERVAL = 10.0
+SLICE_WORKERS = 8
+
+
+def book_levels(order_book, direction):
+    """levels of book side which order consumes"""
+    if direction == OrderDirection.ORDER_DIRECTION_BUY:
+        return order_book.asks
+    return order_book.bids
+
+
+def child_size(quantity, lot_cost, depth_lots, max_notional=None,
+               depth_share=None):
+    """lots of one child order, quantity if order needs no slicing"""
+    size = quantity
+    if max_notional is not None and lot_cost > 0:
+        size = min(size, int(Decimal(str(max_notional)) // lot_cost))
+    if depth_share is not None and depth_lots > 0:
+        size = min(size, int(depth_lots * depth_share))
+    return max(1, size)
+
+
+@dataclasses.dataclass
+class ParentOrder:
+    """large order executed by child orders"""
+    account_id: str
+    order_params: object
+    child_size: int
+    remaining: int
+    superseded: threading.Event
+    sequence: object
+
+
+class SliceTasks:
+    """parent orders of accounts sliced in background by pool of workers"""
+
+    def __init__(self, max_workers=SLICE_WORKERS):
+        self.workers = ThreadPoolExecutor(max_workers=max_workers,
+                                          thread_name_prefix='slices')
+        self.lock = threading.Lock()
+        self.parents = {}
+        self.futures = []
+        self.parent_ids = itertools.count()
+
+    def scope(self):
+        """scope of client order ids of the next parent order"""
+        return f'slice{next(self.parent_ids)}'
+
+    def pending(self, account_id):
+        """remaining lots of pending parent orders by instrument uid"""
+        with self.lock:
+            return {parent.order_params.instrument_id: parent.remaining
+                    for parent in self.parents.get(account_id, [])
+                    if parent.remaining > 0}
+
+    def pop(self, account_id):
+        """forget parent orders of account and return them"""
+        with self.lock:
+            return self.parents.pop(account_id, [])
+
+    def accounts(self):
+        """accounts having parent orders"""
+        with self.lock:
+            return list(self.parents)
+
+    def submit(self, account_id, parents, run):
+        """run parent orders of account in workers"""
+        with self.lock:
+            self.parents[account_id] = parents
+            self.futures = [future for future in self.futures
+                            if not future.done()]
+            for parent in parents:
+                self.futures.append(self.workers.submit(run, parent))
+
+    def posted(self, parent, quantity):
+        """count lots of child order posted for parent"""
+        with self.lock:
+            parent.remaining -= quantity
+
+    def wait(self):
+        """wait until all submitted parent orders are done"""
+        with self.lock:
+            futures = list(self.futures)
+        concurrent.futures.wait(futures)
+
+    def shutdown(self):
+        """stop workers after running parent orders"""
+        self.workers.shutdown(wait=True)
+
+
+class SliceScheduler:
+    """executor splitting large orders into time-spaced child orders
+
+    child orders are posted at best price or by executor if it is set,
+    they keep sync id of parent and get client order ids of own sequence
+    """
+
+    # pylint: disable=R0913,R0917
+    def __init__(self, max_notional=None, depth_share=None,
+                 interval=SLICE_INTERVAL, executor=None, depth=BOOK_DEPTH,
+                 max_workers=SLICE_WORKERS, level=logging.INFO):
+        if max_notional is not None and max_notional <= 0:
+            raise ValueError("Slice notional must be positive")
+        if depth_share is not None and not 0 < depth_share <= 1:
+            raise ValueError("Slice depth share must be between 0 and 1")
+        if interval < 0:
+            raise ValueError("Slice interval must be non-negative")
+        self.max_notional = max_notional
+        self.depth_share = depth_share
+        self.interval = interval
+        self.executor = executor
+        self.depth = depth
+        self.level = level
+        self.tasks = SliceTasks(max_workers)
+    # pylint: enable=R0913,R0917
+
+    def pending(self, account_id):
+        """remaining lots of pending parent orders by instrument uid"""
+        return self.tasks.pending(account_id)
+
+    def supersede(self, account_id):
+        """stop pending slices of account"""
+        for parent in self.tasks.pop(account_id):
+            parent.superseded.set()
+            if parent.remaining > 0:
+                logging.log(self.level,
+                            'новый план заменяет %d неисполненных лотов %s',
+                            parent.remaining,
+                            parent.order_params.instrument_id)
+
+    def plan_slices(self, autorepeater, orders_params):
+        """split orders into posted at once and sliced with child size"""
+        order_books = fetch_order_books(
+            autorepeater.client,
+            [order_params.instrument_id for order_params in orders_params],
+            self.depth, metrics=autorepeater.metrics)
+        immediate = []
+        sliced = []
+        for order_params in orders_params:
+            levels = book_levels(order_books[order_params.instrument_id],
+                                 order_params.direction)
+            if not levels:
+                immediate.append(order_params)
+                continue
+            instrument = autorepeater.get_instrument_by_uid(
+                order_params.instrument_id)
+            size = child_size(
+                order_params.quantity,
+                quotation_to_decimal(levels[0].price) * instrument.lot,
+                sum(level.quantity for level in levels),
+                self.max_notional, self.depth_share)
+            if size >= order_params.quantity:
+                immediate.append(order_params)
+            else:
+                sliced.append((order_params, size))
+        return (immediate, sliced)
+
+    def post(self, autorepeater, account_id, orders_params, sequence=None):
+        """post orders at best price or by executor
+
+        orders of the current sync are posted until its budget expires,
+        child orders with own sequence are not limited by it; returns
+        False if posting is truncated by sync budget
+        """
+        if self.executor:
+            return self.executor.execute(autorepeater, account_id,
+                                         orders_params, sequence)
+        for (index, order_params) in enumerate(orders_params):
+            if sequence is None and autorepeater.current.budget.expired():
+                logging.log(self.level, 'время синхронизации истекло, не '
+                            'отправлено заявок: %d',
+                            len(orders_params) - index,
+                            extra=autorepeater.current.log_extra(
+                                account=account_id))
+                return False
+            autorepeater.post_order(account_id, order_params, sequence)
+        return True
+
+    def execute(self, autorepeater, account_id, orders_params):
+        """post small orders and schedule slices of large ones
+
+        returns False if small orders are truncated by sync budget
+        """
+        self.supersede(account_id)
+        with autorepeater.metrics.stage('order_book'):
+            (immediate, sliced) = self.plan_slices(autorepeater, orders_params)
+        if not self.post(autorepeater, account_id, immediate):
+            return False
+        if not sliced:
+            return True
+        superseded = threading.Event()
+        parents = [ParentOrder(account_id=account_id,
+                               order_params=order_params,
+                               child_size=size,
+                               remaining=order_params.quantity,
+                               superseded=superseded,
+                               sequence=autorepeater.current.sequence.scoped(
+                                   self.tasks.scope()))
+                   for (order_params, size) in sliced]
+        self.tasks.submit(account_id, parents, functools.partial(
+            self.run_parent, autorepeater))
+        return True
+
+    def run_parent(self, autorepeater, parent):
+        """post child orders every interval until done or superseded"""
+        while parent.remaining > 0 and not parent.superseded.is_set():
+            quantity = min(parent.child_size, parent.remaining)
+            try:
+                self.post(autorepeater, parent.account_id,
+                          [dataclasses.replace(parent.order_params,
+                                               quantity=quantity)],
+                          parent.sequence)
+            except RequestError as err:
+                logging.error(err)
+                return
+            except Exception:  # pylint: disable=W0718
+                # Ошибка потока не видна иначе, результат задачи не читается
+                logging.exception('дочерние заявки %s остановлены',
+                                  parent.order_params.instrument_id)
+                return
+            self.tasks.posted(parent, quantity)
+            if parent.remaining > 0 and parent.superseded.wait(self.interval):
+                return
+
+    def wait(self):
+        """wait until all scheduled slices are posted or superseded"""
+        self.tasks.wait()
+
+    def close(self):
+        """supersede pending slices of all accounts and stop workers"""
+        for account_id in self.tasks.accounts():
+            self.supersede(account_id)
+        self.tasks.shutdown()
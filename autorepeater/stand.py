@@ -0,0 +1,414 @@
+"""Local gRPC stand-in of the Invest API for end-to-end and load tests
+
+Implements GetPortfolio, GetWithdrawLimits, GetInstrumentBy,
+FindInstrument, PostOrder, GetOrderState, CancelOrder, GetOrderBook,
+GetAccounts and PositionsStream over a simulated market. The tinkoff
+client always opens a TLS channel, so the stand needs a certificate for
+localhost and the client has to trust it:
+
+    python -m autorepeater.stand --port 8443 --cert cert.pem --key key.pem \\
+        --pairs 2 --scenario mixed
+    GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=cert.pem INVEST_TOKEN=stand \\
+        python main.py --target localhost:8443 -s src-0 -d dst-0
+"""
+import argparse
+import json
+import logging
+import queue
+import random
+import threading
+from concurrent import futures
+from decimal import Decimal
+
+import grpc
+from tinkoff.invest import InstrumentIdType
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderType
+from tinkoff.invest import Quotation
+# Закрытый помощник клиента, версия tinkoff-investments закреплена в
+# requirements.txt, при обновлении проверить его сигнатуру
+from tinkoff.invest._grpc_helpers import dataclass_to_protobuff
+from tinkoff.invest.grpc import instruments_pb2
+from tinkoff.invest.grpc import instruments_pb2_grpc
+from tinkoff.invest.grpc import marketdata_pb2
+from tinkoff.invest.grpc import marketdata_pb2_grpc
+from tinkoff.invest.grpc import operations_pb2
+from tinkoff.invest.grpc import operations_pb2_grpc
+from tinkoff.invest.grpc import orders_pb2
+from tinkoff.invest.grpc import orders_pb2_grpc
+from tinkoff.invest.grpc import users_pb2
+from tinkoff.invest.grpc import users_pb2_grpc
+
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import deposit_event
+from autorepeater.simulation import generate_market
+from autorepeater.simulation import trigger_event
+
+DROP = object()
+
+# Шаги сценариев: rebalance - сделки по счетам источникам с событиями в потоке,
+# deposit - пополнение счетов назначения, drop - обрыв всех потоков,
+# sleep - пауза. Сценарий повторяется по кругу.
+SCENARIOS = {
+    'idle': [{'step': 'sleep', 'seconds': 60}],
+    'rebalance_burst': [
+        {'step': 'rebalance', 'trades': 5},
+        {'step': 'sleep', 'seconds': 10},
+    ],
+    'deposits': [
+        {'step': 'deposit', 'amount': '10000'},
+        {'step': 'sleep', 'seconds': 30},
+    ],
+    'stream_drops': [
+        {'step': 'sleep', 'seconds': 20},
+        {'step': 'drop'},
+    ],
+    'mixed': [
+        {'step': 'rebalance', 'trades': 10},
+        {'step': 'sleep', 'seconds': 5},
+        {'step': 'deposit', 'amount': '5000'},
+        {'step': 'sleep', 'seconds': 5},
+        {'step': 'drop'},
+        {'step': 'rebalance', 'trades': 3},
+        {'step': 'sleep', 'seconds': 10},
+    ],
+}
+
+
+class StreamHub:
+    """broadcast of positions stream responses to subscribed streams"""
+
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, accounts):
+        """new subscriber queue for accounts"""
+        subscriber = (set(accounts), queue.Queue())
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """remove subscriber"""
+        with self.lock:
+            self.subscribers.remove(subscriber)
+
+    def publish(self, response):
+        """send response to streams subscribed to its account"""
+        with self.lock:
+            for accounts, responses in self.subscribers:
+                if response.position.account_id in accounts:
+                    responses.put(response)
+
+    def drop(self):
+        """abort all active streams"""
+        with self.lock:
+            for _, responses in self.subscribers:
+                responses.put(DROP)
+
+
+class InstrumentsServicer(instruments_pb2_grpc.InstrumentsServiceServicer):
+    """instruments service over simulated market"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def GetInstrumentBy(self, request, context):  # pylint: disable=C0103
+        """instrument by uid"""
+        try:
+            response = self.client.instruments.get_instrument_by(
+                id_type=InstrumentIdType(request.id_type), id=request.id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'instrument not found')
+        return dataclass_to_protobuff(
+            response, instruments_pb2.InstrumentResponse())
+
+    def FindInstrument(self, request, _context):  # pylint: disable=C0103
+        """instrument search by uid"""
+        return dataclass_to_protobuff(
+            self.client.instruments.find_instrument(query=request.query),
+            instruments_pb2.FindInstrumentResponse())
+
+
+class OperationsServicer(operations_pb2_grpc.OperationsServiceServicer):
+    """operations service over simulated market"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def GetPortfolio(self, request, _context):  # pylint: disable=C0103
+        """portfolio of account"""
+        return dataclass_to_protobuff(
+            self.client.operations.get_portfolio(account_id=request.account_id),
+            operations_pb2.PortfolioResponse())
+
+    def GetWithdrawLimits(self, request, context):  # pylint: disable=C0103
+        """available money of account"""
+        try:
+            response = self.client.operations.get_withdraw_limits(
+                account_id=request.account_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'account not found')
+        return dataclass_to_protobuff(
+            response, operations_pb2.WithdrawLimitsResponse())
+
+
+class OrdersServicer(orders_pb2_grpc.OrdersServiceServicer):
+    """orders service filling market orders at once
+
+    limit orders which do not cross the book stay open until cancelled
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def PostOrder(self, request, context):  # pylint: disable=C0103
+        """post order"""
+        price = None
+        if request.HasField('price'):
+            price = Quotation(units=request.price.units,
+                              nano=request.price.nano)
+        try:
+            response = self.client.orders.post_order(
+                quantity=request.quantity,
+                direction=OrderDirection(request.direction),
+                account_id=request.account_id,
+                order_type=OrderType(request.order_type),
+                instrument_id=request.instrument_id,
+                price=price,
+                order_id=request.order_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'account not found')
+        return dataclass_to_protobuff(response, orders_pb2.PostOrderResponse())
+
+    def GetOrderState(self, request, context):  # pylint: disable=C0103
+        """state of order"""
+        try:
+            response = self.client.orders.get_order_state(
+                account_id=request.account_id, order_id=request.order_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'order not found')
+        return dataclass_to_protobuff(response, orders_pb2.OrderState())
+
+    def CancelOrder(self, request, context):  # pylint: disable=C0103
+        """cancel open order"""
+        try:
+            self.client.orders.cancel_order(account_id=request.account_id,
+                                            order_id=request.order_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'order not found')
+        return orders_pb2.CancelOrderResponse()
+
+
+# pylint: disable=R0903
+class MarketDataServicer(marketdata_pb2_grpc.MarketDataServiceServicer):
+    """market data service over simulated market"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def GetOrderBook(self, request, context):  # pylint: disable=C0103
+        """order book of instrument"""
+        try:
+            response = self.client.market_data.get_order_book(
+                instrument_id=request.instrument_id, depth=request.depth)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'instrument not found')
+        return dataclass_to_protobuff(
+            response, marketdata_pb2.GetOrderBookResponse())
+
+
+class UsersServicer(users_pb2_grpc.UsersServiceServicer):
+    """users service"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def GetAccounts(self, _request, _context):  # pylint: disable=C0103
+        """all accounts"""
+        return dataclass_to_protobuff(self.client.users.get_accounts(),
+                                      users_pb2.GetAccountsResponse())
+
+
+class OperationsStreamServicer(
+        operations_pb2_grpc.OperationsStreamServiceServicer):
+    """positions stream fed by scenario"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def PositionsStream(self, request, context):  # pylint: disable=C0103
+        """stream of positions changes of requested accounts"""
+        subscriber = self.hub.subscribe(request.accounts)
+        try:
+            while context.is_active():
+                try:
+                    response = subscriber[1].get(timeout=1)
+                except queue.Empty:
+                    continue
+                if response is DROP:
+                    context.abort(grpc.StatusCode.UNAVAILABLE,
+                                  'stream dropped by scenario')
+                yield dataclass_to_protobuff(
+                    response, operations_pb2.PositionsStreamResponse())
+        finally:
+            self.hub.unsubscribe(subscriber)
+# pylint: enable=R0903
+
+
+class ScenarioRunner:
+    """plays scenario steps against market and stream hub in a loop"""
+
+    def __init__(self, market, hub, steps, seed=0):
+        self.market = market
+        self.hub = hub
+        self.steps = steps
+        self.random = random.Random(seed)
+        self.stopped = threading.Event()
+
+    def sources(self):
+        """source accounts of market"""
+        return [account_id for account_id in self.market.accounts
+                if account_id.startswith('src')]
+
+    def destinations(self):
+        """destination accounts of market"""
+        return [account_id for account_id in self.market.accounts
+                if account_id.startswith('dst')]
+
+    def rebalance(self, trades):
+        """random trades in every source account"""
+        for account_id in self.sources():
+            for _ in range(trades):
+                uid = self.random.choice(list(self.market.instruments))
+                held = self.market.accounts[account_id].holdings.get(uid, 0)
+                lot = self.market.instruments[uid].lot
+                direction = (OrderDirection.ORDER_DIRECTION_SELL
+                             if held >= lot and self.random.random() < 0.5
+                             else OrderDirection.ORDER_DIRECTION_BUY)
+                self.market.execute(account_id, uid, 1, direction)
+                self.hub.publish(trigger_event(account_id, uid))
+
+    def deposit(self, amount):
+        """deposit to every destination account"""
+        for account_id in self.destinations():
+            with self.market.lock:
+                self.market.accounts[account_id].cash += Decimal(amount)
+            self.hub.publish(deposit_event(account_id))
+
+    def play(self, step):
+        """play one scenario step"""
+        kind = step['step']
+        if kind == 'rebalance':
+            self.rebalance(step.get('trades', 1))
+        elif kind == 'deposit':
+            self.deposit(step.get('amount', '1000'))
+        elif kind == 'drop':
+            self.hub.drop()
+        elif kind == 'sleep':
+            self.stopped.wait(step.get('seconds', 1))
+        else:
+            raise ValueError(f'unknown scenario step {kind}')
+        logging.info('scenario step %s', step)
+
+    def run(self):
+        """play steps in a loop until stopped"""
+        while not self.stopped.is_set():
+            for step in self.steps:
+                if self.stopped.is_set():
+                    return
+                self.play(step)
+
+    def start(self):
+        """play scenario in daemon thread"""
+        thread = threading.Thread(target=self.run, name='stand-scenario',
+                                  daemon=True)
+        thread.start()
+        return thread
+
+
+def make_market(size, pairs, seed=0):
+    """market with pairs of src-N and dst-N accounts over shared instruments"""
+    market = generate_market(size, seed=seed, src='src-0', dst='dst-0')
+    for index in range(1, pairs):
+        extra = generate_market(size, seed=seed + index,
+                                src=f'src-{index}', dst=f'dst-{index}')
+        market.accounts.update(extra.accounts)
+    return market
+
+
+def make_server(market, hub, latency=0.0, max_workers=32):
+    """grpc server with all stand services registered"""
+    client = SimulatedClient(market, latency=latency)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    instruments_pb2_grpc.add_InstrumentsServiceServicer_to_server(
+        InstrumentsServicer(client), server)
+    operations_pb2_grpc.add_OperationsServiceServicer_to_server(
+        OperationsServicer(client), server)
+    operations_pb2_grpc.add_OperationsStreamServiceServicer_to_server(
+        OperationsStreamServicer(hub), server)
+    orders_pb2_grpc.add_OrdersServiceServicer_to_server(
+        OrdersServicer(client), server)
+    marketdata_pb2_grpc.add_MarketDataServiceServicer_to_server(
+        MarketDataServicer(client), server)
+    users_pb2_grpc.add_UsersServiceServicer_to_server(
+        UsersServicer(client), server)
+    return server
+
+
+def load_steps(scenario, scenario_file):
+    """steps of named scenario or scenario from json file"""
+    if scenario_file:
+        with open(scenario_file, encoding='utf-8') as steps_file:
+            return json.load(steps_file)
+    return SCENARIOS[scenario]
+
+
+def main(argv=None):
+    """main function"""
+    parser = argparse.ArgumentParser(description="autorepeater invest api stand")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--cert", type=str, help="сертификат для TLS")
+    parser.add_argument("--key", type=str, help="ключ сертификата для TLS")
+    parser.add_argument("--size", type=int, default=100,
+                        help="количество инструментов в портфелях")
+    parser.add_argument("--pairs", type=int, default=1,
+                        help="количество пар счетов src-N/dst-N")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="задержка обработки каждого запроса в секундах")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default='idle')
+    parser.add_argument("--scenario-file", type=str,
+                        help="json со списком шагов сценария")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    market = make_market(args.size, args.pairs, args.seed)
+    hub = StreamHub()
+    server = make_server(market, hub, args.latency)
+    address = f'[::]:{args.port}'
+    if args.cert and args.key:
+        with open(args.cert, 'rb') as cert, open(args.key, 'rb') as key:
+            server.add_secure_port(address, grpc.ssl_server_credentials(
+                [(key.read(), cert.read())]))
+    else:
+        logging.warning('без --cert/--key стенд доступен только для '
+                        'небезопасных каналов, клиент tinkoff к нему не подключится')
+        server.add_insecure_port(address)
+    server.start()
+    scenario = ScenarioRunner(market, hub,
+                              load_steps(args.scenario, args.scenario_file),
+                              args.seed)
+    scenario.start()
+    logging.info('stand is listening on %s, accounts: %s', address,
+                 ', '.join(market.accounts))
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        scenario.stopped.set()
+        server.stop(grace=1).wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Persistence of the last converged state of an account pair"""
+import dataclasses
+import json
+import logging
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from autorepeater.autorepeater import format_decimal
+from autorepeater.autorepeater import get_holdings
+from autorepeater.autorepeater import value_positions
+
+
+@dataclasses.dataclass
+class SyncState:
+    """last converged state of account pair
+
+    dst - holdings and total of dst account, None in files of older format
+    """
+    src_account_id: str
+    dst_account_id: str
+    holdings: dict
+    target_positions: dict
+    ratio: str
+    updated_at: float
+    dst: dict = None
+
+
+def load_state(path):
+    """load last converged state from file, None if it is absent or broken"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as state_file:
+            return SyncState(**json.load(state_file))
+    except (OSError, ValueError, TypeError) as err:
+        logging.warning('не удалось прочитать состояние %s: %s', path, err)
+        return None
+
+
+def save_state(path, state):
+    """atomically save converged state to file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as state_file:
+            json.dump(dataclasses.asdict(state), state_file,
+                      ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class StateFile:
+    """last converged state of account pair kept in file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, src_account_id, dst_account_id, plan):
+        """save state of pair by plan with nothing to post"""
+        save_state(self.path, SyncState(
+            src_account_id=src_account_id,
+            dst_account_id=dst_account_id,
+            holdings=get_holdings(plan.src_positions.values()),
+            target_positions={item_id: format_decimal(item_value)
+                              for item_id, item_value
+                              in plan.target_positions.items()},
+            ratio=format_decimal(plan.ratio),
+            updated_at=time.time(),
+            dst={'holdings': get_holdings(plan.dst_positions.values()),
+                 'total': format_decimal(plan.total_dst)}))
+
+    def is_unchanged(self, autorepeater, src_account_id, dst_account_id):
+        """check both accounts of autorepeater against saved state
+
+        holdings must match and value of dst account with money must be
+        within threshold of saved one, so deposits and withdrawals made
+        while stopped are synced; costs two portfolio requests instead of
+        a full sync
+        """
+        state = load_state(self.path)
+        if (state is None or state.src_account_id != src_account_id or
+                state.dst_account_id != dst_account_id):
+            return False
+        client = autorepeater.client
+        portfolio_src = client.operations.get_portfolio(
+            account_id=src_account_id)
+        if get_holdings(portfolio_src.positions) != state.holdings:
+            return False
+        portfolio_dst = client.operations.get_portfolio(
+            account_id=dst_account_id)
+        if (state.dst is None or get_holdings(portfolio_dst.positions) !=
+                state.dst['holdings']):
+            return False
+        (_, _, total_dst) = value_positions(
+            portfolio_dst.positions, autorepeater.get_rates(
+                list(portfolio_src.positions) + list(portfolio_dst.positions)),
+            autorepeater.features.fx)
+        total_dst = total_dst * (Decimal('1') - autorepeater.reserve)
+        saved = Decimal(state.dst['total'])
+        return abs(total_dst - saved) <= saved * autorepeater.threshold
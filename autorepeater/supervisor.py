@@ -0,0 +1,168 @@
+"""Supervisor of worker processes serving shards of account pairs
+
+Every worker gets its shard of account pairs and reports metrics
+snapshots to the supervisor by queue. Supervisor merges them into one
+registry, refreshes the shared instrument catalog and restarts workers
+which have died.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+from autorepeater.metrics import MergedRegistry
+from autorepeater.metrics import Registry
+
+WORKER_POLL_INTERVAL = 1.0
+RESTART_DELAY = 5.0
+# Как часто воркеры отправляют метрики супервизору, секунды
+METRICS_INTERVAL = 5.0
+
+
+def shard_pairs(pairs, workers):
+    """split account pairs into at most workers shards round robin"""
+    if workers < 1:
+        raise ValueError("Number of workers must be positive")
+    shards = [pairs[index::workers] for index in range(workers)]
+    return [shard for shard in shards if shard]
+
+
+class WorkerProcesses:
+    """worker processes of shards reporting metrics snapshots by queue
+
+    target(index, pairs, metrics_queue, *args) runs in worker process
+    and must be a module level function, restarts are counted in registry
+    """
+
+    # pylint: disable=R0913,R0917
+    def __init__(self, target, shards, registry, args=(), context='spawn'):
+        self.target = target
+        self.shards = shards
+        self.args = tuple(args)
+        self.context = multiprocessing.get_context(context)
+        self.metrics_queue = self.context.Queue()
+        self.processes = {}
+        self.restarts = registry.counter(
+            'autorepeater_worker_restarts', 'Number of restarted workers')
+    # pylint: enable=R0913,R0917
+
+    def start(self, index):
+        """start worker process for shard"""
+        process = self.context.Process(
+            target=self.target,
+            args=(index, self.shards[index], self.metrics_queue) + self.args,
+            name=f'worker-{index}', daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def restart(self, index):
+        """start worker again after it has died"""
+        self.restarts.inc()
+        self.start(index)
+
+    def dead(self):
+        """worker processes which are not alive by shard index"""
+        return {index: process for (index, process) in self.processes.items()
+                if not process.is_alive()}
+
+    def reports(self):
+        """metrics snapshots sent by workers since the last call"""
+        while True:
+            try:
+                yield self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def signal(self, signum):
+        """pass signal to alive workers"""
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def stop(self):
+        """terminate all workers"""
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+
+class Supervisor:
+    """start, watch and restart worker processes
+
+    target(index, pairs, metrics_queue, *args) runs in worker process
+    and must be a module level function
+    """
+
+    # pylint: disable=R0913,R0917
+    def __init__(self, target, shards, args=(), restart_delay=RESTART_DELAY,
+                 level=logging.INFO, context='spawn'):
+        own = Registry()
+        self.workers = WorkerProcesses(target, shards, own, args, context)
+        self.restart_delay = restart_delay
+        self.level = level
+        self.registry = MergedRegistry([own])
+        self.restart_at = {}
+        self.refresh = None
+        self.refresh_at = 0.0
+    # pylint: enable=R0913,R0917
+
+    @property
+    def worker_restarts(self):
+        """counter of restarted workers"""
+        return self.workers.restarts
+
+    def set_refresh(self, refresh, interval):
+        """call refresh every interval seconds from supervision loop"""
+        if interval <= 0:
+            raise ValueError("Refresh interval must be positive")
+        self.refresh = (refresh, interval)
+        self.refresh_at = time.monotonic() + interval
+
+    def start(self):
+        """start workers of all shards"""
+        for index in range(len(self.workers.shards)):
+            self.workers.start(index)
+        return self
+
+    def collect_metrics(self):
+        """merge metrics snapshots sent by workers"""
+        for (index, snapshots) in self.workers.reports():
+            self.registry.update(index, snapshots)
+
+    def poll(self):
+        """one supervision step: refresh, metrics and restarts"""
+        now = time.monotonic()
+        if self.refresh and now >= self.refresh_at:
+            (refresh, interval) = self.refresh
+            self.refresh_at = now + interval
+            refresh()
+        self.collect_metrics()
+        for (index, process) in self.workers.dead().items():
+            if index not in self.restart_at:
+                logging.log(self.level, 'воркер %d завершился с кодом %s, '
+                            'перезапуск через %.1f с', index, process.exitcode,
+                            self.restart_delay)
+                self.restart_at[index] = now + self.restart_delay
+            elif now >= self.restart_at[index]:
+                del self.restart_at[index]
+                self.workers.restart(index)
+
+    def signal_workers(self, signum, _frame=None):
+        """pass signal to alive workers, also signal handler"""
+        self.workers.signal(signum)
+
+    def run(self, poll_interval=WORKER_POLL_INTERVAL):
+        """supervise workers until interrupted"""
+        try:
+            while True:
+                self.poll()
+                time.sleep(poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """terminate all workers"""
+        self.workers.stop()
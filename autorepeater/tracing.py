@@ -0,0 +1,296 @@
+"""Span tracing of syncs exported in OTLP JSON format
+
+Every trigger starts a trace with root span from receipt of the stream
+event, sync stages are its child spans. Finished traces are kept by
+sampling ratio or when they are slower than slow threshold and are
+written by background thread as OTLP/JSON lines to file or posted to
+OTLP/HTTP collector.
+"""
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+TRACE_SAMPLE = 1.0
+SERVICE_NAME = 'autorepeater'
+EXPORT_TIMEOUT = 5.0
+SPAN_KIND_INTERNAL = 1
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def otlp_value(value):
+    """attribute value in OTLP JSON encoding"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_attributes(attributes):
+    """attributes in OTLP JSON encoding, None values are skipped"""
+    return [{'key': key, 'value': otlp_value(value)}
+            for key, value in attributes.items() if value is not None]
+
+
+def otlp_request(spans, service=SERVICE_NAME):
+    """export trace service request with spans in OTLP JSON encoding"""
+    return {'resourceSpans': [{
+        'resource': {'attributes': otlp_attributes({'service.name': service})},
+        'scopeSpans': [{'scope': {'name': SERVICE_NAME},
+                        'spans': [span.to_otlp() for span in spans]}]}]}
+
+
+@dataclasses.dataclass(frozen=True)
+class SpanContext:
+    """ids of span, its trace and its parent span"""
+    trace_id: str
+    span_id: str
+    parent_id: str = None
+
+    @classmethod
+    def root(cls):
+        """context of root span of new trace"""
+        return cls(os.urandom(16).hex(), os.urandom(8).hex())
+
+    def child(self):
+        """context of child span"""
+        return SpanContext(self.trace_id, os.urandom(8).hex(), self.span_id)
+
+
+class Span:
+    """timed operation of trace with attributes"""
+
+    def __init__(self, context, name, start_ns, attributes):
+        self.context = context
+        self.name = name
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.status = (STATUS_OK, '')
+
+    def set_attributes(self, **attributes):
+        """add or replace attributes"""
+        self.attributes.update(attributes)
+
+    def set_error(self, message):
+        """mark span as failed"""
+        self.status = (STATUS_ERROR, message)
+
+    def end(self):
+        """finish span now"""
+        self.end_ns = time.time_ns()
+
+    def duration(self):
+        """duration of finished span in seconds"""
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        """span in OTLP JSON encoding"""
+        (code, message) = self.status
+        result = {'traceId': self.context.trace_id,
+                  'spanId': self.context.span_id,
+                  'name': self.name,
+                  'kind': SPAN_KIND_INTERNAL,
+                  'startTimeUnixNano': str(self.start_ns),
+                  'endTimeUnixNano': str(self.end_ns),
+                  'attributes': otlp_attributes(self.attributes),
+                  'status': {'code': code, 'message': message}}
+        if self.context.parent_id:
+            result['parentSpanId'] = self.context.parent_id
+        return result
+
+
+class NoopSpan:
+    """span of trace which is not recorded"""
+
+    def set_attributes(self, **attributes):
+        """ignore attributes"""
+
+    def set_error(self, message):
+        """ignore error"""
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer:
+    """spans of traces of the current thread
+
+    trace is kept if it is sampled by sample ratio or lasted at least
+    slow seconds, spans outside of trace are not recorded
+    """
+
+    def __init__(self, exporter, sample=TRACE_SAMPLE, slow=None,
+                 sampler=random.random):
+        if not 0 <= sample <= 1:
+            raise ValueError("Trace sample must be between 0 and 1")
+        if slow is not None and slow < 0:
+            raise ValueError("Slow trace threshold must be non-negative")
+        self.exporter = exporter
+        self.sample = sample
+        self.slow = slow
+        self.sampler = sampler
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def trace(self, name, start_time=None, **attributes):
+        """root span of new trace
+
+        start_time - monotonic time of trigger, root span starts then
+        """
+        if getattr(self.local, 'stack', None):
+            with self.span(name, **attributes) as span:
+                yield span
+            return
+        start_ns = time.time_ns()
+        if start_time is not None:
+            start_ns -= int((time.monotonic() - start_time) * 1e9)
+        root = Span(SpanContext.root(), name, start_ns, attributes)
+        self.local.stack = [root]
+        self.local.spans = [root]
+        try:
+            yield root
+        except BaseException as err:
+            root.set_error(repr(err))
+            raise
+        finally:
+            root.end()
+            spans = self.local.spans
+            self.local.stack = None
+            self.local.spans = None
+            if self.keep(root):
+                self.exporter.export(spans)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """child span of the current span, not recorded outside of trace"""
+        stack = getattr(self.local, 'stack', None)
+        if not stack:
+            yield NOOP_SPAN
+            return
+        span = Span(stack[-1].context.child(), name, time.time_ns(),
+                    attributes)
+        stack.append(span)
+        self.local.spans.append(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.set_error(repr(err))
+            raise
+        finally:
+            span.end()
+            stack.pop()
+
+    def current(self):
+        """current span with spans of its trace to continue in other thread
+
+        None outside of trace
+        """
+        stack = getattr(self.local, 'stack', None)
+        if not stack:
+            return None
+        return (stack[-1], self.local.spans)
+
+    @contextlib.contextmanager
+    def attach(self, parent):
+        """continue trace of parent from current() in the current thread
+
+        spans of the thread become children of the parent span and are
+        exported with its trace, which must last until they are finished
+        """
+        if parent is None or getattr(self.local, 'stack', None):
+            yield
+            return
+        (span, spans) = parent
+        self.local.stack = [span]
+        # list.append атомарен, потоки пула дописывают спаны в общий список
+        self.local.spans = spans
+        try:
+            yield
+        finally:
+            self.local.stack = None
+            self.local.spans = None
+
+    def keep(self, root):
+        """check that finished trace is exported"""
+        if self.slow is not None and root.duration() >= self.slow:
+            return True
+        return self.sample > 0 and self.sampler() < self.sample
+
+    def close(self):
+        """export queued traces"""
+        self.exporter.close()
+
+
+class TraceExporter:
+    """queue of traces written by background thread
+
+    target is file for OTLP/JSON lines or http url of collector, for
+    example http://localhost:4318/v1/traces
+    """
+
+    def __init__(self, target, timeout=EXPORT_TIMEOUT):
+        self.target = target
+        self.timeout = timeout
+        self.collector = target.startswith(('http://', 'https://'))
+        if not self.collector:
+            # Файл открывается сразу, что бы ошибки были видны при старте
+            with open(target, 'a', encoding='utf-8'):
+                pass
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='traces',
+                                       daemon=True)
+        self.thread.start()
+
+    def export(self, spans):
+        """queue spans of finished trace"""
+        self.queue.put(spans)
+
+    def run(self):
+        """write queued traces until closed"""
+        while True:
+            spans = self.queue.get()
+            if spans is None:
+                return
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.write(spans)
+                    return
+                spans = spans + item
+            self.write(spans)
+
+    def write(self, spans):
+        """write spans as one export request"""
+        body = json.dumps(otlp_request(spans), ensure_ascii=False)
+        try:
+            if self.collector:
+                request = urllib.request.Request(
+                    self.target, data=body.encode('utf-8'),
+                    headers={'Content-Type': 'application/json'})
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+            else:
+                with open(self.target, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(body + '\n')
+        except OSError as err:
+            logging.error('не удалось экспортировать трассы в %s: %s',
+                          self.target, err)
+
+    def close(self):
+        """write queued traces and stop writer"""
+        self.queue.put(None)
+        self.thread.join()
@@ -1,10 +1,286 @@
 """main for start server variant"""
 
 import os
+import sys
+import json
 import argparse
 
-from autorepeater.autorepeater import RunnerParams
-from autorepeater.autorepeater import Runner
+from tinkoff.invest.constants import INVEST_GRPC_API
+
+from autorepeater.autorepeater import DST_MONEY_RESERVED
+from autorepeater.autorepeater import THRESHOLD
+from autorepeater.catalog import CATALOG_FILE
+from autorepeater.catalog import CATALOG_TTL
+from autorepeater.channel import COMPRESSION
+from autorepeater.channel import KEEPALIVE_TIME
+from autorepeater.channel import KEEPALIVE_TIMEOUT
+from autorepeater.channel import MARKET_HOURS
+from autorepeater.channel import parse_hours
+from autorepeater.convergence import CONVERGENCE_WAIT
+from autorepeater.execution import LIMIT_ATTEMPTS
+from autorepeater.execution import LIMIT_TIMEOUT
+from autorepeater.fx import FX_TTL
+from autorepeater.journal import JOURNAL_WINDOW
+from autorepeater.journal import connect
+from autorepeater.journal import explain_orders
+from autorepeater.journal import latency_stats
+from autorepeater.journal import parse_time
+from autorepeater.planner import load_from_recording
+from autorepeater.reconcile import RECONCILE_JITTER
+from autorepeater.retries import CALL_DEADLINE
+from autorepeater.retries import ORDER_DEADLINE
+from autorepeater.retries import ORDER_RETRIES
+from autorepeater.retries import RETRY_BACKOFF
+from autorepeater.runner import BudgetParams
+from autorepeater.runner import ChannelParams
+from autorepeater.runner import ConnectionParams
+from autorepeater.runner import ConvergenceParams
+from autorepeater.runner import DeadlineParams
+from autorepeater.runner import ExecutionParams
+from autorepeater.runner import FxParams
+from autorepeater.runner import HeartbeatParams
+from autorepeater.runner import InstrumentParams
+from autorepeater.runner import LimitParams
+from autorepeater.runner import MetricsParams
+from autorepeater.runner import OutputParams
+from autorepeater.runner import PairsParams
+from autorepeater.runner import ProfileParams
+from autorepeater.runner import ReconcileParams
+from autorepeater.runner import RetryParams
+from autorepeater.runner import Runner
+from autorepeater.runner import RunnerParams
+from autorepeater.runner import SliceParams
+from autorepeater.runner import SyncParams
+from autorepeater.runner import TraceParams
+from autorepeater.slicing import SLICE_INTERVAL
+from autorepeater.planner import load_snapshots
+from autorepeater.planner import plan_offline
+from autorepeater.tracing import TRACE_SAMPLE
+
+
+def add_plan_parser(subparsers):
+    """arguments of offline planner subcommand"""
+    parser = subparsers.add_parser(
+        "plan", help="рассчитать заявки по сохранённым портфелям без обращения к API")
+    parser.add_argument("--src-snapshot", type=str, help="портфель счёта источника")
+    parser.add_argument("--dst-snapshot", type=str, help="портфель счёта назначения")
+    parser.add_argument("--catalog", type=str, help="справочник инструментов")
+    parser.add_argument("--recording", type=str, help="взять последние портфели "
+                        "счетов -s/-d и инструменты из записи --record")
+    parser.add_argument("--thresholds", type=float, nargs='+',
+                        default=[float(THRESHOLD)], help="перебираемые пороги")
+    parser.add_argument("--reserves", type=float, nargs='+',
+                        default=[float(DST_MONEY_RESERVED)],
+                        help="перебираемые резервы")
+    parser.add_argument("-o", "--output", type=str, help="файл для результата")
+
+
+def check_plan_args(parser, args):
+    """exit with usage error if planner has no portfolios to load"""
+    if args.recording:
+        if not (args.src and args.dst):
+            parser.error("--recording требует -s и -d")
+    elif not (args.src_snapshot and args.dst_snapshot and args.catalog):
+        parser.error("plan требует --recording или --src-snapshot, "
+                     "--dst-snapshot и --catalog")
+
+
+def plan(args):
+    """run offline planner and write plans as json"""
+    if args.recording:
+        records = load_from_recording(args.recording, args.src, args.dst)
+    else:
+        records = load_snapshots(args.src_snapshot, args.dst_snapshot,
+                                 args.catalog)
+    result = plan_offline(records, args.thresholds, args.reserves)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(result, output, ensure_ascii=False, indent=1)
+    else:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=1)
+        sys.stdout.write('\n')
+
+
+def add_journal_parser(subparsers):
+    """arguments of journal query subcommand"""
+    parser = subparsers.add_parser(
+        "journal", help="запросы к журналу синхронизаций --journal")
+    parser.add_argument("path", type=str, help="файл журнала")
+    parser.add_argument("--why", type=str, metavar="INSTRUMENT",
+                        help="заявки по uid или тикеру инструмента около "
+                        "времени --at с планом их синхронизаций")
+    parser.add_argument("--at", type=parse_time, help="время в формате ISO "
+                        "или unix time")
+    parser.add_argument("--window", type=float, default=JOURNAL_WINDOW,
+                        help="окно поиска заявок вокруг --at в секундах")
+    parser.add_argument("--since", type=parse_time,
+                        help="начало периода статистики задержек")
+    parser.add_argument("--until", type=parse_time,
+                        help="конец периода статистики задержек")
+    parser.add_argument("--account", type=str,
+                        help="счёт назначения для статистики задержек")
+
+
+def journal(args):
+    """answer journal query as json"""
+    connection = connect(args.path)
+    try:
+        if args.why:
+            result = explain_orders(connection, args.why, args.at, args.window)
+        else:
+            result = latency_stats(connection, since=args.since,
+                                   until=args.until, account=args.account)
+    finally:
+        connection.close()
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=1)
+    sys.stdout.write('\n')
+
+
+def add_order_arguments(parser):
+    """add arguments of order execution and retries"""
+    parser.add_argument("--check-buying-power", action='store_true',
+                        help="перед отправкой уменьшать покупки до доступных "
+                        "средств счёта назначения, начиная с самых крупных")
+    parser.add_argument("--order-mode", choices=['bestprice', 'limit'],
+                        default='bestprice',
+                        help="тип заявок: по лучшей цене или лимитные по "
+                        "стакану с перевыставлением неисполненных")
+    parser.add_argument("--limit-timeout", type=float, default=LIMIT_TIMEOUT,
+                        help="сколько секунд ждать исполнения лимитных заявок "
+                        "перед отменой и перевыставлением")
+    parser.add_argument("--limit-attempts", type=int, default=LIMIT_ATTEMPTS,
+                        help="количество попыток лимитными заявками, остаток "
+                        "выставляется по лучшей цене")
+    parser.add_argument("--slice-notional", type=float,
+                        help="дробить заявки дороже этой суммы на дочерние")
+    parser.add_argument("--slice-depth-share", type=float,
+                        help="дробить заявки больше этой доли объёма стакана")
+    parser.add_argument("--slice-interval", type=float, default=SLICE_INTERVAL,
+                        help="пауза в секундах между дочерними заявками")
+    parser.add_argument("--convergence-rounds", type=int, default=0,
+                        help="сколько раз после исполнения заявок пересчитывать "
+                        "план по свежим портфелям, пока отклонение выше порога")
+    parser.add_argument("--convergence-wait", type=float, default=CONVERGENCE_WAIT,
+                        help="сколько секунд ждать исполнения заявок перед "
+                        "раундом выравнивания")
+    parser.add_argument("--call-deadline", type=float, default=CALL_DEADLINE,
+                        help="дедлайн запроса к API в секундах")
+    parser.add_argument("--order-deadline", type=float, default=ORDER_DEADLINE,
+                        help="дедлайн выставления заявки в секундах")
+    parser.add_argument("--order-retries", type=int, default=ORDER_RETRIES,
+                        help="сколько раз повторять заявку с тем же "
+                        "идентификатором после таймаута")
+    parser.add_argument("--retry-backoff", type=float, default=RETRY_BACKOFF,
+                        help="пауза в секундах перед первым повтором заявки, "
+                        "удваивается с каждым повтором")
+    parser.add_argument("--sync-deadline", type=float,
+                        help="бюджет времени синхронизации в секундах; новое "
+                        "событие прерывает синхронизацию, ещё не начавшую "
+                        "выставлять заявки")
+
+
+def add_channel_arguments(parser):
+    """add arguments of gRPC channel and its keepalive"""
+    parser.add_argument("--keepalive-time", type=float, default=KEEPALIVE_TIME,
+                        help="интервал keepalive пингов канала в секундах, по "
+                        "умолчанию без keepalive; сервер API разрывает "
+                        "соединение при слишком частых пингах")
+    parser.add_argument("--keepalive-timeout", type=float,
+                        default=KEEPALIVE_TIMEOUT,
+                        help="сколько секунд ждать ответа на keepalive пинг")
+    parser.add_argument("--max-message-size", type=float,
+                        help="максимальный размер сообщения канала в мегабайтах")
+    parser.add_argument("--compression", choices=sorted(COMPRESSION),
+                        help="сжатие сообщений канала")
+    parser.add_argument("--warm-up", action='store_true',
+                        help="прогреть канал и кэш инструментов перед "
+                        "подпиской на поток")
+    parser.add_argument("--heartbeat-interval", type=float,
+                        help="интервал лёгкого запроса к API в секундах, "
+                        "поддерживающего соединение в часы торгов")
+    parser.add_argument("--heartbeat-hours", type=parse_hours,
+                        default=MARKET_HOURS,
+                        help="часы торгов по Москве для --heartbeat-interval, "
+                        "например 7-24")
+
+
+def add_output_arguments(parser):
+    """add arguments of sync journal, traces and log format"""
+    parser.add_argument("--journal", type=str, metavar="FILE",
+                        help="записывать синхронизации, планы и заявки в "
+                        "журнал SQLite FILE")
+    parser.add_argument("--trace", type=str, metavar="TARGET",
+                        help="трассировать синхронизации и писать трассы в "
+                        "формате OTLP/JSON в файл TARGET или отправлять на "
+                        "коллектор по http адресу, например "
+                        "http://localhost:4318/v1/traces")
+    parser.add_argument("--trace-sample", type=float, default=TRACE_SAMPLE,
+                        help="доля сохраняемых трасс от 0 до 1")
+    parser.add_argument("--trace-slow", type=float,
+                        help="всегда сохранять трассы синхронизаций дольше "
+                        "этого числа секунд")
+    parser.add_argument("--log-json", action='store_true',
+                        help="писать лог в формате JSON с полями синхронизации, "
+                        "счёта, инструмента, лотов и задержки")
+
+
+def make_params(args):
+    """runner params grouped by feature from command line arguments"""
+    return RunnerParams(
+        debug=args.debug,
+        threshold=args.threshold,
+        reserve=args.reserve,
+        sync=SyncParams(
+            state_file=args.state_file,
+            delta_tolerance=args.delta_tolerance,
+            budget=BudgetParams(calls=args.call_budget,
+                                deadline=args.sync_deadline),
+            fx=FxParams(multi_currency=args.multi_currency, ttl=args.fx_ttl,
+                        rebalance=args.rebalance_currencies),
+            reconcile=ReconcileParams(interval=args.reconcile_interval,
+                                      jitter=args.reconcile_jitter,
+                                      hours=args.reconcile_hours),
+            instruments=InstrumentParams(ttl=args.instrument_ttl,
+                                         catalog_file=args.catalog_file,
+                                         catalog_ttl=args.catalog_ttl),
+            pairs=PairsParams(config_file=args.config, pairs_file=args.pairs,
+                              workers=args.workers)),
+        orders=ExecutionParams(
+            mode=args.order_mode,
+            check_buying_power=args.check_buying_power,
+            limit=LimitParams(timeout=args.limit_timeout,
+                              attempts=args.limit_attempts),
+            slicing=SliceParams(notional=args.slice_notional,
+                                depth_share=args.slice_depth_share,
+                                interval=args.slice_interval),
+            retries=RetryParams(retries=args.order_retries,
+                                backoff=args.retry_backoff),
+            convergence=ConvergenceParams(rounds=args.convergence_rounds,
+                                          wait=args.convergence_wait)),
+        connection=ConnectionParams(
+            target=args.target,
+            channel=ChannelParams(keepalive_time=args.keepalive_time,
+                                  keepalive_timeout=args.keepalive_timeout,
+                                  max_message_size=args.max_message_size,
+                                  compression=args.compression),
+            deadlines=DeadlineParams(call=args.call_deadline,
+                                     order=args.order_deadline),
+            heartbeat=HeartbeatParams(interval=args.heartbeat_interval,
+                                      hours=args.heartbeat_hours),
+            warm_up=args.warm_up),
+        outputs=OutputParams(
+            print_portfolio=args.print_portfolio,
+            log_json=args.log_json,
+            record_file=args.record,
+            journal_file=args.journal,
+            metrics=MetricsParams(port=args.metrics_port,
+                                  file=args.metrics_file),
+            trace=TraceParams(target=args.trace, sample=args.trace_sample,
+                              slow=args.trace_slow),
+            profile=ProfileParams(directory=args.profile,
+                                  every=args.profile_every,
+                                  top=args.profile_top)))
+
 
 def main():
     """main function"""
@@ -19,19 +295,104 @@ def main():
     parser.add_argument("-r", "--reserve", type=float, help="резев на счёте назначения"
                         " для округлений и комиссий. Доля стоимости счёта назначения. "
                         "По умолчания 0.005")
+    parser.add_argument("--print-portfolio", nargs='?', const='full',
+                        choices=['full', 'summary'],
+                        help="вывести состав всех счетов при запуске: full - все "
+                        "позиции, summary - только итоговая стоимость счетов")
+    parser.add_argument("--state-file", type=str, help="файл последнего "
+                        "синхронизированного состояния. Если позиции обоих счетов "
+                        "не изменились, начальная синхронизация пропускается")
+    parser.add_argument("--metrics-port", type=int, help="порт для отдачи метрик "
+                        "в формате Prometheus на 127.0.0.1")
+    parser.add_argument("--metrics-file", type=str, help="файл для периодической "
+                        "записи метрик в формате Prometheus (textfile collector)")
+    parser.add_argument("--call-budget", type=int, help="максимальное количество "
+                        "запросов к API за одну синхронизацию, при превышении "
+                        "планирование прерывается. Заявки не ограничиваются")
+    parser.add_argument("--instrument-ttl", type=float, help="время жизни кэша "
+                        "торгового статуса и лотности инструментов между "
+                        "синхронизациями в секундах. По умолчанию 0 - статус "
+                        "запрашивается каждой синхронизацией")
+    parser.add_argument("--profile", nargs='?', const='profiles', metavar="DIR",
+                        help="профилировать синхронизации и сохранять профили в "
+                        "каталог DIR (по умолчанию profiles)")
+    parser.add_argument("--profile-every", type=int, default=1,
+                        help="профилировать каждую N-ую синхронизацию")
+    parser.add_argument("--profile-top", type=int, default=20,
+                        help="количество самых затратных функций в логе")
+    parser.add_argument("--target", type=str, default=INVEST_GRPC_API,
+                        help="адрес gRPC API, например локального стенда "
+                        "autorepeater.stand")
+    parser.add_argument("--record", type=str, metavar="FILE",
+                        help="дописывать события потока и полученные при "
+                        "синхронизации портфели в FILE для воспроизведения через "
+                        "python -m autorepeater.replay")
+    add_order_arguments(parser)
+    add_channel_arguments(parser)
+    parser.add_argument("--multi-currency", action='store_true',
+                        help="оценивать позиции во всех валютах в рублях по "
+                        "курсам валют")
+    parser.add_argument("--fx-ttl", type=float, default=FX_TTL,
+                        help="время жизни кэша курсов валют в секундах")
+    parser.add_argument("--rebalance-currencies", action='store_true',
+                        help="повторять позиции в иностранных валютах "
+                        "покупкой и продажей валют, включает --multi-currency")
+    parser.add_argument("--reconcile-interval", type=float,
+                        help="интервал сверки счетов в секундах между событиями "
+                        "потока; полная синхронизация запускается, только если "
+                        "отклонение больше порога")
+    parser.add_argument("--reconcile-jitter", type=float,
+                        default=RECONCILE_JITTER,
+                        help="случайное отклонение интервала сверки, доля "
+                        "интервала")
+    parser.add_argument("--reconcile-hours", type=parse_hours,
+                        default=MARKET_HOURS,
+                        help="часы торгов по Москве для сверки, например 7-24")
+    parser.add_argument("--delta-tolerance", type=float,
+                        help="по событию счёта источника пересчитывать заявки "
+                        "только по названным в нём бумагам, пока коэффициент "
+                        "отличается от коэффициента последнего полного плана "
+                        "не больше чем на эту долю")
+    parser.add_argument("--config", type=str, metavar="FILE",
+                        help="TOML конфигурация пар счетов с порогом, резервом "
+                        "и полосой сверки для каждой пары. Перечитывается при "
+                        "изменении файла и по SIGHUP без перезапуска; без -d "
+                        "пары из FILE запускаются в режиме супервизора")
+    parser.add_argument("--pairs", type=str, metavar="FILE",
+                        help="режим супервизора: JSON список пар [src, dst], "
+                        "распределяемых по процессам-воркерам вместо -s/-d")
+    parser.add_argument("--workers", type=int,
+                        help="количество процессов-воркеров, по умолчанию по "
+                        "числу процессоров")
+    parser.add_argument("--catalog-file", type=str, default=CATALOG_FILE,
+                        help="файл общего справочника инструментов воркеров")
+    parser.add_argument("--catalog-ttl", type=float, default=CATALOG_TTL,
+                        help="интервал обновления справочника инструментов в "
+                        "секундах")
+    add_output_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command")
+    add_plan_parser(subparsers)
+    add_journal_parser(subparsers)
     args = parser.parse_args()
 
+    if args.command == "plan":
+        check_plan_args(parser, args)
+        plan(args)
+        return
+    if args.command == "journal":
+        if args.why and args.at is None:
+            parser.error("--why требует --at")
+        journal(args)
+        return
+
     invest_token = os.environ["INVEST_TOKEN"]
 
-    runer = Runner(
-        token=invest_token,
-        src=args.src,
-        dst=args.dst,
-        params=RunnerParams(
-            debug=args.debug,
-            threshold=args.threshold,
-            reserve=args.reserve))
-    runer.run()
+    runer = Runner(token=invest_token, src=args.src, dst=args.dst,
+                   params=make_params(args))
+    if args.pairs or (args.config and not args.dst):
+        runer.run_supervisor()
+    else:
+        runer.run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,262 @@
+# pylint: disable=R0903, R0913, R0917
+"""shared fixtures and helpers of tests"""
+from decimal import Decimal
+
+import pytest
+
+from tinkoff.invest import MoneyValue
+from tinkoff.invest import Instrument
+from tinkoff.invest import PortfolioPosition
+from tinkoff.invest import Quotation
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderType
+from tinkoff.invest import FindInstrumentResponse
+from tinkoff.invest import InstrumentResponse
+from tinkoff.invest import PortfolioResponse
+from tinkoff.invest import InstrumentShort
+from tinkoff.invest import GetAccountsResponse
+from tinkoff.invest import Account
+from tinkoff.invest import AccountType
+from tinkoff.invest import AccountStatus
+from tinkoff.invest import InstrumentIdType
+from tinkoff.invest import SecurityTradingStatus
+from tinkoff.invest import PostOrderResponse
+from tinkoff.invest import RequestError
+from tinkoff.invest import WithdrawLimitsResponse
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import OrderParams
+from autorepeater.simulation import SimAccount
+from autorepeater.simulation import SimInstrument
+from autorepeater.simulation import SimulatedMarket
+
+
+class TestException(Exception):
+    """TestException исключение для остановки бесконечного цикла в тесте mainflow"""
+
+
+class FakeClient:
+    """FakeClient mock для клиента тинькофф инвестиций"""
+    class FakeInstruments:
+        """FakeInstruments mock для работы с инструментами тинькофф инвестиций"""
+
+        def find_instrument(self, query):
+            """find_instrument mock для поиска инструмента"""
+            names = {
+                "1": "share1",
+                "2": "etf2"
+            }
+            tickers = {
+                "1": "SHR",
+                "2": "ETF"
+            }
+            try:
+                return FindInstrumentResponse(
+                    instruments=[InstrumentShort(
+                        name=names[query], ticker=tickers[query])]
+                )
+            except KeyError:
+                return FindInstrumentResponse(
+                    instruments=[]
+                )
+
+# pylint: disable=W0622,C0103
+        def get_instrument_by(self, id_type, id):
+            """get_instrument_by mock для получения инструмента по его id"""
+            assert id_type == InstrumentIdType.INSTRUMENT_ID_TYPE_UID
+            names = {
+                "1": "share1",
+                "2": "etf2"
+            }
+            tickers = {
+                "1": "SHR",
+                "2": "ETF"
+            }
+            try:
+                return InstrumentResponse(
+                    instrument=Instrument(
+                        name=names[id],
+                        ticker=tickers[id],
+                        trading_status=SecurityTradingStatus.SECURITY_TRADING_STATUS_NORMAL_TRADING,
+                        lot=1))
+            except KeyError:
+                assert False
+# pylint: enable=W0622,C0103
+
+    class FakeOperations:
+        """FakeOperations mock для работы с операциями тинькофф инвестиций"""
+
+        def get_portfolio(self, account_id):
+            """get_portfolio mock для получения данных о составе инструментов на брокерском счёте"""
+            if account_id == '1':
+                return PortfolioResponse(
+                    positions=[
+                        PortfolioPosition(
+                            instrument_type='currency',
+                            current_price=MoneyValue(
+                                currency='RUB',
+                                units=1,
+                                nano=200000000),
+                            quantity=Quotation(
+                                units=2,
+                                nano=0))])
+            if account_id == '4':
+                return PortfolioResponse(
+                    positions=[
+                        PortfolioPosition(
+                            instrument_type='share',
+                            instrument_uid='1',
+                            current_price=MoneyValue(
+                                currency='RUB',
+                                units=1,
+                                nano=200000000),
+                            quantity=Quotation(
+                                units=2,
+                                nano=0))])
+            if account_id == '5':
+                return PortfolioResponse(
+                    positions=[
+                        PortfolioPosition(
+                            instrument_type='currency',
+                            current_price=MoneyValue(
+                                currency='RUB',
+                                units=1,
+                                nano=200000000),
+                            quantity=Quotation(
+                                units=2,
+                                nano=0))])
+            return PortfolioResponse(positions=[])
+
+        def get_withdraw_limits(self, account_id):
+            """get_withdraw_limits mock для получения доступных средств счёта"""
+            assert account_id == '5'
+            return WithdrawLimitsResponse(
+                money=[MoneyValue(currency='rub', units=2, nano=400000000)],
+                blocked=[],
+                blocked_guarantee=[])
+
+    class FakeUsers:
+        """FakeUsers mock для работы с аккаунтами тинькофф инвестиций"""
+
+        def get_accounts(self):
+            """get_accounts mock для получения списка брокерских счетов"""
+            return GetAccountsResponse(
+                accounts=[
+                    Account(
+                        id='1',
+                        type=AccountType.ACCOUNT_TYPE_TINKOFF,
+                        name='account name',
+                        status=AccountStatus.ACCOUNT_STATUS_OPEN),
+                    Account(
+                        id='2',
+                        type=AccountType.ACCOUNT_TYPE_TINKOFF,
+                        name='account name',
+                        status=AccountStatus.ACCOUNT_STATUS_OPEN)])
+
+    class FakeOrders:
+        """FakeOrders mock для работы с заявками тинькофф инвестиций"""
+
+        def post_order(
+            self,
+            quantity,
+            direction,
+            account_id,
+            order_type,
+            instrument_id,
+            order_id,
+        ):
+            """post_order mock для отправки заявки"""
+            assert order_type == OrderType.ORDER_TYPE_BESTPRICE
+            assert len(order_id) == 36
+            if account_id == '1':
+                if direction == OrderDirection.ORDER_DIRECTION_BUY:
+                    assert instrument_id == '2'
+                    assert quantity == 50
+                elif direction == OrderDirection.ORDER_DIRECTION_SELL:
+                    assert instrument_id == '1'
+                    assert quantity == 100
+                else:
+                    assert False
+            elif account_id == '5':
+                if direction == OrderDirection.ORDER_DIRECTION_BUY:
+                    assert instrument_id == '1'
+                    assert quantity == 2
+                elif direction == OrderDirection.ORDER_DIRECTION_SELL:
+                    assert instrument_id == '1'
+                    assert quantity == 100
+                else:
+                    assert False
+
+            return PostOrderResponse()
+
+    class FakeOperationsStream:
+        """FakeOperationsStream mock для работы с потоком операций тинькофф инвестиций"""
+        count_operations: int
+
+        def positions_stream(self, accounts):
+            """positions_stream mock для получения операций по списку счетов"""
+            self.count_operations = self.count_operations + 1
+            assert accounts == ['4', '5']
+            # 2 запуска и кидаем исключение, что бы не уйти в бесконечный цикл
+            if (self.count_operations) <= 2:
+                return []
+            if self.count_operations == 3:
+                raise RequestError(
+                    code='1', details='details', metadata='metadata')
+            raise TestException()
+
+        def __init__(self):
+            self.count_operations = 0
+
+    instruments: FakeInstruments
+    operations: FakeOperations
+    operations_stream: FakeOperationsStream
+    users: FakeUsers
+    orders: FakeOrders
+
+    def __init__(self):
+        self.instruments = FakeClient.FakeInstruments()
+        self.operations = FakeClient.FakeOperations()
+        self.operations_stream = FakeClient.FakeOperationsStream()
+        self.users = FakeClient.FakeUsers()
+        self.orders = FakeClient.FakeOrders()
+
+
+@pytest.fixture(name='client')
+def client_tinvest():
+    """client_tinvest - фикстура создаёт и возвращает mock клиента"""
+    return FakeClient()
+
+
+@pytest.fixture(name='auto_repeater')
+def auto_repeater_fixture(client):
+    """auto_repeater_fixture - фикстура создаёт и возвращает основной класс передав ему клиента"""
+    return AutoRepeater(client)
+
+
+@pytest.fixture(name='market')
+def market_fixture():
+    """market_fixture - фикстура создаёт рынок: рублёвые акция и фонд,
+    долларовая акция и доллар, счёт источника с акцией и счёт назначения
+    с рублями
+    """
+    return SimulatedMarket(
+        [SimInstrument(uid='1', name='share1', ticker='SHR',
+                       price=Decimal('10'), lot=1),
+         SimInstrument(uid='2', name='etf2', ticker='ETF',
+                       price=Decimal('10'), lot=10),
+         SimInstrument(uid='3', name='share3', ticker='USH',
+                       price=Decimal('10'), currency='usd'),
+         SimInstrument(uid='usd-uid', name='usd', ticker='USDRUB',
+                       price=Decimal('90'), instrument_type='currency',
+                       currency='usd')],
+        [SimAccount(account_id='src', name='src',
+                    holdings={'1': Decimal('10')}),
+         SimAccount(account_id='dst', name='dst', cash=Decimal('1000'))])
+
+
+def buy_order(instrument_id, quantity):
+    """buy order params for tests"""
+    return OrderParams(instrument_id=instrument_id, quantity=quantity,
+                       direction=OrderDirection.ORDER_DIRECTION_BUY,
+                       order_type=OrderType.ORDER_TYPE_BESTPRICE)
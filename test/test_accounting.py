@@ -0,0 +1,55 @@
+# pylint: disable=R0903
+"""tests for api calls accounting"""
+import pytest
+
+from autorepeater.accounting import CallBudgetExceeded
+from autorepeater.accounting import CountingClient
+
+
+class FakeService:
+    """FakeService mock сервиса клиента"""
+    name = 'service'
+
+    def call(self, value):
+        """call mock запроса"""
+        return value
+
+
+class FakeClient:
+    """FakeClient mock клиента с двумя сервисами"""
+
+    def __init__(self):
+        self.instruments = FakeService()
+        self.orders = FakeService()
+
+
+def test_counting_client():
+    """test_counting_client"""
+    client = CountingClient(FakeClient())
+    assert client.instruments.call(1) == 1
+    assert client.instruments.name == 'service'
+    with client.sync_scope(7) as calls:
+        client.instruments.call(2)
+        client.instruments.call(3)
+        client.orders.call(4)
+    assert calls.counts == {'instruments.call': 2, 'orders.call': 1}
+    assert calls.total == 3
+    assert calls.summary().startswith('sync 7 calls: instruments.call=2/')
+    assert client.totals.counts == {'instruments.call': 3, 'orders.call': 1}
+    assert client.current is None
+
+
+def test_counting_client_budget():
+    """test_counting_client_budget"""
+    client = CountingClient(FakeClient(), budget=2)
+    # Вне синхронизации бюджет не действует
+    for value in range(3):
+        client.instruments.call(value)
+    with client.sync_scope(1) as calls:
+        client.instruments.call(1)
+        client.instruments.call(2)
+        with pytest.raises(CallBudgetExceeded):
+            client.instruments.call(3)
+        # Заявки бюджетом не ограничиваются
+        client.orders.call(4)
+    assert calls.counts == {'instruments.call': 2, 'orders.call': 1}
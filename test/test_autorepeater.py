@@ -2,8 +2,11 @@
 """tests"""
 from decimal import Decimal
 
+from test.conftest import TestException
+
 import pytest
 
+from tinkoff.invest import Account
 from tinkoff.invest import MoneyValue
 from tinkoff.invest import Instrument
 from tinkoff.invest import PortfolioPosition
@@ -13,18 +16,6 @@ from tinkoff.invest import PositionsMoney
 from tinkoff.invest import PositionsSecurities
 from tinkoff.invest import OrderDirection
 from tinkoff.invest import OrderType
-from tinkoff.invest import FindInstrumentResponse
-from tinkoff.invest import InstrumentResponse
-from tinkoff.invest import PortfolioResponse
-from tinkoff.invest import InstrumentShort
-from tinkoff.invest import GetAccountsResponse
-from tinkoff.invest import Account
-from tinkoff.invest import AccountType
-from tinkoff.invest import AccountStatus
-from tinkoff.invest import InstrumentIdType
-from tinkoff.invest import SecurityTradingStatus
-from tinkoff.invest import PostOrderResponse
-from tinkoff.invest import RequestError
 
 from autorepeater.autorepeater import money_to_string
 from autorepeater.autorepeater import no_money_to_string
@@ -39,11 +30,16 @@ from autorepeater.autorepeater import OrderParams
 from autorepeater.autorepeater import AutoRepeater
 from autorepeater.autorepeater import THRESHOLD
 from autorepeater.autorepeater import DST_MONEY_RESERVED
+from autorepeater.autorepeater import IMPORTANT
 from autorepeater.autorepeater import GetInstrumentException
-
-
-class TestException(Exception):
-    """TestException исключение для остановки бесконечного цикла в тесте mainflow"""
+from autorepeater.autorepeater import get_holdings
+from autorepeater.accounting import CallBudgetExceeded
+from autorepeater.accounting import CountingClient
+from autorepeater.delta import DeltaPlans
+from autorepeater.metrics import SyncMetrics
+from autorepeater.profiling import SyncProfiler
+from autorepeater.state import load_state
+from autorepeater.state import StateFile
 
 
 @pytest.mark.parametrize(
@@ -385,195 +381,6 @@ def test_get_max_sum_positions_price(sell_orders_params, buy_orders_params,
     assert result == expected
 
 
-class FakeClient:
-    """FakeClient mock для клиента тинькофф инвестиций"""
-    class FakeInstruments:
-        """FakeInstruments mock для работы с инструментами тинькофф инвестиций"""
-
-        def find_instrument(self, query):
-            """find_instrument mock для поиска инструмента"""
-            names = {
-                "1": "share1",
-                "2": "etf2"
-            }
-            tickers = {
-                "1": "SHR",
-                "2": "ETF"
-            }
-            try:
-                return FindInstrumentResponse(
-                    instruments=[InstrumentShort(
-                        name=names[query], ticker=tickers[query])]
-                )
-            except KeyError:
-                return FindInstrumentResponse(
-                    instruments=[]
-                )
-
-# pylint: disable=W0622,C0103
-        def get_instrument_by(self, id_type, id):
-            """get_instrument_by mock для получения инструмента по его id"""
-            assert id_type == InstrumentIdType.INSTRUMENT_ID_TYPE_UID
-            names = {
-                "1": "share1",
-                "2": "etf2"
-            }
-            tickers = {
-                "1": "SHR",
-                "2": "ETF"
-            }
-            try:
-                return InstrumentResponse(
-                    instrument=Instrument(
-                        name=names[id],
-                        ticker=tickers[id],
-                        trading_status=SecurityTradingStatus.SECURITY_TRADING_STATUS_NORMAL_TRADING,
-                        lot=1))
-            except KeyError:
-                assert False
-# pylint: enable=W0622,C0103
-
-    class FakeOperations:
-        """FakeOperations mock для работы с операциями тинькофф инвестиций"""
-
-        def get_portfolio(self, account_id):
-            """get_portfolio mock для получения данных о составе инструментов на брокерском счёте"""
-            if account_id == '1':
-                return PortfolioResponse(
-                    positions=[
-                        PortfolioPosition(
-                            instrument_type='currency',
-                            current_price=MoneyValue(
-                                currency='RUB',
-                                units=1,
-                                nano=200000000),
-                            quantity=Quotation(
-                                units=2,
-                                nano=0))])
-            if account_id == '4':
-                return PortfolioResponse(
-                    positions=[
-                        PortfolioPosition(
-                            instrument_type='share',
-                            instrument_uid='1',
-                            current_price=MoneyValue(
-                                currency='RUB',
-                                units=1,
-                                nano=200000000),
-                            quantity=Quotation(
-                                units=2,
-                                nano=0))])
-            if account_id == '5':
-                return PortfolioResponse(
-                    positions=[
-                        PortfolioPosition(
-                            instrument_type='currency',
-                            current_price=MoneyValue(
-                                currency='RUB',
-                                units=1,
-                                nano=200000000),
-                            quantity=Quotation(
-                                units=2,
-                                nano=0))])
-            return PortfolioResponse(positions=[])
-
-    class FakeUsers:
-        """FakeUsers mock для работы с аккаунтами тинькофф инвестиций"""
-
-        def get_accounts(self):
-            """get_accounts mock для получения списка брокерских счетов"""
-            return GetAccountsResponse(
-                accounts=[
-                    Account(
-                        id='1',
-                        type=AccountType.ACCOUNT_TYPE_TINKOFF,
-                        name='account name',
-                        status=AccountStatus.ACCOUNT_STATUS_OPEN),
-                    Account(
-                        id='2',
-                        type=AccountType.ACCOUNT_TYPE_TINKOFF,
-                        name='account name',
-                        status=AccountStatus.ACCOUNT_STATUS_OPEN)])
-
-    class FakeOrders:
-        """FakeOrders mock для работы с заявками тинькофф инвестиций"""
-
-        def post_order(
-            self,
-            quantity,
-            direction,
-            account_id,
-            order_type,
-            instrument_id,
-        ):
-            """post_order mock для отправки заявки"""
-            assert order_type == OrderType.ORDER_TYPE_BESTPRICE
-            if account_id == '1':
-                if direction == OrderDirection.ORDER_DIRECTION_BUY:
-                    assert instrument_id == '2'
-                    assert quantity == 50
-                elif direction == OrderDirection.ORDER_DIRECTION_SELL:
-                    assert instrument_id == '1'
-                    assert quantity == 100
-                else:
-                    assert False
-            elif account_id == '5':
-                if direction == OrderDirection.ORDER_DIRECTION_BUY:
-                    assert instrument_id == '1'
-                    assert quantity == 2
-                elif direction == OrderDirection.ORDER_DIRECTION_SELL:
-                    assert instrument_id == '1'
-                    assert quantity == 100
-                else:
-                    assert False
-
-            return PostOrderResponse()
-
-    class FakeOperationsStream:
-        """FakeOperationsStream mock для работы с потоком операций тинькофф инвестиций"""
-        count_operations: int
-
-        def positions_stream(self, accounts):
-            """positions_stream mock для получения операций по списку счетов"""
-            self.count_operations = self.count_operations + 1
-            assert accounts == ['4', '5']
-            # 2 запуска и кидаем исключение, что бы не уйти в бесконечный цикл
-            if (self.count_operations) <= 2:
-                return []
-            if self.count_operations == 3:
-                raise RequestError(
-                    code='1', details='details', metadata='metadata')
-            raise TestException()
-
-        def __init__(self):
-            self.count_operations = 0
-
-    instruments: FakeInstruments
-    operations: FakeOperations
-    operations_stream: FakeOperationsStream
-    users: FakeUsers
-    orders: FakeOrders
-
-    def __init__(self):
-        self.instruments = FakeClient.FakeInstruments()
-        self.operations = FakeClient.FakeOperations()
-        self.operations_stream = FakeClient.FakeOperationsStream()
-        self.users = FakeClient.FakeUsers()
-        self.orders = FakeClient.FakeOrders()
-
-
-@pytest.fixture(name='client')
-def client_tinvest():
-    """client_tinvest - фикстура создаёт и возвращает mock клиента"""
-    return FakeClient()
-
-
-@pytest.fixture(name='auto_repeater')
-def auto_repeater_fixture(client):
-    """auto_repeater_fixture - фикстура создаёт и возвращает основной класс передав ему клиента"""
-    return AutoRepeater(client)
-
-
 def test_init(auto_repeater):
     """test_init"""
     # Проверка базовой инициализации
@@ -724,6 +531,28 @@ def test_postiton_to_string(
     assert result == expected
 
 
+def test_postiton_to_string_cached_only(auto_repeater):
+    """test_postiton_to_string_cached_only"""
+    position = PortfolioPosition(
+        instrument_type='share',
+        current_price=MoneyValue(currency="USD", units=100, nano=0),
+        quantity=Quotation(units=2, nano=0),
+        instrument_uid='1',
+    )
+    calls = []
+    find_instrument = auto_repeater.client.instruments.find_instrument
+    auto_repeater.client.instruments.find_instrument = (
+        lambda query: calls.append(query) or find_instrument(query))
+    # Инструмент не в кэше: вместо имени uid, без запросов к API
+    assert (auto_repeater.postiton_to_string(position, cached_only=True) ==
+            '1 - 2.0 - USD - 200.0')
+    assert not calls
+    auto_repeater.get_instrument('1')
+    assert (auto_repeater.postiton_to_string(position, cached_only=True) ==
+            'share1(SHR) - 2.0 - USD - 200.0')
+    assert calls == ['1']
+
+
 def test_get_instrument(auto_repeater):
     """test_get_instrument"""
     instrument_id = "1"
@@ -976,3 +805,174 @@ def test_mainflow(auto_repeater):
         auto_repeater.mainflow(src_account_id, dst_account_id)
     except TestException:
         pass
+
+
+def test_get_holdings():
+    """test_get_holdings"""
+    positions = [
+        PortfolioPosition(
+            instrument_type='currency',
+            instrument_uid='rub',
+            quantity=Quotation(units=10, nano=0)),
+        PortfolioPosition(
+            instrument_type='share',
+            instrument_uid='1',
+            quantity=Quotation(units=2, nano=500000000)),
+    ]
+    assert get_holdings(positions) == {'1': '2.5'}
+
+
+def test_sync_accounts_truncated(auto_repeater, tmp_path):
+    """test_sync_accounts_truncated"""
+    state_file = str(tmp_path / 'state.json')
+    auto_repeater.features.state = StateFile(state_file)
+    auto_repeater.features.delta = DeltaPlans(0.05)
+    orders = auto_repeater.features.orders
+    by_contribution = orders.by_contribution
+
+    def expiring_by_contribution(*args):
+        # Время синхронизации истекает перед выставлением заявок
+        auto_repeater.current.budget.deadline = 0
+        return by_contribution(*args)
+    orders.by_contribution = expiring_by_contribution
+    auto_repeater.sync_accounts('4', '5')
+    assert auto_repeater.metrics.orders.value(status='posted') == 0
+    assert load_state(state_file) is None
+    assert auto_repeater.features.delta.base is None
+
+
+def test_get_instrument_cache(auto_repeater):
+    """test_get_instrument_cache"""
+    calls = []
+    find_instrument = auto_repeater.client.instruments.find_instrument
+
+    def counting_find_instrument(query):
+        calls.append(query)
+        return find_instrument(query)
+    auto_repeater.client.instruments.find_instrument = counting_find_instrument
+
+    account = Account(id='4', name='src')
+    auto_repeater.print_portfolio_by_account(account)
+    auto_repeater.print_portfolio_by_account(account)
+    assert calls == ['1']
+    assert auto_repeater.get_instrument('1').ticker == 'SHR'
+    assert auto_repeater.get_instrument('2').ticker == 'ETF'
+    assert sorted(calls) == ['1', '2']
+
+
+@pytest.mark.parametrize(
+    'summary_only, expected',
+    [
+        (
+            False,
+            [['account name (1)', '------------', 'RUB - 2.4',
+              'total: 2.400000000', '============'],
+             ['account name (2)', '------------', 'total: 0', '============']]
+        ),
+        (
+            True,
+            [['account name (1)', '------------', 'total: 2.400000000',
+              '============'],
+             ['account name (2)', '------------', 'total: 0', '============']]
+        ),
+    ],
+    ids=[
+        'full',
+        'summary_only'
+    ]
+)
+def test_print_all_portfolio(auto_repeater, caplog, summary_only, expected):
+    """test_print_all_portfolio"""
+    with caplog.at_level(IMPORTANT):
+        auto_repeater.print_all_portfolio(summary_only=summary_only)
+    reports = [[]]
+    for record in caplog.records:
+        reports[-1].append(record.getMessage())
+        if record.getMessage() == '============':
+            reports.append([])
+    # Счета выводятся по мере получения, порядок между счетами не гарантирован
+    assert sorted(reports[:-1]) == expected
+
+
+def test_sync_accounts_metrics(auto_repeater):
+    """test_sync_accounts_metrics"""
+    auto_repeater.sync_accounts('4', '5')
+    metrics = auto_repeater.metrics
+    assert metrics.syncs.value() == 1
+    assert metrics.syncs.skipped.value() == 0
+    assert metrics.orders.value(status='posted') == 1
+    assert metrics.orders.first_order_seconds.count() == 1
+    assert metrics.stage_seconds.count(stage='portfolio_fetch') == 2
+    assert metrics.stage_seconds.count(stage='planning') == 1
+    assert metrics.stage_seconds.count(stage='threshold_check') == 1
+    assert metrics.stage_seconds.count(stage='post_order') == 1
+
+    # Счета совпадают, стоимость заявок ниже порога
+    auto_repeater.sync_accounts('4', '4')
+    assert metrics.syncs.value() == 2
+    assert metrics.syncs.skipped.value() == 1
+    assert metrics.orders.value(status='posted') == 1
+
+
+def test_sync_accounts_calls(client):
+    """test_sync_accounts_calls"""
+    auto_repeater = AutoRepeater(CountingClient(client))
+    auto_repeater.sync_accounts('4', '5')
+    assert auto_repeater.current.sync_id == 1
+    # Позиции в логе строятся из кэша, поиск инструментов не нужен
+    assert auto_repeater.client.totals.counts == {
+        'operations.get_portfolio': 2,
+        'instruments.get_instrument_by': 1,
+        'orders.post_order': 1,
+    }
+
+
+def test_sync_accounts_call_budget(client):
+    """test_sync_accounts_call_budget"""
+    auto_repeater = AutoRepeater(CountingClient(client, budget=3))
+    with pytest.raises(CallBudgetExceeded):
+        auto_repeater.sync_accounts('4', '5')
+    assert 'orders.post_order' not in auto_repeater.client.totals.counts
+
+
+def test_sync_accounts_profile(client, tmp_path):
+    """test_sync_accounts_profile"""
+    auto_repeater = AutoRepeater(client, metrics=SyncMetrics(
+        profiler=SyncProfiler(str(tmp_path), every=2)))
+    auto_repeater.sync_accounts('4', '5')
+    assert not list(tmp_path.iterdir())
+    auto_repeater.sync_accounts('4', '5')
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_sync_accounts_deadline(auto_repeater):
+    """test_sync_accounts_deadline"""
+    with pytest.raises(ValueError):
+        auto_repeater.set_sync_deadline(0)
+    auto_repeater.set_sync_deadline(1e-9)
+    auto_repeater.sync_accounts('4', '5')
+    metrics = auto_repeater.metrics
+    assert metrics.syncs.cancelled.value() == 1
+    assert metrics.orders.value(status='posted') == 0
+    assert metrics.stage_seconds.count(stage='portfolio_fetch') == 0
+
+
+def test_sync_accounts_preempt(auto_repeater):
+    """test_sync_accounts_preempt"""
+    operations = auto_repeater.client.operations
+    get_portfolio = operations.get_portfolio
+
+    def preempting_get_portfolio(account_id):
+        # Новое событие приходит, пока синхронизация получает портфели
+        auto_repeater.current.preempt()
+        return get_portfolio(account_id)
+    operations.get_portfolio = preempting_get_portfolio
+    auto_repeater.sync_accounts('4', '5')
+    assert auto_repeater.metrics.syncs.cancelled.value() == 1
+    assert auto_repeater.metrics.orders.value(status='posted') == 0
+
+    # После начала выставления заявок синхронизация не прерывается
+    operations.get_portfolio = get_portfolio
+    auto_repeater.post_order = lambda *args: auto_repeater.current.preempt()
+    auto_repeater.sync_accounts('4', '5')
+    assert auto_repeater.metrics.syncs.cancelled.value() == 1
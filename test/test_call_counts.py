@@ -0,0 +1,85 @@
+"""api call-count regression tests for large synthetic portfolios
+
+every sync must make a bounded number of round trips: at most one
+request per unique instrument on a cold cache and none on a warm one
+"""
+import time
+
+import pytest
+
+from autorepeater.accounting import CountingClient
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.instruments import INSTRUMENT_TTL
+from autorepeater.instruments import InstrumentCache
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import generate_market
+
+# Верхняя граница времени одной синхронизации без сетевых задержек
+MAX_SYNC_SECONDS = 5.0
+
+
+def make_autorepeater(size, ttl=INSTRUMENT_TTL):
+    """make_autorepeater - создаёт основной класс над счётчиком запросов"""
+    market = generate_market(size, seed=size)
+    return AutoRepeater(CountingClient(SimulatedClient(market)), SyncFeatures(
+        instruments=InstrumentCache(ttl=ttl))), market
+
+
+def sync_calls(auto_repeater):
+    """sync_calls - выполняет синхронизацию и возвращает запросы по методам"""
+    client = auto_repeater.client
+    before = dict(client.totals.counts)
+    start = time.perf_counter()
+    auto_repeater.sync_accounts('src', 'dst')
+    duration = time.perf_counter() - start
+    calls = {method: count - before.get(method, 0)
+             for method, count in client.totals.counts.items()
+             if count - before.get(method, 0)}
+    return calls, duration
+
+
+@pytest.mark.parametrize('size', [100, 500])
+def test_cold_sync_calls(size):
+    """test_cold_sync_calls"""
+    auto_repeater, market = make_autorepeater(size)
+    instruments = len(set(market.accounts['src'].holdings) |
+                      set(market.accounts['dst'].holdings))
+    calls, duration = sync_calls(auto_repeater)
+    assert calls['operations.get_portfolio'] == 2
+    assert calls['instruments.find_instrument'] <= instruments
+    assert calls['instruments.get_instrument_by'] <= instruments
+    assert calls.get('orders.post_order', 0) <= instruments
+    assert set(calls) <= {'operations.get_portfolio',
+                          'instruments.find_instrument',
+                          'instruments.get_instrument_by',
+                          'orders.post_order'}
+    assert duration < MAX_SYNC_SECONDS
+
+
+@pytest.mark.parametrize('size', [100, 500])
+def test_warm_sync_calls(size):
+    """test_warm_sync_calls"""
+    auto_repeater, market = make_autorepeater(size, ttl=60)
+    initial = market.snapshot()
+    sync_calls(auto_repeater)
+    market.restore(initial)
+    calls, duration = sync_calls(auto_repeater)
+    # Инструменты берутся из кэша, запросы не зависят от размера портфеля
+    assert calls.get('instruments.find_instrument', 0) == 0
+    assert calls.get('instruments.get_instrument_by', 0) == 0
+    assert calls['operations.get_portfolio'] == 2
+    assert duration < MAX_SYNC_SECONDS
+
+
+def test_instrument_ttl_expired():
+    """test_instrument_ttl_expired"""
+    with pytest.raises(ValueError):
+        InstrumentCache(ttl=-1)
+    auto_repeater, market = make_autorepeater(100, ttl=0)
+    instruments = len(set(market.accounts['src'].holdings) |
+                      set(market.accounts['dst'].holdings))
+    sync_calls(auto_repeater)
+    calls, _ = sync_calls(auto_repeater)
+    # Без кэша между синхронизациями - не больше одного запроса на инструмент
+    assert calls['instruments.get_instrument_by'] <= instruments
@@ -0,0 +1,76 @@
+"""tests for sync budget and sync worker"""
+import math
+import threading
+
+import pytest
+
+from autorepeater.cancellation import SyncBudget
+from autorepeater.cancellation import SyncCancelled
+from autorepeater.cancellation import SyncContext
+from autorepeater.cancellation import SyncDeadlineExceeded
+from autorepeater.cancellation import SyncWorker
+
+
+def test_sync_budget():
+    """test_sync_budget"""
+    budget = SyncBudget()
+    assert budget.remaining() == math.inf
+    budget.check('planning')
+    budget.cancel()
+    with pytest.raises(SyncCancelled, match='planning'):
+        budget.check('planning')
+
+    budget = SyncBudget(0)
+    assert budget.expired()
+    with pytest.raises(SyncDeadlineExceeded):
+        budget.check('portfolio_fetch')
+    assert not SyncBudget(60).expired()
+
+    # Отправляемая синхронизация не прерывается новым событием
+    budget = SyncBudget()
+    budget.posting = True
+    budget.preempt()
+    budget.check('posting')
+
+
+def test_sync_context():
+    """test_sync_context"""
+    context = SyncContext()
+    context.deadline = 60
+    run_id = context.run_id
+    context.start()
+    assert (context.run_id, context.sync_id) == (run_id, 1)
+    assert context.log_extra(account='1') == {'account': '1', 'sync_id': 1}
+    sync_budget = context.budget
+    assert not sync_budget.expired()
+    with context.own_budget(SyncBudget(0)) as budget:
+        assert context.budget is budget
+    assert context.budget is sync_budget
+    context.plan = object()
+    context.start()
+    assert context.sync_id == 2
+    assert context.plan is None
+    context.preempt()
+    with pytest.raises(SyncCancelled):
+        context.budget.check('planning')
+
+
+def test_sync_worker():
+    """test_sync_worker"""
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def run(trigger_time):
+        runs.append(trigger_time)
+        started.set()
+        release.wait()
+    worker = SyncWorker(run).start()
+    worker.trigger(1)
+    started.wait()
+    # События во время синхронизации сливаются в один следующий запуск
+    worker.trigger(2)
+    worker.trigger(3)
+    release.set()
+    worker.stop()
+    assert runs == [1, 2]
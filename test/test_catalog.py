@@ -0,0 +1,98 @@
+"""tests for shared instrument catalog"""
+import os
+from decimal import Decimal
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.catalog import CatalogRecord
+from autorepeater.catalog import InstrumentCatalog
+from autorepeater.catalog import write_catalog
+from autorepeater.instruments import InstrumentCache
+from autorepeater.simulation import SimulatedClient
+
+
+def record(uid, ticker, lot=1):
+    """catalog record for tests"""
+    return CatalogRecord(uid=uid, ticker=ticker, name=f'name {ticker}',
+                         instrument_type='share', currency='rub', lot=lot)
+
+
+def test_catalog(tmp_path):
+    """test_catalog"""
+    path = str(tmp_path / 'instruments.catalog')
+    # Без файла справочник пустой
+    catalog = InstrumentCatalog(path)
+    assert len(catalog) == 0
+    assert catalog.get('1') is None
+
+    records = [record(f'uid-{index:04d}', f'T{index}', lot=index)
+               for index in range(1000, 0, -7)]
+    write_catalog(path, records)
+    assert catalog.refresh()
+    assert not catalog.refresh()
+    assert len(catalog) == len(records)
+    for item in records:
+        assert catalog.get(item.uid) == item
+    assert catalog.get('uid-0000') is None
+    assert catalog.get('uid-9999') is None
+    assert catalog.get('x' * 40) is None
+
+    # Длинные названия обрезаются по границе символа
+    write_catalog(path, [record('1', 'SBER')._replace(name='Сбербанк' * 10)])
+    assert catalog.refresh()
+    assert catalog.get('1').name == 'Сбербанк' * 4
+    assert catalog.get('uid-0001') is None
+    catalog.close()
+
+    with pytest.raises(ValueError):
+        write_catalog(path, [record('x' * 40, 'LONG')])
+
+
+def test_catalog_broken(tmp_path):
+    """test_catalog_broken"""
+    path = tmp_path / 'instruments.catalog'
+    path.write_bytes(b'not a catalog')
+    with pytest.raises(ValueError):
+        InstrumentCatalog(str(path))
+
+
+def test_catalog_broken_file(tmp_path):
+    """test_catalog_broken_file"""
+    path = str(tmp_path / 'instruments.catalog')
+    write_catalog(path, [record('1', 'AAA')])
+    catalog = InstrumentCatalog(path)
+    # Файл заменяется целиком, как это делает write_catalog
+    with open(path + '.tmp', 'wb') as catalog_file:
+        catalog_file.write(b'broken')
+    os.replace(path + '.tmp', path)
+    with pytest.raises(ValueError):
+        catalog.refresh()
+    # Прежний справочник остаётся в работе
+    assert catalog.get('1').ticker == 'AAA'
+    catalog.close()
+
+
+def test_sync_accounts_catalog(market, tmp_path):
+    """test_sync_accounts_catalog"""
+    path = str(tmp_path / 'instruments.catalog')
+    write_catalog(path, [CatalogRecord(
+        uid='1', ticker='CAT', name='catalog1', instrument_type='share',
+        currency='rub', lot=1)])
+    instruments = InstrumentCache(catalog=InstrumentCatalog(path))
+    autorepeater = AutoRepeater(SimulatedClient(market),
+                                SyncFeatures(instruments=instruments))
+    autorepeater.sync_accounts('src', 'dst')
+    # Название взято из справочника, а торговый статус всегда из API
+    assert autorepeater.get_instrument('1').name == 'catalog1'
+    assert autorepeater.get_instrument_by_uid('1').ticker == 'SHR'
+    assert market.accounts['dst'].holdings == {'1': Decimal('99')}
+    # Испорченный справочник не прерывает синхронизацию
+    # Файл заменяется целиком, как это делает write_catalog
+    with open(path + '.tmp', 'wb') as catalog_file:
+        catalog_file.write(b'not a catalog')
+    os.replace(path + '.tmp', path)
+    autorepeater.sync_accounts('src', 'dst')
+    assert instruments.catalog.get('1').name == 'catalog1'
+    assert market.accounts['dst'].holdings == {'1': Decimal('99')}
@@ -0,0 +1,71 @@
+"""tests for channel options and heartbeat"""
+import datetime
+
+import grpc
+import pytest
+
+from autorepeater.accounting import CountingClient
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.channel import Heartbeat
+from autorepeater.channel import channel_options
+from autorepeater.channel import parse_hours
+from autorepeater.channel import warm_up
+from autorepeater.instruments import InstrumentCache
+
+
+def test_channel_options():
+    """test_channel_options"""
+    options = dict(channel_options(keepalive_time=30, keepalive_timeout=5,
+                                   max_message_size=8, compression='gzip'))
+    assert options['grpc.keepalive_time_ms'] == 30000
+    assert options['grpc.keepalive_timeout_ms'] == 5000
+    assert options['grpc.max_receive_message_length'] == 8 * 1024 * 1024
+    assert options['grpc.default_compression_algorithm'] == int(
+        grpc.Compression.Gzip)
+    assert not channel_options(keepalive_time=0)
+    # Без явного интервала keepalive не включается
+    assert not channel_options()
+
+
+def test_parse_hours():
+    """test_parse_hours"""
+    assert parse_hours('7-24') == (7, 24)
+    with pytest.raises(ValueError):
+        parse_hours('10-7')
+
+
+def test_heartbeat():
+    """test_heartbeat"""
+    calls = []
+    heartbeat = Heartbeat(lambda: calls.append(1), interval=60, hours=(0, 24))
+    msk = datetime.timezone(datetime.timedelta(hours=3))
+    assert heartbeat.in_market_hours(datetime.datetime(2024, 1, 1, 3, tzinfo=msk))
+    heartbeat.hours = (7, 24)
+    assert not heartbeat.in_market_hours(
+        datetime.datetime(2024, 1, 1, 3, tzinfo=msk))
+    # 5 утра по UTC - 8 утра по Москве
+    assert heartbeat.in_market_hours(
+        datetime.datetime(2024, 1, 1, 5, tzinfo=datetime.timezone.utc))
+    heartbeat.hours = (0, 24)
+    assert heartbeat.beat()
+    assert calls == [1]
+    heartbeat.start().stop()
+    with pytest.raises(ValueError):
+        Heartbeat(lambda: None, interval=0)
+
+
+def test_warm_up(client):
+    """test_warm_up"""
+    auto_repeater = AutoRepeater(CountingClient(client), SyncFeatures(
+        instruments=InstrumentCache(ttl=60)))
+    warm_up(auto_repeater, '4', '5')
+    assert auto_repeater.client.totals.counts == {
+        'operations.get_portfolio': 2,
+        'instruments.find_instrument': 1,
+        'instruments.get_instrument_by': 1,
+    }
+    # Кэш прогрет, синхронизация не запрашивает инструменты
+    auto_repeater.sync_accounts('4', '5')
+    assert auto_repeater.client.totals.counts[
+        'instruments.get_instrument_by'] == 1
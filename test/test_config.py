@@ -0,0 +1,102 @@
+"""tests for config file of account pairs"""
+import os
+import threading
+import types
+
+import pytest
+
+from autorepeater.config import ConfigWatcher
+from autorepeater.config import PairConfig
+from autorepeater.config import apply_pairs
+from autorepeater.config import load_config
+from autorepeater.config import parse_config
+
+CONFIG = '''
+threshold = 0.004
+
+[[pairs]]
+src = "src"
+dst = "dst1"
+
+[[pairs]]
+src = "src"
+dst = "dst2"
+threshold = 0.01
+drift_band = 0.002
+'''
+
+
+def configured_pair():
+    """autorepeater stub remembering applied pair configs"""
+    pairs = []
+    return types.SimpleNamespace(pairs=pairs, configure_pair=pairs.append)
+
+
+def test_load_config(tmp_path):
+    """test_load_config"""
+    path = tmp_path / 'config.toml'
+    path.write_text(CONFIG, encoding='utf-8')
+    pairs = load_config(str(path), defaults={'threshold': 0.1, 'reserve': 0.05,
+                                             'drift_band': None})
+    # Значения пары важнее верхнего уровня, а он важнее параметров запуска
+    assert pairs == [
+        PairConfig(src='src', dst='dst1', threshold=0.004, reserve=0.05),
+        PairConfig(src='src', dst='dst2', threshold=0.01, reserve=0.05,
+                   drift_band=0.002)]
+    with pytest.raises(ValueError):
+        parse_config({'treshold': 0.1})
+    with pytest.raises(ValueError):
+        parse_config({'pairs': [{'src': 'src', 'dst': 'dst', 'lots': 1}]})
+    with pytest.raises(ValueError):
+        parse_config({'pairs': [{'src': 'src'}]})
+    with pytest.raises(ValueError):
+        parse_config({'reserve': 2, 'pairs': [{'src': 'src', 'dst': 'dst'}]})
+    with pytest.raises(ValueError):
+        parse_config({'pairs': [{'src': 'src', 'dst': 'dst'},
+                                {'src': 'other', 'dst': 'dst'}]})
+
+
+def test_apply_pairs():
+    """test_apply_pairs"""
+    autorepeaters = {'dst1': configured_pair(), 'dst3': configured_pair()}
+    pairs = [PairConfig(src='src', dst='dst1', threshold=0.01),
+             PairConfig(src='src', dst='dst2')]
+    apply_pairs(autorepeaters, pairs)
+    assert autorepeaters['dst1'].pairs == [pairs[0]]
+    # Пары нет в конфигурации - её параметры не меняются
+    assert not autorepeaters['dst3'].pairs
+
+
+def test_config_watcher(tmp_path):
+    """test_config_watcher"""
+    path = tmp_path / 'config.toml'
+    path.write_text(CONFIG, encoding='utf-8')
+    applied = []
+    watcher = ConfigWatcher(str(path), applied.append, interval=100)
+    with pytest.raises(ValueError):
+        ConfigWatcher(str(path), applied.append, interval=0)
+    assert not watcher.check()
+    # Изменение файла применяется
+    path.write_text(CONFIG.replace('0.004', '0.005'), encoding='utf-8')
+    os.utime(path, ns=(0, 1))
+    assert watcher.check()
+    assert applied[-1][0].threshold == 0.005
+    # Файл с ошибкой не применяется
+    path.write_text(CONFIG + '[[pairs]\n', encoding='utf-8')
+    assert not watcher.check()
+    assert len(applied) == 1
+    # SIGHUP перечитывает файл без изменения
+    path.write_text(CONFIG, encoding='utf-8')
+    watcher.check()
+    watcher.request()
+    assert watcher.check()
+    assert len(applied) == 3
+
+    reloaded = threading.Event()
+    watcher = ConfigWatcher(str(path), lambda pairs: reloaded.set(),
+                            interval=100)
+    # Поток запускается без обработчика SIGHUP
+    threading.Thread.start(watcher)
+    watcher.request()
+    assert reloaded.wait(5)
+    watcher.stop()
@@ -0,0 +1,51 @@
+"""tests for convergence rounds after posting orders"""
+from decimal import Decimal
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.convergence import Convergence
+from autorepeater.execution import OrderExecution
+from autorepeater.metrics import SyncMetrics
+from autorepeater.simulation import SimulatedClient
+
+
+def converging(client, rounds):
+    """autorepeater with convergence rounds and its convergence"""
+    metrics = SyncMetrics()
+    convergence = Convergence(metrics, rounds=rounds)
+    autorepeater = AutoRepeater(client, SyncFeatures(
+        orders=OrderExecution(convergence=convergence)), metrics)
+    return (autorepeater, convergence)
+
+
+def test_convergence_params():
+    """test_convergence_params"""
+    with pytest.raises(ValueError):
+        Convergence(SyncMetrics(), rounds=-1)
+    with pytest.raises(ValueError):
+        Convergence(SyncMetrics(), wait=-1)
+
+
+def test_sync_accounts_convergence(client):
+    """test_sync_accounts_convergence"""
+    (auto_repeater, convergence) = converging(client, 2)
+    auto_repeater.sync_accounts('4', '5')
+    metrics = auto_repeater.metrics
+    # Портфель назначения в моке не меняется, поэтому каждый раунд снова
+    # выставляет заявку, пока раунды не кончатся
+    assert convergence.completed.value() == 2
+    assert convergence.tracking_error.count() == 2
+    assert metrics.orders.value(status='posted') == 3
+    assert metrics.stage_seconds.count(stage='convergence_round') == 2
+
+
+def test_sync_accounts_converged(market):
+    """test_sync_accounts_converged"""
+    (autorepeater, convergence) = converging(SimulatedClient(market), 3)
+    autorepeater.sync_accounts('src', 'dst')
+    # После первой синхронизации счёт в пределах порога, хватает одного раунда
+    assert market.accounts['dst'].holdings == {'1': Decimal('99')}
+    assert convergence.completed.value() == 1
+    assert autorepeater.metrics.orders.value(status='posted') == 1
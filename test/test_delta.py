@@ -0,0 +1,62 @@
+"""tests for delta plans of src events"""
+from decimal import Decimal
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.delta import DeltaPlans
+from autorepeater.simulation import SimAccount
+from autorepeater.simulation import SimInstrument
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import SimulatedMarket
+
+
+def test_delta_changes():
+    """test_delta_changes"""
+    with pytest.raises(ValueError):
+        DeltaPlans(-1)
+    delta = DeltaPlans(0.05)
+    assert delta.take() is None
+    delta.note({'1'})
+    delta.note({'2'})
+    assert delta.take() == {'1', '2'}
+    # Событие без бумаг требует полного плана до следующей синхронизации
+    delta.note({'1'})
+    delta.note(None)
+    delta.note({'2'})
+    assert delta.take() is None
+    assert delta.take() is None
+
+
+def test_sync_accounts_delta():
+    """test_sync_accounts_delta"""
+    market = SimulatedMarket(
+        [SimInstrument(uid=uid, name=f'share{uid}', ticker=f'SH{uid}',
+                       price=Decimal('10'), lot=1) for uid in '123'],
+        [SimAccount(account_id='src', name='src',
+                    holdings={'1': Decimal('10'), '2': Decimal('10')}),
+         SimAccount(account_id='dst', name='dst', cash=Decimal('2000'))])
+    autorepeater = AutoRepeater(SimulatedClient(market),
+                                SyncFeatures(delta=DeltaPlans(0.05)))
+    # Без полного плана частичный не строится
+    autorepeater.sync_accounts('src', 'dst', changed={'1'})
+    assert market.accounts['dst'].holdings == {'1': Decimal('99'),
+                                               '2': Decimal('99')}
+    # Источник заменил бумагу 2 на 3, коэффициент не изменился
+    market.accounts['src'].holdings = {'1': Decimal('10'), '3': Decimal('10')}
+    autorepeater.features.instruments.by_uid.clear()
+    autorepeater.sync_accounts('src', 'dst', changed={'2', '3'})
+    assert market.accounts['dst'].holdings == {'1': Decimal('99'),
+                                               '3': Decimal('99')}
+    # Бумага 1 не пересчитывалась и не запрашивалась
+    assert '1' not in autorepeater.features.instruments.by_uid
+    assert autorepeater.current.plan.delta
+    assert autorepeater.current.plan.target_positions['1'] == Decimal('99')
+    assert autorepeater.metrics.plans.value(kind='delta') == 1
+    # Пополнение счёта назначения меняет коэффициент - полный план
+    market.accounts['dst'].cash += Decimal('1000')
+    autorepeater.sync_accounts('src', 'dst', changed={'3'})
+    assert not autorepeater.current.plan.delta
+    assert market.accounts['dst'].holdings['1'] > Decimal('99')
+    assert autorepeater.metrics.plans.value(kind='full') == 2
@@ -0,0 +1,168 @@
+"""tests for limit order execution"""
+from decimal import Decimal
+
+from test.conftest import buy_order
+
+import pytest
+
+from tinkoff.invest import GetOrderBookResponse
+from tinkoff.invest import MoneyValue
+from tinkoff.invest import Order
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderExecutionReportStatus
+from tinkoff.invest import PortfolioPosition
+from tinkoff.invest import WithdrawLimitsResponse
+
+from autorepeater.accounting import CountingClient
+from autorepeater.autorepeater import IMPORTANT
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.cancellation import SyncBudget
+from autorepeater.execution import LimitOrderExecutor
+from autorepeater.execution import OrderExecution
+from autorepeater.execution import fit_buy_orders
+from autorepeater.execution import limit_price
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import generate_market
+from autorepeater.simulation import to_quotation
+
+
+def test_limit_price():
+    """test_limit_price"""
+    order_book = GetOrderBookResponse(
+        bids=[Order(price=to_quotation(Decimal('9.9')), quantity=5),
+              Order(price=to_quotation(Decimal('9.8')), quantity=5)],
+        asks=[Order(price=to_quotation(Decimal('10.1')), quantity=3),
+              Order(price=to_quotation(Decimal('10.2')), quantity=3)])
+    buy = OrderDirection.ORDER_DIRECTION_BUY
+    sell = OrderDirection.ORDER_DIRECTION_SELL
+    assert limit_price(order_book, buy, 3) == Decimal('10.1')
+    assert limit_price(order_book, buy, 4) == Decimal('10.2')
+    assert limit_price(order_book, buy, 7) is None
+    assert limit_price(order_book, sell, 5) == Decimal('9.9')
+    assert limit_price(order_book, sell, 10) == Decimal('9.8')
+
+
+def test_executor_params():
+    """test_executor_params"""
+    with pytest.raises(ValueError):
+        LimitOrderExecutor(timeout=-1)
+    with pytest.raises(ValueError):
+        LimitOrderExecutor(attempts=0)
+
+
+def test_execute_filled(market):
+    """test_execute_filled"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    LimitOrderExecutor(timeout=0).execute(autorepeater, 'dst', [buy_order('1', 15)])
+    # Заявка на 15 лотов покрывается вторым уровнем стакана
+    (state,) = market.order_states.values()
+    assert (state.execution_report_status ==
+            OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL)
+    assert market.accounts['dst'].holdings == {'1': Decimal('15')}
+
+
+def test_execute_replace(market):
+    """test_execute_replace"""
+    client = SimulatedClient(market)
+
+    def stale_order_book(instrument_id, depth):
+        order_book = market.order_book(instrument_id, depth)
+        # Цена уходит вверх сразу после получения стакана
+        market.instruments[instrument_id].price += Decimal('10')
+        return order_book
+    client.market_data.get_order_book = stale_order_book
+    autorepeater = AutoRepeater(client)
+    LimitOrderExecutor(timeout=0, attempts=2).execute(
+        autorepeater, 'dst', [buy_order('1', 5)])
+    statuses = [state.execution_report_status
+                for state in market.order_states.values()]
+    assert statuses == [
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL]
+    assert market.accounts['dst'].holdings == {'1': Decimal('5')}
+    assert autorepeater.metrics.orders.value(status='posted') == 3
+
+
+def test_sync_accounts_limit_orders():
+    """test_sync_accounts_limit_orders"""
+    market = generate_market(20, seed=1)
+    autorepeater = AutoRepeater(SimulatedClient(market), SyncFeatures(
+        orders=OrderExecution(executor=LimitOrderExecutor(timeout=0))))
+    autorepeater.sync_accounts('src', 'dst')
+    assert market.orders
+    assert all(state.execution_report_status ==
+               OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+               for state in market.order_states.values())
+    assert autorepeater.metrics.stage_seconds.count(stage='order_book') == 1
+
+
+def test_execute_expired(market):
+    """test_execute_expired"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    autorepeater.set_sync_deadline(1e-9)
+    autorepeater.current.budget = SyncBudget(
+        autorepeater.current.deadline)
+    assert LimitOrderExecutor(timeout=60).execute(
+        autorepeater, 'dst', [buy_order('1', 5)]) is False
+    assert not market.orders
+
+
+def test_fit_buy_orders():
+    """test_fit_buy_orders"""
+    lot_costs = {
+        'a': ('rub', Decimal('10')),
+        'b': ('rub', Decimal('100')),
+        'c': ('usd', Decimal('1')),
+    }
+    orders = [buy_order('a', 5), buy_order('b', 3), buy_order('c', 2)]
+    # Самая крупная покупка первой, она забирает большую часть средств
+    assert fit_buy_orders(orders, lot_costs,
+                          {'rub': Decimal('260'), 'usd': Decimal('5')}) == [
+        buy_order('b', 2), buy_order('a', 5), buy_order('c', 2)]
+    # Без средств в валюте покупка выкидывается
+    assert fit_buy_orders(orders, lot_costs, {'rub': Decimal('1000')}) == [
+        buy_order('b', 3), buy_order('a', 5)]
+    assert not fit_buy_orders([], lot_costs, {})
+
+
+def test_sync_accounts_check_buying_power(client):
+    """test_sync_accounts_check_buying_power"""
+    with pytest.raises(TypeError):
+        OrderExecution(check_buying_power=1)
+    auto_repeater = AutoRepeater(CountingClient(client), SyncFeatures(
+        orders=OrderExecution(check_buying_power=True)))
+    auto_repeater.sync_accounts('4', '5')
+    assert auto_repeater.client.totals.counts[
+        'operations.get_withdraw_limits'] == 1
+    assert auto_repeater.metrics.orders.value(status='posted') == 1
+
+
+def test_fit_to_buying_power(auto_repeater, caplog):
+    """test_fit_to_buying_power"""
+    plan = auto_repeater.plan_sync('4', '5')
+    assert plan.orders_params_buy == [buy_order('1', 2)]
+    with caplog.at_level(IMPORTANT):
+        client = auto_repeater.client
+        client.operations.get_withdraw_limits = (
+            lambda account_id: WithdrawLimitsResponse(
+                money=[MoneyValue(currency='rub', units=2, nano=0)],
+                blocked=[], blocked_guarantee=[]))
+        assert OrderExecution(level=IMPORTANT).fit_to_buying_power(
+            auto_repeater, '5', plan) == [buy_order('1', 1)]
+    assert 'Не хватает средств: 1 1 из 2 лотов' in caplog.text
+
+
+def test_by_contribution(auto_repeater):
+    """test_by_contribution"""
+    positions = {
+        '1': PortfolioPosition(current_price=MoneyValue(
+            currency='RUB', units=10, nano=0)),
+        '2': PortfolioPosition(current_price=MoneyValue(
+            currency='RUB', units=1, nano=0)),
+    }
+    orders = [buy_order('2', 50), buy_order('1', 2), buy_order('1', 10)]
+    assert OrderExecution().by_contribution(
+        auto_repeater, orders, positions) == [
+            buy_order('1', 10), buy_order('2', 50), buy_order('1', 2)]
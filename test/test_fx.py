@@ -0,0 +1,88 @@
+# pylint: disable=R0903
+"""tests for multi-currency valuation"""
+from decimal import Decimal
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.fx import FxRates
+from autorepeater.fx import FxRateUnavailable
+from autorepeater.simulation import SimulatedClient
+
+
+class CountingMarketData:
+    """market data service counting calls of get_last_prices"""
+
+    def __init__(self, market_data):
+        self.market_data = market_data
+        self.calls = []
+
+    def get_last_prices(self, instrument_id):
+        """last prices of instruments"""
+        self.calls.append(instrument_id)
+        return self.market_data.get_last_prices(instrument_id=instrument_id)
+
+
+def test_fx_rates(market):
+    """test_fx_rates"""
+    client = SimulatedClient(market)
+    client.market_data = CountingMarketData(client.market_data)
+    fx = FxRates(client, ttl=60)
+    assert fx.get(['RUB', 'usd']) == {'rub': Decimal('1'),
+                                      'usd': Decimal('90')}
+    # Курс берётся из кэша до истечения ttl
+    market.instruments['usd-uid'].price = Decimal('95')
+    assert fx.get(['usd'])['usd'] == Decimal('90')
+    assert client.market_data.calls == [['usd-uid']]
+    assert fx.is_foreign('usd-uid')
+    assert not fx.is_foreign('rub-uid')
+    with pytest.raises(FxRateUnavailable):
+        fx.get(['eur'])
+    with pytest.raises(ValueError):
+        FxRates(client, ttl=-1)
+    with pytest.raises(TypeError):
+        FxRates(client, rebalance=1)
+
+
+def test_fx_rates_expired(market):
+    """test_fx_rates_expired"""
+    fx = FxRates(SimulatedClient(market), ttl=0)
+    assert fx.get(['usd'])['usd'] == Decimal('90')
+    market.instruments['usd-uid'].price = Decimal('95')
+    assert fx.get(['usd'])['usd'] == Decimal('95')
+
+
+def fund_usd(market):
+    """fund source with usd share and dollars, destination with rubles"""
+    market.accounts['src'].cash = Decimal('100')
+    market.accounts['src'].holdings = {'3': Decimal('10'),
+                                       'usd-uid': Decimal('10')}
+    market.accounts['dst'].cash = Decimal('99000')
+
+
+def test_sync_accounts_multi_currency(market):
+    """test_sync_accounts_multi_currency"""
+    fund_usd(market)
+    client = SimulatedClient(market)
+    autorepeater = AutoRepeater(client, SyncFeatures(fx=FxRates(client)))
+    autorepeater.set_reserve(0)
+    autorepeater.sync_accounts('src', 'dst')
+    # Источник без валют стоит 10 * 10 * 90 = 9000 руб.,
+    # доллары и рубли не повторяются
+    assert market.accounts['dst'].holdings == {'3': Decimal('110')}
+    assert market.accounts['dst'].cash == Decimal('0')
+
+
+def test_sync_accounts_rebalance_currencies(market):
+    """test_sync_accounts_rebalance_currencies"""
+    fund_usd(market)
+    client = SimulatedClient(market)
+    autorepeater = AutoRepeater(client, SyncFeatures(
+        fx=FxRates(client, rebalance=True)))
+    autorepeater.set_reserve(0)
+    autorepeater.sync_accounts('src', 'dst')
+    # Источник стоит 9000 + 900 руб., доллары покупаются как бумаги
+    assert market.accounts['dst'].holdings == {'3': Decimal('100'),
+                                               'usd-uid': Decimal('100')}
+    assert market.accounts['dst'].cash == Decimal('0')
@@ -0,0 +1,50 @@
+"""tests for caches of instruments"""
+import os
+
+import pytest
+
+from tinkoff.invest import Instrument
+
+from autorepeater.catalog import CatalogRecord
+from autorepeater.catalog import InstrumentCatalog
+from autorepeater.catalog import write_catalog
+from autorepeater.instruments import InstrumentCache
+
+
+def test_instrument_cache():
+    """test_instrument_cache"""
+    with pytest.raises(ValueError):
+        InstrumentCache(ttl=-1)
+    cache = InstrumentCache(ttl=0)
+    instrument = Instrument(uid='1', ticker='SHR')
+    assert cache.fresh('1', 1) is None
+    assert cache.ticker('1') is None
+    cache.store('1', 1, instrument)
+    # Без ttl инструмент используется только своей синхронизацией
+    assert cache.fresh('1', 1) == instrument
+    assert cache.fresh('1', 2) is None
+    assert cache.ticker('1') == 'SHR'
+    assert cache.cached('1') == instrument
+    cache = InstrumentCache(ttl=60)
+    cache.store('1', 1, instrument)
+    assert cache.fresh('1', 2) == instrument
+
+
+def test_instrument_cache_catalog(tmp_path):
+    """test_instrument_cache_catalog"""
+    path = str(tmp_path / 'instruments.catalog')
+    write_catalog(path, [CatalogRecord(
+        uid='1', ticker='CAT', name='catalog1', instrument_type='share',
+        currency='rub', lot=1)])
+    cache = InstrumentCache(catalog=InstrumentCatalog(path))
+    assert cache.missing(['1', '2']) == {'1', '2'}
+    assert cache.find('1').name == 'catalog1'
+    assert cache.find('2') is None
+    assert cache.missing(['1', '2']) == {'2'}
+    # Испорченный справочник не бросает исключение
+    with open(path + '.tmp', 'wb') as catalog_file:
+        catalog_file.write(b'not a catalog')
+    os.replace(path + '.tmp', path)
+    cache.refresh_catalog()
+    assert cache.from_catalog('1').ticker == 'CAT'
+    assert InstrumentCache().find('1') is None
@@ -0,0 +1,98 @@
+"""tests for journal of syncs"""
+import time
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.journal import SyncJournal
+from autorepeater.journal import connect
+from autorepeater.journal import explain_orders
+from autorepeater.journal import latency_stats
+from autorepeater.journal import parse_time
+from autorepeater.simulation import SimulatedClient
+
+
+def add_sync(journal, sync_id, started_at, latency, status='posted'):
+    """add sync with one planned and one posted order of SBER"""
+    key = {'run_id': 'run', 'sync_id': sync_id}
+    journal.add('syncs', dict(key, started_at=started_at, dst_account='dst',
+                              status=status, latency=latency, ratio='2.0',
+                              changed='["sber-uid"]'))
+    journal.add('targets', dict(key, instrument_uid='sber-uid', held='1.0',
+                                target='3.0'))
+    journal.add('orders', dict(key, created_at=started_at,
+                               instrument_uid='sber-uid', ticker='SBER',
+                               direction='ORDER_DIRECTION_BUY', lots=2,
+                               state='planned'))
+    journal.add('orders', dict(key, created_at=started_at + 0.1,
+                               instrument_uid='sber-uid', ticker='SBER',
+                               direction='ORDER_DIRECTION_BUY', lots=2,
+                               state='posted', order_id=f'order{sync_id}'))
+
+
+def test_journal(tmp_path):
+    """test_journal"""
+    path = str(tmp_path / 'journal.db')
+    with pytest.raises(ValueError):
+        SyncJournal(path, batch_size=0)
+    journal = SyncJournal(path, batch_size=3)
+    for sync_id in range(1, 11):
+        add_sync(journal, sync_id, 1000.0 * sync_id, sync_id / 10,
+                 status='skipped' if sync_id == 10 else 'posted')
+    journal.close()
+
+    connection = connect(path)
+    # Заявки ближайшей по времени синхронизации идут первыми
+    rows = explain_orders(connection, 'SBER', 2990.0, window=600)
+    assert [(row['sync_id'], row['state']) for row in rows] == [
+        (3, 'planned'), (3, 'posted')]
+    assert rows[1]['order_id'] == 'order3'
+    assert (rows[1]['held'], rows[1]['target'], rows[1]['ratio']) == (
+        '1.0', '3.0', '2.0')
+    assert rows[0]['changed'] == '["sber-uid"]'
+    assert explain_orders(connection, 'sber-uid', 3000.0, window=600) == rows
+    assert explain_orders(connection, 'GAZP', 3000.0) == []
+
+    stats = latency_stats(connection)
+    assert stats['posted']['count'] == 9
+    assert stats['posted']['p50'] == pytest.approx(0.5)
+    assert stats['posted']['max'] == pytest.approx(0.9)
+    assert stats['skipped']['count'] == 1
+    stats = latency_stats(connection, since=2000.0, until=5000.0,
+                          account='dst')
+    assert stats['posted']['count'] == 3
+    assert not latency_stats(connection, account='other')
+    connection.close()
+
+
+def test_parse_time():
+    """test_parse_time"""
+    assert parse_time('1700000000.5') == 1700000000.5
+    assert parse_time('2024-05-06T10:15:00+03:00') == 1714979700.0
+
+
+def test_sync_accounts_journal(market, tmp_path):
+    """test_sync_accounts_journal"""
+    path = str(tmp_path / 'journal.db')
+    journal = SyncJournal(path)
+    autorepeater = AutoRepeater(SimulatedClient(market),
+                                SyncFeatures(journal=journal))
+    autorepeater.sync_accounts('src', 'dst', trigger_time=time.monotonic())
+    autorepeater.sync_accounts('src', 'dst')
+    journal.close()
+
+    connection = connect(path)
+    syncs = [dict(row) for row in connection.execute(
+        'SELECT * FROM syncs ORDER BY sync_id')]
+    assert [sync['status'] for sync in syncs] == ['posted', 'skipped']
+    assert syncs[0]['ratio'] == '9.9'
+    assert syncs[0]['trigger_delay'] >= 0
+    assert syncs[1]['trigger_delay'] is None
+    rows = explain_orders(connection, 'SHR', syncs[0]['started_at'])
+    # Запланированная и выставленная заявки первой синхронизации
+    assert [(row['sync_id'], row['state'], row['lots']) for row in rows] == [
+        (1, 'planned', 99), (1, 'posted', 99)]
+    assert rows[1]['target'] == '99.0'
+    assert len(rows[1]['client_order_id']) == 36
+    connection.close()
@@ -0,0 +1,66 @@
+"""tests for logging pipeline"""
+import io
+import json
+import logging
+
+import pytest
+
+from autorepeater.logs import DeferredQueueHandler
+from autorepeater.logs import LazyString
+from autorepeater.logs import setup_logging
+
+
+@pytest.fixture(name='root_handlers')
+def fixture_root_handlers():
+    """restore root logger after test"""
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    level = root.level
+    yield
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_lazy_string():
+    """test_lazy_string"""
+    calls = []
+
+    def render(value):
+        calls.append(value)
+        return f'value {value}'
+    lazy = LazyString(render, 1)
+    logging.getLogger('test_lazy_string').debug('%s', lazy)
+    # запись отброшена по уровню, строка не строилась
+    assert not calls
+    assert str(lazy) == 'value 1'
+    assert calls == [1]
+
+
+def test_setup_logging(root_handlers):  # pylint: disable=W0613
+    """test_setup_logging"""
+    stream = io.StringIO()
+    listener = setup_logging(logging.INFO, stream=stream)
+    root = logging.getLogger()
+    assert len(root.handlers) == 1
+    assert isinstance(root.handlers[0], DeferredQueueHandler)
+    logging.info('sync %d', 3)
+    listener.stop()
+    assert 'INFO:root:sync 3' in stream.getvalue()
+
+
+def test_setup_logging_json(root_handlers):  # pylint: disable=W0613
+    """test_setup_logging_json"""
+    stream = io.StringIO()
+    listener = setup_logging(logging.INFO, json_format=True, stream=stream)
+    logging.info('order %s', 'id', extra={'sync_id': 2, 'lots': 5,
+                                          'instrument_uid': 'uid'})
+    listener.stop()
+    record = json.loads(stream.getvalue())
+    assert record['message'] == 'order id'
+    assert record['sync_id'] == 2
+    assert record['lots'] == 5
+    assert record['instrument_uid'] == 'uid'
+    assert record['levelname'] == 'INFO'
@@ -0,0 +1,25 @@
+"""tests for command line checks"""
+import argparse
+
+import pytest
+
+from main import check_plan_args
+
+
+def test_check_plan_args():
+    """test_check_plan_args"""
+    parser = argparse.ArgumentParser()
+    args = argparse.Namespace(recording=None, src=None, dst=None,
+                              src_snapshot='src.json',
+                              dst_snapshot='dst.json', catalog=None)
+    # Без справочника портфели снимков не загрузить
+    with pytest.raises(SystemExit):
+        check_plan_args(parser, args)
+    args.catalog = 'catalog.json'
+    check_plan_args(parser, args)
+    args.recording = 'session.jsonl'
+    with pytest.raises(SystemExit):
+        check_plan_args(parser, args)
+    args.src = 'src'
+    args.dst = 'dst'
+    check_plan_args(parser, args)
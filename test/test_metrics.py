@@ -0,0 +1,119 @@
+"""tests for sync metrics"""
+import urllib.request
+
+from autorepeater.metrics import MergedRegistry
+from autorepeater.metrics import Registry
+from autorepeater.metrics import SyncMetrics
+from autorepeater.metrics import escape_label_value
+from autorepeater.metrics import registry_snapshot
+from autorepeater.metrics import start_http_exporter
+from autorepeater.metrics import write_textfile
+
+
+def test_escape_label_value():
+    """test_escape_label_value"""
+    assert escape_label_value('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_counter_render():
+    """test_counter_render"""
+    registry = Registry()
+    counter = registry.counter('orders', 'Orders')
+    counter.inc(status='posted')
+    counter.inc(2, status='posted')
+    counter.inc(status='failed')
+    assert counter.value(status='posted') == 3
+    assert registry.render() == (
+        '# HELP orders Orders\n'
+        '# TYPE orders counter\n'
+        'orders_total{status="failed"} 1.0\n'
+        'orders_total{status="posted"} 3.0\n')
+
+
+def test_histogram_render():
+    """test_histogram_render"""
+    registry = Registry()
+    histogram = registry.histogram('latency', 'Latency', buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+    assert histogram.count() == 3
+    assert registry.render() == (
+        '# HELP latency Latency\n'
+        '# TYPE latency histogram\n'
+        'latency_bucket{le="0.1"} 2.0\n'
+        'latency_bucket{le="1.0"} 2.0\n'
+        'latency_bucket{le="+Inf"} 3.0\n'
+        'latency_sum 5.15\n'
+        'latency_count 3.0\n')
+
+
+def test_sync_metrics():
+    """test_sync_metrics"""
+    metrics = SyncMetrics()
+    metrics.begin_sync()
+    with metrics.stage('planning'):
+        pass
+    metrics.order_posted()
+    metrics.order_posted()
+    metrics.order_failed()
+    metrics.end_sync(0)
+    assert metrics.syncs.value() == 1
+    assert metrics.stage_seconds.count(stage='planning') == 1
+    assert metrics.orders.value(status='posted') == 2
+    assert metrics.orders.value(status='failed') == 1
+    # Задержка до первой заявки считается один раз за синхронизацию
+    assert metrics.orders.first_order_seconds.count() == 1
+    assert metrics.sync_seconds.count() == 1
+    metrics.syncs.skipped.inc()
+    assert metrics.syncs.skipped.value() == 1
+    assert '# TYPE autorepeater_syncs_skipped counter' in metrics.render()
+    # Без профайлера синхронизации не профилируются
+    with metrics.profile(1) as profile:
+        assert profile is None
+
+
+def test_write_textfile(tmp_path):
+    """test_write_textfile"""
+    metrics = SyncMetrics()
+    metrics.begin_sync()
+    path = tmp_path / 'autorepeater.prom'
+    write_textfile(metrics, str(path))
+    assert 'autorepeater_syncs_total 1.0' in path.read_text(encoding='utf-8')
+
+
+def test_http_exporter():
+    """test_http_exporter"""
+    metrics = SyncMetrics()
+    metrics.begin_sync()
+    server = start_http_exporter(metrics, 0)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'autorepeater_syncs_total 1.0' in body
+
+
+def test_merged_registry():
+    """test_merged_registry"""
+    local = Registry()
+    local.counter('restarts', 'Restarts').inc()
+    merged = MergedRegistry([local])
+    for (source, posted) in ((0, 2), (1, 3)):
+        worker = SyncMetrics()
+        worker.orders.inc(posted, status='posted')
+        worker.sync_seconds.observe(0.02)
+        merged.update(source, [registry_snapshot(worker)])
+    # Повторный отчёт источника заменяет предыдущий
+    worker = SyncMetrics()
+    worker.orders.inc(4, status='posted')
+    merged.update(1, [registry_snapshot(worker)])
+    text = merged.render()
+    assert 'autorepeater_orders_total{status="posted"} 6.0' in text
+    assert 'autorepeater_sync_seconds_count 1.0' in text
+    assert 'autorepeater_sync_seconds_bucket{le="0.025"} 1.0' in text
+    assert 'restarts_total 1.0' in text
+    assert text.count('# TYPE autorepeater_orders counter') == 1
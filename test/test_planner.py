@@ -0,0 +1,87 @@
+"""tests for offline planner"""
+import json
+
+import pytest
+
+from tinkoff.invest import Instrument
+from tinkoff.invest import MoneyValue
+from tinkoff.invest import PortfolioPosition
+from tinkoff.invest import PortfolioResponse
+from tinkoff.invest import Quotation
+from tinkoff.invest import SecurityTradingStatus
+
+from autorepeater.planner import load_from_recording
+from autorepeater.planner import load_snapshots
+from autorepeater.planner import plan_offline
+from autorepeater.recording import StreamRecorder
+from autorepeater.recording import to_jsonable
+
+
+def make_position(uid, instrument_type, price, quantity):
+    """make_position - создаёт позицию портфеля"""
+    return PortfolioPosition(
+        instrument_type=instrument_type,
+        instrument_uid=uid,
+        current_price=MoneyValue(currency='rub', units=price, nano=0),
+        quantity=Quotation(units=quantity, nano=0))
+
+
+SRC_PORTFOLIO = PortfolioResponse(positions=[
+    make_position('rub', 'currency', 1, 100),
+    make_position('1', 'share', 10, 10),
+])
+DST_PORTFOLIO = PortfolioResponse(positions=[
+    make_position('rub', 'currency', 1, 1000),
+    make_position('1', 'share', 10, 50),
+    make_position('2', 'etf', 5, 20),
+])
+CATALOG = [
+    Instrument(uid='1', name='share1', ticker='SHR', lot=1,
+               trading_status=SecurityTradingStatus.SECURITY_TRADING_STATUS_NORMAL_TRADING),
+    Instrument(uid='2', name='etf2', ticker='ETF', lot=1,
+               trading_status=SecurityTradingStatus.SECURITY_TRADING_STATUS_NORMAL_TRADING),
+]
+
+
+def write_json(path, value):
+    """write_json - сохраняет значение в json файл"""
+    path.write_text(json.dumps(value), encoding='utf-8')
+    return str(path)
+
+
+def test_plan_offline(tmp_path):
+    """test_plan_offline"""
+    records = load_snapshots(
+        write_json(tmp_path / 'src.json', to_jsonable(SRC_PORTFOLIO)),
+        write_json(tmp_path / 'dst.json', to_jsonable(DST_PORTFOLIO)),
+        write_json(tmp_path / 'catalog.json', to_jsonable(CATALOG)))
+    result = plan_offline(records, [0.004, 0.9], [0.0, 0.1])
+    assert [(item['reserve'], item['threshold']) for item in result] == [
+        (0.0, 0.004), (0.0, 0.9), (0.1, 0.004), (0.1, 0.9)]
+    # Стоимость счёта назначения 1600, источника 100 - соотношение 16
+    assert result[0]['ratio'] == '16.0'
+    assert result[0]['sell'] == [{'instrument_id': '2',
+                                  'direction': 'ORDER_DIRECTION_SELL',
+                                  'quantity': 20, 'price': '5.0'}]
+    assert result[0]['buy'] == [{'instrument_id': '1',
+                                 'direction': 'ORDER_DIRECTION_BUY',
+                                 'quantity': 110, 'price': '10.0'}]
+    assert result[0]['post'] is True
+    assert result[1]['post'] is False
+    # Резерв 10% уменьшает целевую позицию
+    assert result[2]['ratio'] == '14.4'
+    assert result[2]['buy'][0]['quantity'] == 94
+
+
+def test_load_from_recording(tmp_path):
+    """test_load_from_recording"""
+    path = str(tmp_path / 'session.jsonl')
+    recorder = StreamRecorder(path)
+    recorder.record('portfolio', DST_PORTFOLIO, 'a')
+    recorder.record('portfolio', SRC_PORTFOLIO, 'a')
+    recorder.record('portfolio', DST_PORTFOLIO, 'b')
+    recorder.close()
+    records = load_from_recording(path, 'a', 'b')
+    assert sorted(record['key'] for record in records) == ['dst', 'src']
+    with pytest.raises(ValueError):
+        load_from_recording(path, 'a', 'c')
@@ -0,0 +1,45 @@
+"""tests for sync profiling"""
+import pstats
+
+import pytest
+
+from autorepeater.profiling import SyncProfiler
+
+
+def test_should_profile():
+    """test_should_profile"""
+    profiler = SyncProfiler('profiles', every=3)
+    assert [sync_id for sync_id in range(1, 10)
+            if profiler.should_profile(sync_id)] == [3, 6, 9]
+    with pytest.raises(ValueError):
+        SyncProfiler('profiles', every=0)
+
+
+def test_profile(tmp_path, caplog):
+    """test_profile"""
+    directory = tmp_path / 'profiles'
+    profiler = SyncProfiler(str(directory), top=5, level=30)
+    with caplog.at_level(30):
+        with profiler.profile(4):
+            sorted(range(1000), key=str)
+    files = list(directory.iterdir())
+    assert len(files) == 1
+    assert files[0].name.startswith('sync-')
+    assert files[0].name.endswith('-4.prof')
+    assert pstats.Stats(str(files[0])).total_calls > 0
+    assert 'профиль синхронизации 4' in caplog.text
+    assert 'tottime' in caplog.text
+
+
+def test_profile_one_at_a_time(tmp_path):
+    """test_profile_one_at_a_time"""
+    directory = tmp_path / 'profiles'
+    profiler = SyncProfiler(str(directory))
+    with profiler.profile(1, 'dst1') as outer:
+        # Вторая синхронизация того же процесса не профилируется
+        with profiler.profile(2, 'dst2') as inner:
+            assert inner is None
+        assert outer is not None
+    (path,) = directory.iterdir()
+    assert path.name.startswith('sync-dst1-')
+    assert path.name.endswith('-1.prof')
@@ -0,0 +1,105 @@
+"""tests for periodic reconciliation"""
+import threading
+from decimal import Decimal
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.cancellation import SyncBudget
+from autorepeater.cancellation import SyncCancelled
+from autorepeater.config import PairConfig
+from autorepeater.metrics import SyncMetrics
+from autorepeater.reconcile import DriftCheck
+from autorepeater.reconcile import Reconciler
+from autorepeater.simulation import SimAccount
+from autorepeater.simulation import SimInstrument
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import SimulatedMarket
+
+
+def make_market():
+    """market of two shares, src holds only the first one"""
+    return SimulatedMarket(
+        [SimInstrument(uid='1', name='share1', ticker='SHR',
+                       price=Decimal('10'), lot=1),
+         SimInstrument(uid='2', name='share2', ticker='SHS',
+                       price=Decimal('10'), lot=1)],
+        [SimAccount(account_id='src', name='src',
+                    holdings={'1': Decimal('10')}),
+         SimAccount(account_id='dst', name='dst', cash=Decimal('1000'))])
+
+
+def test_reconciler():
+    """test_reconciler"""
+    reconciler = Reconciler(lambda: None, interval=100, jitter=0.2)
+    delays = [reconciler.delay() for _ in range(100)]
+    assert all(80 <= delay <= 120 for delay in delays)
+    assert len(set(delays)) > 1
+    assert Reconciler(lambda: None, interval=100, jitter=0).delay() == 100
+    with pytest.raises(ValueError):
+        Reconciler(lambda: None, jitter=1)
+
+    called = threading.Event()
+    reconciler = Reconciler(called.set, interval=0.01, hours=(0, 24))
+    reconciler.start()
+    assert called.wait(5)
+    reconciler.stop()
+
+
+def test_reconcile():
+    """test_reconcile"""
+    market = make_market()
+    metrics = SyncMetrics()
+    with pytest.raises(ValueError):
+        DriftCheck(metrics, interval=0)
+    drift = DriftCheck(metrics, interval=60, jitter=0.1)
+    autorepeater = AutoRepeater(SimulatedClient(market),
+                                SyncFeatures(reconcile=drift), metrics)
+    assert drift.check(autorepeater, 'src', 'dst')
+    autorepeater.sync_accounts('src', 'dst')
+    orders = len(market.orders)
+    # После синхронизации отклонение в пределах порога, заявок нет
+    assert not drift.check(autorepeater, 'src', 'dst')
+    assert len(market.orders) == orders
+    # Пропущенное событие: источник заменил половину позиции другой бумагой
+    market.accounts['src'].holdings = {'1': Decimal('5'), '2': Decimal('5')}
+    assert drift.check(autorepeater, 'src', 'dst')
+    # Сверка не выполняется, пока идёт синхронизация
+    with autorepeater.current.lock:
+        assert not drift.check(autorepeater, 'src', 'dst')
+    # Сверка не заменяет бюджет синхронизации и ограничена своим
+    budget = autorepeater.current.budget
+    assert drift.check(autorepeater, 'src', 'dst')
+    assert autorepeater.current.budget is budget
+    with pytest.raises(SyncCancelled):
+        drift.measure(autorepeater, 'src', 'dst', SyncBudget(0))
+    assert drift.checks.value(result='escalated') == 3
+    assert drift.checks.value(result='in_band') == 1
+    assert drift.checks.value(result='busy') == 1
+
+
+def test_configure_pair():
+    """test_configure_pair"""
+    market = make_market()
+    metrics = SyncMetrics()
+    drift = DriftCheck(metrics)
+    autorepeater = AutoRepeater(SimulatedClient(market),
+                                SyncFeatures(reconcile=drift), metrics)
+    autorepeater.sync_accounts('src', 'dst')
+    cached = dict(autorepeater.features.instruments.by_uid)
+    market.accounts['src'].holdings = {'1': Decimal('5'), '2': Decimal('5')}
+    autorepeater.configure_pair(PairConfig(src='src', dst='dst',
+                                           threshold=0.01, reserve=0.02,
+                                           drift_band=0.9))
+    assert autorepeater.threshold == Decimal('0.01')
+    assert autorepeater.reserve == Decimal('0.02')
+    # Отклонение в пределах полосы сверки, кэш инструментов сохранён
+    assert not drift.check(autorepeater, 'src', 'dst')
+    assert autorepeater.features.instruments.by_uid == cached
+    # Без значений в конфигурации восстанавливаются значения по умолчанию
+    autorepeater.configure_pair(PairConfig(src='src', dst='dst'))
+    assert drift.band is None
+    assert drift.check(autorepeater, 'src', 'dst')
+    with pytest.raises(ValueError):
+        drift.set_band(2)
@@ -0,0 +1,94 @@
+"""tests for recording of stream sessions"""
+from datetime import datetime
+from datetime import timezone
+
+from tinkoff.invest import MoneyValue
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import PortfolioPosition
+from tinkoff.invest import PortfolioResponse
+from tinkoff.invest import PositionData
+from tinkoff.invest import PositionsMoney
+from tinkoff.invest import PositionsSecurities
+from tinkoff.invest import PositionsStreamResponse
+from tinkoff.invest import Quotation
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.recording import RecordingClient
+from autorepeater.recording import StreamRecorder
+from autorepeater.recording import from_jsonable
+from autorepeater.recording import read_recording
+from autorepeater.recording import to_jsonable
+from autorepeater.simulation import SimulatedClient
+
+
+def make_stream_response():
+    """make_stream_response - создаёт событие потока позиций"""
+    return PositionsStreamResponse(position=PositionData(
+        account_id='1',
+        money=[PositionsMoney(
+            available_value=MoneyValue(currency='rub', units=10, nano=5),
+            blocked_value=MoneyValue(currency='rub', units=0, nano=0))],
+        securities=[PositionsSecurities(instrument_uid='uid', blocked=0,
+                                        balance=3)],
+        date=datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)))
+
+
+def test_jsonable_roundtrip():
+    """test_jsonable_roundtrip"""
+    response = from_jsonable(PositionsStreamResponse,
+                             to_jsonable(make_stream_response()))
+    position = response.position
+    assert position.account_id == '1'
+    assert position.money[0].available_value.units == 10
+    assert position.money[0].available_value.nano == 5
+    assert position.securities[0].instrument_uid == 'uid'
+    assert position.securities[0].balance == 3
+    assert position.date == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+
+def test_jsonable_enum():
+    """test_jsonable_enum"""
+    assert to_jsonable(OrderDirection.ORDER_DIRECTION_BUY) == 1
+    assert (from_jsonable(OrderDirection, 1) ==
+            OrderDirection.ORDER_DIRECTION_BUY)
+
+
+def test_recorder(tmp_path):
+    """test_recorder"""
+    path = str(tmp_path / 'session.jsonl')
+    recorder = StreamRecorder(path)
+    recorder.record('stream', make_stream_response())
+    recorder.record('portfolio', PortfolioResponse(positions=[
+        PortfolioPosition(
+            instrument_type='share',
+            instrument_uid='uid',
+            current_price=MoneyValue(currency='rub', units=1, nano=0),
+            quantity=Quotation(units=3, nano=0))]), '1')
+    recorder.close()
+    # Запись только дописывается
+    recorder = StreamRecorder(path)
+    recorder.record('stream', make_stream_response())
+    recorder.close()
+
+    records = read_recording(path)
+    assert [record['kind'] for record in records] == [
+        'stream', 'portfolio', 'stream']
+    assert records[1]['key'] == '1'
+    assert records[1]['response'].positions[0].quantity.units == 3
+    assert records[0]['t'] <= records[2]['t']
+
+
+def test_recording_client(market, tmp_path):
+    """test_recording_client"""
+    path = str(tmp_path / 'session.jsonl')
+    recorder = StreamRecorder(path)
+    autorepeater = AutoRepeater(RecordingClient(SimulatedClient(market),
+                                                recorder))
+    autorepeater.sync_accounts('src', 'dst')
+    recorder.close()
+    keys = {(record['kind'], record['key']) for record in read_recording(path)}
+    # Заявки не записываются, только состояние для воспроизведения
+    assert {('portfolio', 'src'), ('portfolio', 'dst'),
+            ('instrument', '1')} <= keys
+    assert {kind for (kind, _) in keys} <= {'portfolio', 'instrument',
+                                              'find_instrument'}
@@ -0,0 +1,42 @@
+"""tests for replay of recorded stream sessions"""
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.recording import RecordingClient
+from autorepeater.recording import StreamRecorder
+from autorepeater.recording import read_recording
+from autorepeater.replay import replay
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import SimulationFinished
+from autorepeater.simulation import generate_market
+from autorepeater.simulation import trigger_event
+
+
+def record_session(path, triggers):
+    """record_session - записывает сессию mainflow над имитацией рынка"""
+    market = generate_market(20, seed=3)
+    market.stream_script = [(0, trigger_event('src'))
+                            for _ in range(triggers)]
+    recorder = StreamRecorder(path)
+    auto_repeater = AutoRepeater(RecordingClient(SimulatedClient(market),
+                                                 recorder))
+    try:
+        auto_repeater.mainflow('src', 'dst')
+    except SimulationFinished:
+        pass
+    recorder.close()
+    return market
+
+
+def test_replay(tmp_path):
+    """test_replay"""
+    path = str(tmp_path / 'session.jsonl')
+    market = record_session(path, 3)
+    records = read_recording(path)
+    assert sum(1 for record in records if record['kind'] == 'stream') == 3
+    assert sum(1 for record in records if record['kind'] == 'portfolio') == 8
+
+    report = replay(records, 'src', 'dst')
+    assert report['events'] == 3
+    assert report['triggers'] == 3
+    # Начальная синхронизация и по одной на каждое событие
+    assert report['syncs'] == 4
+    assert report['orders'] == len(market.orders)
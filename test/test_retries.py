@@ -0,0 +1,126 @@
+"""tests for deadlines and idempotent retries"""
+import uuid
+
+import grpc
+import pytest
+
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderType
+from tinkoff.invest import PostOrderResponse
+from tinkoff.invest import RequestError
+
+from autorepeater.autorepeater import OrderParams
+from autorepeater.retries import ClientCallDetails
+from autorepeater.retries import DeadlineInterceptor
+from autorepeater.retries import RetryPolicy
+from autorepeater.retries import backoff_delay
+from autorepeater.retries import client_order_id
+
+
+def test_client_order_id():
+    """test_client_order_id"""
+    run_id = uuid.uuid4()
+    buy = OrderDirection.ORDER_DIRECTION_BUY
+    sell = OrderDirection.ORDER_DIRECTION_SELL
+    order_id = client_order_id(run_id, 1, 'uid', buy)
+    assert len(order_id) == 36
+    assert order_id == client_order_id(run_id, 1, 'uid', buy)
+    assert len({order_id,
+                client_order_id(run_id, 2, 'uid', buy),
+                client_order_id(run_id, 1, 'uid2', buy),
+                client_order_id(run_id, 1, 'uid', sell),
+                client_order_id(run_id, 1, 'uid', buy, 1),
+                client_order_id(uuid.uuid4(), 1, 'uid', buy)}) == 6
+
+
+def test_backoff_delay():
+    """test_backoff_delay"""
+    assert [backoff_delay(attempt, 0.5) for attempt in range(4)] == [
+        0.5, 1.0, 2.0, 4.0]
+
+
+def test_retry_policy():
+    """test_retry_policy"""
+    with pytest.raises(ValueError):
+        RetryPolicy(retries=-1)
+    with pytest.raises(ValueError):
+        RetryPolicy(backoff=-1)
+    policy = RetryPolicy(retries=1, backoff=0.5)
+    timeout = RequestError(code=grpc.StatusCode.DEADLINE_EXCEEDED,
+                           details='deadline', metadata=None)
+    invalid = RequestError(code=grpc.StatusCode.INVALID_ARGUMENT,
+                           details='invalid', metadata=None)
+    assert policy.should_retry(0, timeout)
+    assert not policy.should_retry(1, timeout)
+    assert not policy.should_retry(0, invalid)
+    assert policy.delay(1) == 1.0
+
+
+def test_deadline_interceptor():
+    """test_deadline_interceptor"""
+    with pytest.raises(ValueError):
+        DeadlineInterceptor(call_deadline=0)
+    interceptor = DeadlineInterceptor(call_deadline=10, order_deadline=2)
+    calls = []
+
+    def continuation(client_call_details, request):
+        calls.append((client_call_details.method,
+                      client_call_details.timeout, request))
+        return 'response'
+
+    def details(method, timeout=None):
+        return ClientCallDetails(method=method, timeout=timeout,
+                                 metadata=None, credentials=None,
+                                 wait_for_ready=None, compression=None)
+    orders = ('/tinkoff.public.invest.api.contract.v1.OrdersService/'
+              'PostOrder')
+    portfolio = ('/tinkoff.public.invest.api.contract.v1.OperationsService/'
+                 'GetPortfolio')
+    assert interceptor.intercept_unary_unary(
+        continuation, details(orders), 'order') == 'response'
+    interceptor.intercept_unary_unary(continuation, details(portfolio), 'p')
+    # Явно заданный дедлайн не меняется
+    interceptor.intercept_unary_unary(continuation, details(portfolio, 1), 'p')
+    assert calls == [(orders, 2, 'order'), (portfolio, 10, 'p'),
+                     (portfolio, 1, 'p')]
+    assert isinstance(details(orders), grpc.ClientCallDetails)
+
+
+def test_post_order_retry(auto_repeater):
+    """test_post_order_retry"""
+    orders = auto_repeater.features.orders
+    orders.retries = RetryPolicy(backoff=0)
+    order_ids = []
+    errors = [RequestError(code=grpc.StatusCode.DEADLINE_EXCEEDED,
+                           details='deadline', metadata=None)]
+
+    def post_order(**kwargs):
+        order_ids.append(kwargs['order_id'])
+        if errors:
+            raise errors.pop()
+        return PostOrderResponse(order_id='exchange')
+    auto_repeater.client.orders.post_order = post_order
+    order_params = OrderParams(
+        instrument_id='1',
+        quantity=1,
+        direction=OrderDirection.ORDER_DIRECTION_BUY,
+        order_type=OrderType.ORDER_TYPE_BESTPRICE)
+    assert auto_repeater.post_order('5', order_params).order_id == 'exchange'
+    # Повтор с тем же идентификатором, следующая заявка получает новый
+    assert order_ids[0] == order_ids[1]
+    auto_repeater.post_order('5', order_params)
+    assert len(set(order_ids)) == 2
+    assert auto_repeater.metrics.orders.value(status='retried') == 1
+
+    errors.append(RequestError(code=grpc.StatusCode.INVALID_ARGUMENT,
+                               details='invalid', metadata=None))
+    with pytest.raises(RequestError):
+        auto_repeater.post_order('5', order_params)
+    assert auto_repeater.metrics.orders.value(status='failed') == 1
+
+    orders.retries = RetryPolicy(retries=0, backoff=0)
+    errors.append(RequestError(code=grpc.StatusCode.UNAVAILABLE,
+                               details='unavailable', metadata=None))
+    with pytest.raises(RequestError):
+        auto_repeater.post_order('5', order_params)
+    assert auto_repeater.metrics.orders.value(status='failed') == 2
@@ -0,0 +1,15 @@
+"""tests for runner of autorepeater"""
+import pytest
+
+from autorepeater.runner import load_pairs
+
+
+def test_load_pairs(tmp_path):
+    """test_load_pairs"""
+    path = tmp_path / 'pairs.json'
+    path.write_text('[["src1", "dst1"], ["src2", "dst2"]]', encoding='utf-8')
+    assert load_pairs(str(path)) == [('src1', 'dst1'), ('src2', 'dst2')]
+    for broken in ('{"src1": "dst1"}', '[["src1"]]', '[["src1", 2]]'):
+        path.write_text(broken, encoding='utf-8')
+        with pytest.raises(ValueError):
+            load_pairs(str(path))
@@ -0,0 +1,115 @@
+"""tests for simulated client and benchmark"""
+from decimal import Decimal
+
+import pytest
+
+from tinkoff.invest import InstrumentIdType
+from tinkoff.invest import OrderDirection
+from tinkoff.invest import OrderType
+
+from autorepeater.autorepeater import changed_instruments
+from autorepeater.autorepeater import check_triggers
+from autorepeater.autorepeater import get_quantity_position
+from autorepeater.benchmark import percentile
+from autorepeater.benchmark import run
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import SimulationFinished
+from autorepeater.simulation import deposit_event
+from autorepeater.simulation import generate_market
+from autorepeater.simulation import to_quotation
+from autorepeater.simulation import trigger_event
+
+
+def test_to_quotation():
+    """test_to_quotation"""
+    assert to_quotation(Decimal('1.5')) == to_quotation(Decimal('1.50'))
+    quotation = to_quotation(Decimal('-1.25'))
+    assert (quotation.units, quotation.nano) == (-1, -250000000)
+
+
+def test_simulated_client(market):
+    """test_simulated_client"""
+    market.accounts['dst'].holdings = {'2': Decimal('20')}
+    client = SimulatedClient(market)
+    positions = client.operations.get_portfolio(account_id='dst').positions
+    assert [position.instrument_type for position in positions] == [
+        'currency', 'share']
+    assert get_quantity_position(positions[1]) == Decimal('20')
+    instrument = client.instruments.get_instrument_by(
+        id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_UID, id='2').instrument
+    assert instrument.lot == 10
+    assert client.instruments.find_instrument(query='1').instruments[0].ticker == 'SHR'
+    assert client.instruments.find_instrument(query='4').instruments == []
+
+    client.orders.post_order(quantity=1, direction=OrderDirection.ORDER_DIRECTION_BUY,
+                             account_id='dst', order_type=OrderType.ORDER_TYPE_BESTPRICE,
+                             instrument_id='2')
+    assert market.accounts['dst'].holdings == {'2': Decimal('30')}
+    assert market.accounts['dst'].cash == Decimal('900')
+    money = client.operations.get_withdraw_limits(account_id='dst').money
+    assert (money[0].units, money[0].nano) == (900, 0)
+    client.orders.post_order(quantity=3, direction=OrderDirection.ORDER_DIRECTION_SELL,
+                             account_id='dst', order_type=OrderType.ORDER_TYPE_BESTPRICE,
+                             instrument_id='2')
+    assert market.accounts['dst'].holdings == {}
+    assert len(market.orders) == 2
+
+
+def test_snapshot_restore(market):
+    """test_snapshot_restore"""
+    snapshot = market.snapshot()
+    market.execute('src', '1', 1, OrderDirection.ORDER_DIRECTION_BUY)
+    market.restore(snapshot)
+    assert market.accounts['src'].holdings == {'1': Decimal('10')}
+
+
+def test_positions_stream(market):
+    """test_positions_stream"""
+    market.stream_script = [(0, trigger_event('src')), (0, deposit_event('dst'))]
+    client = SimulatedClient(market)
+    responses = []
+    with pytest.raises(SimulationFinished):
+        for response in client.operations_stream.positions_stream(
+                accounts=['src', 'dst']):
+            responses.append(response)
+    assert [check_triggers(response.position, 'src', 'dst')
+            for response in responses] == [True, True]
+
+
+def test_generate_market():
+    """test_generate_market"""
+    market = generate_market(20, seed=1)
+    assert len(market.accounts['src'].holdings) == 20
+    assert len(market.accounts['dst'].holdings) > 20
+    assert generate_market(20, seed=1).snapshot() == market.snapshot()
+
+
+def test_percentile():
+    """test_percentile"""
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([3.0], 0.99) == 3.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_benchmark_run():
+    """test_benchmark_run"""
+    report = run(sizes=[5], syncs=2, events=2, latency=0.0)
+    scenarios = {result['scenario']: result for result in report['results']}
+    assert set(scenarios) == {'sync_accounts', 'mainflow_burst',
+                              'print_all_portfolio',
+                              'print_all_portfolio_summary'}
+    assert scenarios['sync_accounts']['syncs'] == 2
+    assert scenarios['sync_accounts']['calls']['operations.get_portfolio'] == 2
+    # Начальная синхронизация и по одной на каждое событие
+    assert scenarios['mainflow_burst']['syncs'] == 3
+
+
+def test_changed_instruments():
+    """test_changed_instruments"""
+    assert changed_instruments(trigger_event('src', '1').position,
+                               'src') == {'1'}
+    # Без uid бумаг и для счёта назначения нужен полный план
+    assert changed_instruments(trigger_event('src').position, 'src') is None
+    assert changed_instruments(deposit_event('dst').position, 'src') is None
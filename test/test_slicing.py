@@ -0,0 +1,153 @@
+"""tests for slicing of large orders"""
+import logging
+from decimal import Decimal
+
+from test.conftest import buy_order
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.autorepeater import SyncFeatures
+from autorepeater.cancellation import SyncBudget
+from autorepeater.delta import DeltaPlans
+from autorepeater.execution import LimitOrderExecutor
+from autorepeater.execution import OrderExecution
+from autorepeater.simulation import SimAccount
+from autorepeater.simulation import SimInstrument
+from autorepeater.simulation import SimulatedClient
+from autorepeater.simulation import SimulatedMarket
+from autorepeater.slicing import SliceScheduler
+from autorepeater.slicing import child_size
+
+
+def test_child_size():
+    """test_child_size"""
+    assert child_size(50, Decimal('100'), 200) == 50
+    assert child_size(50, Decimal('100'), 200, max_notional=1000) == 10
+    assert child_size(50, Decimal('100'), 200, depth_share=0.1) == 20
+    assert child_size(50, Decimal('100'), 200, max_notional=1000,
+                      depth_share=0.01) == 2
+    # Хотя бы один лот, даже если лот дороже лимита
+    assert child_size(50, Decimal('100'), 200, max_notional=10) == 1
+
+
+def test_scheduler_params():
+    """test_scheduler_params"""
+    with pytest.raises(ValueError):
+        SliceScheduler(max_notional=0)
+    with pytest.raises(ValueError):
+        SliceScheduler(depth_share=1.5)
+    with pytest.raises(ValueError):
+        SliceScheduler(interval=-1)
+
+
+def test_execute_slices(market):
+    """test_execute_slices"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    scheduler = SliceScheduler(depth_share=0.1, interval=0)
+    # Стакан симуляции 20 уровней по 10 лотов, дочерние заявки по 20 лотов
+    scheduler.execute(autorepeater, 'dst',
+                      [buy_order('1', 50), buy_order('2', 5)])
+    scheduler.wait()
+    scheduler.close()
+    assert market.accounts['dst'].holdings == {'1': Decimal('50'),
+                                               '2': Decimal('50')}
+    lots = sorted(quantity for (_, _, instrument_id, quantity, _)
+                  in market.orders if instrument_id == '1')
+    assert lots == [10, 20, 20]
+    assert scheduler.pending('dst') == {}
+
+
+def test_execute_slices_limit(market):
+    """test_execute_slices_limit"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    scheduler = SliceScheduler(max_notional=250, interval=0,
+                               executor=LimitOrderExecutor(timeout=0))
+    scheduler.execute(autorepeater, 'dst', [buy_order('1', 60)])
+    scheduler.wait()
+    scheduler.close()
+    assert market.accounts['dst'].holdings == {'1': Decimal('60')}
+    assert len(market.orders) == 3
+
+
+def test_supersede(market):
+    """test_supersede"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    scheduler = SliceScheduler(max_notional=100, interval=60)
+    scheduler.execute(autorepeater, 'dst', [buy_order('1', 30)])
+    # Лот стоит 10.01 по первому уровню стакана, дочерние заявки по 9 лотов
+    # Первая дочерняя заявка выставляется сразу, остальные ждут паузы
+    while scheduler.pending('dst').get('1', 30) == 30:
+        pass
+    assert scheduler.pending('dst') == {'1': 21}
+    # Новый план без заявок отменяет ожидающие дочерние заявки
+    scheduler.execute(autorepeater, 'dst', [])
+    scheduler.wait()
+    scheduler.close()
+    assert scheduler.pending('dst') == {}
+    assert market.accounts['dst'].holdings == {'1': Decimal('9')}
+
+
+def test_child_sequence(market):
+    """test_child_sequence"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    scheduler = SliceScheduler(depth_share=0.1, interval=0)
+    scheduler.execute(autorepeater, 'dst', [buy_order('1', 50)])
+    scheduler.execute(autorepeater, 'dst', [buy_order('1', 50)])
+    scheduler.wait()
+    scheduler.close()
+    # Дочерние заявки не считаются заявками синхронизации и не повторяют id
+    assert not autorepeater.current.posted_orders
+    assert len(market.client_orders) == len(market.orders)
+
+
+def test_immediate_budget(market, caplog):
+    """test_immediate_budget"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    autorepeater.current.budget = SyncBudget(0)
+    scheduler = SliceScheduler(depth_share=0.1, interval=0)
+    # Заявка без нарезки не отправляется после дедлайна, нарезка не
+    # планируется
+    with caplog.at_level(logging.INFO):
+        assert not scheduler.execute(autorepeater, 'dst',
+                                     [buy_order('1', 50), buy_order('2', 5)])
+    scheduler.close()
+    assert not market.orders
+    assert scheduler.pending('dst') == {}
+    assert 'не отправлено заявок: 1' in caplog.text
+
+
+def test_child_error(market, caplog):
+    """test_child_error"""
+    autorepeater = AutoRepeater(SimulatedClient(market))
+    scheduler = SliceScheduler(depth_share=0.1, interval=0)
+
+    def post_order(*_):
+        raise ValueError('broken')
+    autorepeater.post_order = post_order
+    scheduler.execute(autorepeater, 'dst', [buy_order('1', 50)])
+    scheduler.wait()
+    scheduler.close()
+    assert 'дочерние заявки 1 остановлены' in caplog.text
+
+
+def test_delta_with_pending_slices():
+    """test_delta_with_pending_slices"""
+    market = SimulatedMarket(
+        [SimInstrument(uid=uid, name=f'share{uid}', ticker=f'SH{uid}',
+                       price=Decimal('100'), lot=1) for uid in '12'],
+        [SimAccount(account_id='src', name='src',
+                    holdings={'1': Decimal('10'), '2': Decimal('10')}),
+         SimAccount(account_id='dst', name='dst', cash=Decimal('100000'))])
+    scheduler = SliceScheduler(max_notional=1000, interval=60)
+    autorepeater = AutoRepeater(SimulatedClient(market), SyncFeatures(
+        orders=OrderExecution(executor=scheduler), delta=DeltaPlans(0.05)))
+    autorepeater.sync_accounts('src', 'dst')
+    assert set(scheduler.pending('dst')) == {'1', '2'}
+    # Пока есть дочерние заявки, событие по бумаге 1 строит полный план,
+    # иначе дочерние заявки бумаги 2 были бы отменены без замены
+    autorepeater.sync_accounts('src', 'dst', changed={'1'})
+    assert not autorepeater.current.plan.delta
+    assert autorepeater.metrics.plans.value(kind='full') == 2
+    assert set(scheduler.pending('dst')) == {'1', '2'}
+    scheduler.close()
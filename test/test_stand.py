@@ -0,0 +1,112 @@
+"""tests for local invest api stand"""
+import grpc
+import pytest
+
+from tinkoff.invest.grpc import common_pb2
+from tinkoff.invest.grpc import marketdata_pb2
+from tinkoff.invest.grpc import marketdata_pb2_grpc
+from tinkoff.invest.grpc import operations_pb2
+from tinkoff.invest.grpc import operations_pb2_grpc
+from tinkoff.invest.grpc import orders_pb2
+from tinkoff.invest.grpc import orders_pb2_grpc
+
+from autorepeater.simulation import deposit_event
+from autorepeater.simulation import trigger_event
+from autorepeater.stand import DROP
+from autorepeater.stand import ScenarioRunner
+from autorepeater.stand import StreamHub
+from autorepeater.stand import make_market
+from autorepeater.stand import make_server
+
+
+def test_stream_hub():
+    """test_stream_hub"""
+    hub = StreamHub()
+    subscriber = hub.subscribe(['src-0', 'dst-0'])
+    other = hub.subscribe(['src-1'])
+    hub.publish(trigger_event('src-0'))
+    hub.publish(deposit_event('dst-1'))
+    hub.drop()
+    assert subscriber[1].get_nowait().position.account_id == 'src-0'
+    assert subscriber[1].get_nowait() is DROP
+    assert other[1].get_nowait() is DROP
+    hub.unsubscribe(subscriber)
+    hub.unsubscribe(other)
+    assert not hub.subscribers
+
+
+def test_make_market():
+    """test_make_market"""
+    market = make_market(10, 3)
+    assert sorted(market.accounts) == ['dst-0', 'dst-1', 'dst-2',
+                                       'src-0', 'src-1', 'src-2']
+
+
+def test_scenario_steps():
+    """test_scenario_steps"""
+    market = make_market(10, 2)
+    hub = StreamHub()
+    subscriber = hub.subscribe(['src-0', 'src-1', 'dst-0', 'dst-1'])
+    scenario = ScenarioRunner(market, hub, [])
+    cash = market.accounts['dst-0'].cash
+
+    scenario.play({'step': 'rebalance', 'trades': 2})
+    assert subscriber[1].qsize() == 4
+    assert len(market.orders) == 4
+
+    scenario.play({'step': 'deposit', 'amount': '100'})
+    assert market.accounts['dst-0'].cash == cash + 100
+    assert subscriber[1].qsize() == 6
+
+    with pytest.raises(ValueError):
+        scenario.play({'step': 'unknown'})
+
+
+def test_stand_get_portfolio():
+    """test_stand_get_portfolio"""
+    market = make_market(5, 1)
+    server = make_server(market, StreamHub())
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    try:
+        with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+            stub = operations_pb2_grpc.OperationsServiceStub(channel)
+            response = stub.GetPortfolio(
+                operations_pb2.PortfolioRequest(account_id='src-0'))
+    finally:
+        server.stop(grace=None)
+    # Валюта и пять инструментов
+    assert len(response.positions) == 6
+
+
+def test_stand_limit_order():
+    """test_stand_limit_order"""
+    market = make_market(5, 1)
+    uid = next(iter(market.instruments))
+    server = make_server(market, StreamHub())
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    try:
+        with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+            order_book = marketdata_pb2_grpc.MarketDataServiceStub(
+                channel).GetOrderBook(marketdata_pb2.GetOrderBookRequest(
+                    instrument_id=uid, depth=5))
+            orders = orders_pb2_grpc.OrdersServiceStub(channel)
+            # Лимитная заявка ниже лучшей цены покупки не исполняется
+            bid = order_book.bids[-1].price
+            response = orders.PostOrder(orders_pb2.PostOrderRequest(
+                instrument_id=uid, quantity=1, account_id='dst-0',
+                direction=orders_pb2.ORDER_DIRECTION_BUY,
+                order_type=orders_pb2.ORDER_TYPE_LIMIT, order_id='limit',
+                price=common_pb2.Quotation(units=bid.units, nano=bid.nano)))
+            orders.CancelOrder(orders_pb2.CancelOrderRequest(
+                account_id='dst-0', order_id=response.order_id))
+            state = orders.GetOrderState(orders_pb2.GetOrderStateRequest(
+                account_id='dst-0', order_id=response.order_id))
+    finally:
+        server.stop(grace=None)
+    assert len(order_book.asks) == 5
+    assert (response.execution_report_status ==
+            orders_pb2.EXECUTION_REPORT_STATUS_NEW)
+    assert (state.execution_report_status ==
+            orders_pb2.EXECUTION_REPORT_STATUS_CANCELLED)
@@ -0,0 +1,111 @@
+"""tests for persisted sync state"""
+import dataclasses
+from decimal import Decimal
+
+from test.conftest import TestException
+
+from autorepeater.state import StateFile
+from autorepeater.state import SyncState
+from autorepeater.state import load_state
+from autorepeater.state import save_state
+
+
+def make_state():
+    """make_state - создаёт тестовое состояние"""
+    return SyncState(
+        src_account_id='4',
+        dst_account_id='5',
+        holdings={'1': '2.0'},
+        target_positions={'1': '1.99'},
+        ratio='0.995',
+        updated_at=1.0)
+
+
+def test_save_load_state(tmp_path):
+    """test_save_load_state"""
+    path = str(tmp_path / 'state.json')
+    save_state(path, make_state())
+    assert load_state(path) == make_state()
+    # Временных файлов не остаётся
+    assert [item.name for item in tmp_path.iterdir()] == ['state.json']
+
+
+def test_load_state_missing(tmp_path):
+    """test_load_state_missing"""
+    assert load_state(str(tmp_path / 'absent.json')) is None
+    assert load_state(None) is None
+
+
+def test_load_state_broken(tmp_path):
+    """test_load_state_broken"""
+    path = tmp_path / 'state.json'
+    path.write_text('{"src_account_id": "4"}', encoding='utf-8')
+    assert load_state(str(path)) is None
+    path.write_text('not json', encoding='utf-8')
+    assert load_state(str(path)) is None
+
+
+def test_load_state_without_dst(tmp_path):
+    """test_load_state_without_dst"""
+    path = tmp_path / 'state.json'
+    state = make_state()
+    save_state(str(path), state)
+    # Файл прежнего формата читается, но счёт назначения считается изменённым
+    path.write_text(path.read_text(encoding='utf-8').replace(
+        ',\n "dst": null', ''), encoding='utf-8')
+    assert load_state(str(path)) == state
+
+
+def test_sync_accounts_save_state(auto_repeater, tmp_path):
+    """test_sync_accounts_save_state"""
+    state_file = str(tmp_path / 'state.json')
+    state = StateFile(state_file)
+    auto_repeater.features.state = state
+    auto_repeater.sync_accounts('4', '5')
+    # Заявки выставлены, но не исполнены, состояние не сохраняется
+    assert load_state(state_file) is None
+
+    # Синхронизация ниже порога ничего не выставляет
+    auto_repeater.set_threshold(1)
+    auto_repeater.sync_accounts('4', '5')
+    saved = load_state(state_file)
+    assert saved.src_account_id == '4'
+    assert saved.dst_account_id == '5'
+    assert saved.holdings == {'1': '2.0'}
+    assert saved.dst['holdings'] is not None
+    assert saved.ratio == '0.995'
+
+    # Позиции источника не изменились
+    assert state.is_unchanged(auto_repeater, '4', '5') is True
+    # Состояние сохранено для другой пары счетов
+    assert state.is_unchanged(auto_repeater, '4', '1') is False
+    # Пока процесс стоял, счёт назначения пополнили
+    save_state(state_file, dataclasses.replace(saved, dst=dict(
+        saved.dst, total=str(Decimal(saved.dst['total']) * 3))))
+    assert state.is_unchanged(auto_repeater, '4', '5') is False
+
+
+def test_sync_accounts_debug_not_save_state(auto_repeater, tmp_path):
+    """test_sync_accounts_debug_not_save_state"""
+    state_file = str(tmp_path / 'state.json')
+    state = StateFile(state_file)
+    auto_repeater.features.state = state
+    auto_repeater.set_debug(True)
+    auto_repeater.sync_accounts('4', '5')
+    assert load_state(state_file) is None
+    assert state.is_unchanged(auto_repeater, '4', '5') is False
+
+
+def test_mainflow_skip_initial_sync(auto_repeater, tmp_path):
+    """test_mainflow_skip_initial_sync"""
+    auto_repeater.features.state = StateFile(str(tmp_path / 'state.json'))
+    auto_repeater.set_threshold(1)
+    auto_repeater.sync_accounts('4', '5')
+
+    def fail_sync(src_account_id, dst_account_id):
+        assert False, (src_account_id, dst_account_id)
+    auto_repeater.sync_accounts = fail_sync
+    try:
+        auto_repeater.mainflow('4', '5')
+    except TestException:
+        pass
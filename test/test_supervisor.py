@@ -0,0 +1,59 @@
+"""tests for supervisor of worker processes"""
+import os
+import time
+
+import pytest
+
+from autorepeater.metrics import Registry
+from autorepeater.metrics import registry_snapshot
+from autorepeater.supervisor import Supervisor
+from autorepeater.supervisor import shard_pairs
+
+
+def crashing_worker(index, pairs, metrics_queue, marker):
+    """worker reporting metrics and crashing on the first start"""
+    registry = Registry()
+    registry.counter('pairs', 'Pairs of worker').inc(len(pairs))
+    metrics_queue.put((index, [registry_snapshot(registry)]))
+    path = f'{marker}.{index}'
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8'):
+            pass
+        os._exit(1)  # pylint: disable=W0212
+    time.sleep(60)
+
+
+def test_shard_pairs():
+    """test_shard_pairs"""
+    pairs = [(f'src{index}', f'dst{index}') for index in range(5)]
+    assert shard_pairs(pairs, 2) == [pairs[0::2], pairs[1::2]]
+    assert shard_pairs(pairs[:1], 4) == [pairs[:1]]
+    with pytest.raises(ValueError):
+        shard_pairs(pairs, 0)
+
+
+def test_supervisor(tmp_path):
+    """test_supervisor"""
+    pairs = [('src1', 'dst1'), ('src2', 'dst2'), ('src3', 'dst3')]
+    refreshes = []
+    supervisor = Supervisor(crashing_worker, shard_pairs(pairs, 2),
+                            args=(str(tmp_path / 'crashed'),),
+                            restart_delay=0)
+    supervisor.set_refresh(lambda: refreshes.append(1), interval=0.01)
+    supervisor.start()
+    try:
+        deadline = time.monotonic() + 60
+        # Каждый воркер падает один раз, перезапускается и присылает метрики
+        while (supervisor.worker_restarts.value() < 2 or
+               'pairs_total 3.0' not in supervisor.registry.render()):
+            assert time.monotonic() < deadline
+            supervisor.poll()
+            time.sleep(0.05)
+        assert all(process.is_alive()
+                   for process in supervisor.workers.processes.values())
+    finally:
+        supervisor.stop()
+    assert supervisor.worker_restarts.value() == 2
+    assert refreshes
+    assert ('autorepeater_worker_restarts_total 2.0' in
+            supervisor.registry.render())
@@ -0,0 +1,179 @@
+"""tests for span tracing of syncs"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from autorepeater.autorepeater import AutoRepeater
+from autorepeater.metrics import SyncMetrics
+from autorepeater.simulation import SimulatedClient
+from autorepeater.tracing import NOOP_SPAN
+from autorepeater.tracing import STATUS_ERROR
+from autorepeater.tracing import Span
+from autorepeater.tracing import TraceExporter
+from autorepeater.tracing import Tracer
+from autorepeater.tracing import otlp_attributes
+
+
+class ListExporter:
+    """exporter keeping traces in list"""
+
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        """keep spans of trace"""
+        self.traces.append(spans)
+
+    def close(self):
+        """nothing to flush"""
+
+
+def test_tracer():
+    """test_tracer"""
+    exporter = ListExporter()
+    tracer = Tracer(exporter)
+    # Вне трассы спаны не записываются
+    with tracer.span('orphan') as span:
+        assert span is NOOP_SPAN
+    trigger_time = time.monotonic() - 0.5
+    with tracer.trace('sync', trigger_time, dst_account='dst') as root:
+        with tracer.span('portfolio_fetch', account='src') as span:
+            span.set_attributes(positions=3)
+        with pytest.raises(RuntimeError):
+            with tracer.span('post_order', lots=2):
+                raise RuntimeError('rejected')
+    assert isinstance(root, Span)
+    assert len(exporter.traces) == 1
+    spans = exporter.traces[0]
+    assert spans[0] is root
+    assert [span.name for span in spans] == [
+        'sync', 'portfolio_fetch', 'post_order']
+    contexts = [span.context for span in spans]
+    assert {context.trace_id for context in contexts} == {
+        contexts[0].trace_id}
+    assert [context.parent_id for context in contexts] == [
+        None, contexts[0].span_id, contexts[0].span_id]
+    # Корневой спан начинается от получения события
+    assert spans[0].duration() >= 0.5
+    assert spans[1].attributes == {'account': 'src', 'positions': 3}
+    assert spans[2].status[0] == STATUS_ERROR
+    with tracer.span('after') as span:
+        assert span is NOOP_SPAN
+
+
+def test_tracer_sampling():
+    """test_tracer_sampling"""
+    with pytest.raises(ValueError):
+        Tracer(ListExporter(), sample=2)
+    exporter = ListExporter()
+    tracer = Tracer(exporter, sample=0.1, slow=0.5, sampler=lambda: 0.5)
+    with tracer.trace('fast'):
+        pass
+    # Медленная трасса сохраняется независимо от доли
+    with tracer.trace('slow', time.monotonic() - 1.0):
+        pass
+    tracer = Tracer(exporter, sample=0.6, sampler=lambda: 0.5)
+    with tracer.trace('sampled'):
+        pass
+    assert [spans[0].name for spans in exporter.traces] == ['slow', 'sampled']
+
+
+def test_sync_metrics_trace():
+    """test_sync_metrics_trace"""
+    metrics = SyncMetrics()
+    with metrics.trace('sync') as root, metrics.stage('planning') as span:
+        assert root is NOOP_SPAN and span is NOOP_SPAN
+    exporter = ListExporter()
+    metrics.tracer = Tracer(exporter)
+    with metrics.trace('sync'):
+        with metrics.stage('planning', ratio=1.5):
+            pass
+    assert [span.name for span in exporter.traces[0]] == ['sync', 'planning']
+    assert metrics.stage_seconds.count(stage='planning') == 2
+
+
+def test_sync_metrics_bind():
+    """test_sync_metrics_bind"""
+    metrics = SyncMetrics()
+    exporter = ListExporter()
+    metrics.tracer = Tracer(exporter)
+
+    def resolve(instrument_id):
+        with metrics.stage('instrument_resolution',
+                           instrument_id=instrument_id) as span:
+            return span
+
+    with metrics.trace('sync'):
+        with metrics.stage('portfolio_fetch') as parent:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                spans = list(executor.map(metrics.bind(resolve), ['a', 'b']))
+    # Спаны потоков пула продолжают трассу родителя
+    assert all(isinstance(span, Span) for span in spans)
+    assert isinstance(parent, Span)
+    assert sorted(span.name for span in exporter.traces[0]) == [
+        'instrument_resolution', 'instrument_resolution', 'portfolio_fetch',
+        'sync']
+    assert {span.context.parent_id for span in spans} == {
+        exporter.traces[0][1].context.span_id}
+    # Вне трассы функция не меняется
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert list(executor.map(metrics.bind(resolve), ['c'])) == [NOOP_SPAN]
+
+
+def test_trace_exporter(tmp_path):
+    """test_trace_exporter"""
+    path = str(tmp_path / 'traces.jsonl')
+    tracer = Tracer(TraceExporter(path))
+    for _ in range(2):
+        with tracer.trace('sync', sync_id=1, ratio=0.5, debug=False):
+            with tracer.span('post_order', status='EXECUTION_REPORT_STATUS_FILL'):
+                pass
+    tracer.close()
+    with open(path, encoding='utf-8') as trace_file:
+        requests = [json.loads(line) for line in trace_file]
+    spans = [span for request in requests
+             for resource in request['resourceSpans']
+             for scope in resource['scopeSpans'] for span in scope['spans']]
+    assert len(spans) == 4
+    root = spans[0]
+    assert len(root['traceId']) == 32 and len(root['spanId']) == 16
+    assert 'parentSpanId' not in root
+    assert spans[1]['parentSpanId'] == root['spanId']
+    assert int(root['endTimeUnixNano']) >= int(root['startTimeUnixNano'])
+    assert root['attributes'] == [
+        {'key': 'sync_id', 'value': {'intValue': '1'}},
+        {'key': 'ratio', 'value': {'doubleValue': 0.5}},
+        {'key': 'debug', 'value': {'boolValue': False}}]
+
+
+def test_otlp_attributes():
+    """test_otlp_attributes"""
+    assert otlp_attributes({'uid': 'abc', 'price': None}) == [
+        {'key': 'uid', 'value': {'stringValue': 'abc'}}]
+
+
+def test_sync_accounts_trace(market, tmp_path):
+    """test_sync_accounts_trace"""
+    path = str(tmp_path / 'traces.jsonl')
+    autorepeater = AutoRepeater(SimulatedClient(market), metrics=SyncMetrics(
+        tracer=Tracer(TraceExporter(path))))
+    autorepeater.sync_accounts('src', 'dst', trigger_time=time.monotonic())
+    autorepeater.metrics.tracer.close()
+
+    with open(path, encoding='utf-8') as trace_file:
+        spans = [span for line in trace_file
+                 for span in json.loads(line)['resourceSpans'][0]
+                 ['scopeSpans'][0]['spans']]
+    names = [span['name'] for span in spans]
+    # Корневой спан синхронизации и вложенные этапы
+    assert names[0] == 'sync'
+    assert names.count('portfolio_fetch') == 2
+    assert 'planning' in names and 'instrument_resolution' in names
+    order = spans[names.index('post_order')]
+    attributes = {item['key']: item['value'] for item in order['attributes']}
+    assert attributes['account'] == {'stringValue': 'dst'}
+    assert attributes['lots'] == {'intValue': '99'}
+    assert 'status' in attributes
+    assert {span['traceId'] for span in spans} == {spans[0]['traceId']}